@@ -93,6 +93,8 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # File-backed test DB so concurrent sync threads get normal SQLite locking
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
     }
 }
 
@@ -152,9 +154,100 @@ CORS_ALLOW_CREDENTIALS = True
 # Elasticsearch settings
 ELASTICSEARCH_HOST = 'http://localhost:9200'
 
+# IMAP sync settings
+IMAP_SYNC_WINDOW_DAYS = int(os.getenv('IMAP_SYNC_WINDOW_DAYS', '30'))
+IMAP_FETCH_BATCH_SIZE = int(os.getenv('IMAP_FETCH_BATCH_SIZE', '200'))
+# 'headers' fetches headers + the text part only (attachments are skipped); 'full' downloads whole messages
+IMAP_SYNC_MODE = os.getenv('IMAP_SYNC_MODE', 'headers')
+IMAP_BODY_PREVIEW_BYTES = int(os.getenv('IMAP_BODY_PREVIEW_BYTES', '65536'))
+# Socket timeout when an API request downloads a full body on demand; the preview is served on failure
+IMAP_BODY_FETCH_TIMEOUT = float(os.getenv('IMAP_BODY_FETCH_TIMEOUT', '10'))
+# Concurrent multi-account sync (runimap / fetch_emails)
+IMAP_SYNC_WORKERS = int(os.getenv('IMAP_SYNC_WORKERS', '8'))
+IMAP_MAX_CONNECTIONS_PER_SERVER = int(os.getenv('IMAP_MAX_CONNECTIONS_PER_SERVER', '3'))
+IMAP_ACCOUNT_TIMEOUT = float(os.getenv('IMAP_ACCOUNT_TIMEOUT', '300'))
+IMAP_FOLDER_CONNECTIONS = int(os.getenv('IMAP_FOLDER_CONNECTIONS', '2'))
+# Streaming ingestion: emails are stored and checkpointed in batches bounded by count and size
+IMAP_INGEST_BATCH_SIZE = int(os.getenv('IMAP_INGEST_BATCH_SIZE', '50'))
+IMAP_INGEST_MAX_BATCH_BYTES = int(os.getenv('IMAP_INGEST_MAX_BATCH_BYTES', str(8 * 1024 * 1024)))
+# MIME parsing: worker processes (0 = parse inline) and the smallest batch worth sending to them
+IMAP_PARSE_WORKERS = int(os.getenv('IMAP_PARSE_WORKERS', str(max(0, (os.cpu_count() or 1) - 1))))
+IMAP_PARSE_POOL_MIN_BATCH = int(os.getenv('IMAP_PARSE_POOL_MIN_BATCH', '32'))
+# Ingestion pipeline: worker threads per stage and batches queued between stages
+INGEST_CATEGORIZE_WORKERS = int(os.getenv('INGEST_CATEGORIZE_WORKERS', '4'))
+INGEST_PERSIST_WORKERS = int(os.getenv('INGEST_PERSIST_WORKERS', '1'))
+INGEST_INDEX_WORKERS = int(os.getenv('INGEST_INDEX_WORKERS', '1'))
+INGEST_NOTIFY_WORKERS = int(os.getenv('INGEST_NOTIFY_WORKERS', '1'))
+INGEST_QUEUE_SIZE = int(os.getenv('INGEST_QUEUE_SIZE', '4'))
+# IDLE supervisor: servers drop IDLE after 29 minutes, so renew well before that
+IMAP_IDLE_RENEW_SECONDS = float(os.getenv('IMAP_IDLE_RENEW_SECONDS', '1500'))
+IMAP_RECONNECT_BACKOFF_BASE = float(os.getenv('IMAP_RECONNECT_BACKOFF_BASE', '1'))
+IMAP_RECONNECT_BACKOFF_MAX = float(os.getenv('IMAP_RECONNECT_BACKOFF_MAX', '300'))
+
 # OpenAI settings
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY', '')
 OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL', 'https://api.openai.com/v1')
+OPENAI_MODEL = os.getenv('OPENAI_MODEL', 'gpt-3.5-turbo')
+# LLM client: concurrent requests, provider rate limits (0 = unlimited), retries and circuit breaker
+OPENAI_TIMEOUT = float(os.getenv('OPENAI_TIMEOUT', '60'))
+OPENAI_MAX_IN_FLIGHT = int(os.getenv('OPENAI_MAX_IN_FLIGHT', '8'))
+OPENAI_REQUESTS_PER_MINUTE = int(os.getenv('OPENAI_REQUESTS_PER_MINUTE', '500'))
+OPENAI_TOKENS_PER_MINUTE = int(os.getenv('OPENAI_TOKENS_PER_MINUTE', '200000'))
+OPENAI_MAX_RETRIES = int(os.getenv('OPENAI_MAX_RETRIES', '4'))
+OPENAI_RETRY_BASE_DELAY = float(os.getenv('OPENAI_RETRY_BASE_DELAY', '0.5'))
+OPENAI_RETRY_MAX_DELAY = float(os.getenv('OPENAI_RETRY_MAX_DELAY', '30'))
+OPENAI_BREAKER_FAILURES = int(os.getenv('OPENAI_BREAKER_FAILURES', '5'))
+OPENAI_BREAKER_RESET_SECONDS = float(os.getenv('OPENAI_BREAKER_RESET_SECONDS', '60'))
+# Batched categorization: emails per request, prompt token budget, body characters sent per email
+OPENAI_CATEGORIZE_BATCH_SIZE = int(os.getenv('OPENAI_CATEGORIZE_BATCH_SIZE', '20'))
+OPENAI_CATEGORIZE_BATCH_TOKENS = int(os.getenv('OPENAI_CATEGORIZE_BATCH_TOKENS', '6000'))
+OPENAI_CATEGORIZE_BODY_CHARS = int(os.getenv('OPENAI_CATEGORIZE_BODY_CHARS', '2000'))
+OPENAI_CATEGORIZE_RETRIES = int(os.getenv('OPENAI_CATEGORIZE_RETRIES', '2'))
+# Prompt text reduction: quoted history, signatures, legal footers and long URLs are stripped,
+# then email text is cut to a token limit per task (counted with tiktoken when installed)
+PROMPT_REDUCTION_ENABLED = os.getenv('PROMPT_REDUCTION_ENABLED', 'True') == 'True'
+PROMPT_TOKENS_CATEGORIZE = int(os.getenv('PROMPT_TOKENS_CATEGORIZE', '400'))
+PROMPT_TOKENS_REPLY = int(os.getenv('PROMPT_TOKENS_REPLY', '1500'))
+PROMPT_TOKENS_CONTEXT = int(os.getenv('PROMPT_TOKENS_CONTEXT', '300'))
+PROMPT_URL_MAX_CHARS = int(os.getenv('PROMPT_URL_MAX_CHARS', '60'))
+# Categorization cache: in-process LRU size, table size and entry lifetime
+CATEGORY_CACHE_ENABLED = os.getenv('CATEGORY_CACHE_ENABLED', 'True') == 'True'
+CATEGORY_CACHE_LRU_SIZE = int(os.getenv('CATEGORY_CACHE_LRU_SIZE', '10000'))
+CATEGORY_CACHE_MAX_ENTRIES = int(os.getenv('CATEGORY_CACHE_MAX_ENTRIES', '100000'))
+CATEGORY_CACHE_MAX_AGE_DAYS = int(os.getenv('CATEGORY_CACHE_MAX_AGE_DAYS', '30'))
+# JSON rules for the offline keyword categorizer (defaults to the built-in rules)
+FALLBACK_RULES_PATH = os.getenv('FALLBACK_RULES_PATH', '')
+# Request coalescing: identical concurrent LLM/embedding calls share one result, remembered this long
+SINGLEFLIGHT_TTL_SECONDS = float(os.getenv('SINGLEFLIGHT_TTL_SECONDS', '30'))
+SINGLEFLIGHT_MAX_ENTRIES = int(os.getenv('SINGLEFLIGHT_MAX_ENTRIES', '1024'))
+# Reply drafting (draft_replies): threads drafting in the background, how far back to look, poll interval
+REPLY_DRAFT_WORKERS = int(os.getenv('REPLY_DRAFT_WORKERS', '2'))
+REPLY_DRAFT_MAX_AGE_DAYS = int(os.getenv('REPLY_DRAFT_MAX_AGE_DAYS', '14'))
+REPLY_DRAFT_POLL_SECONDS = float(os.getenv('REPLY_DRAFT_POLL_SECONDS', '30'))
+# Embedding model, loaded once per process; EMBEDDING_WARMUP loads it at server startup
+EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL', 'sentence-transformers/all-MiniLM-L6-v2')
+EMBEDDING_DEVICE = os.getenv('EMBEDDING_DEVICE', '')  # '' picks cuda when available
+EMBEDDING_WARMUP = os.getenv('EMBEDDING_WARMUP', 'False') == 'True'
+EMBEDDING_BATCH_SIZE = int(os.getenv('EMBEDDING_BATCH_SIZE', '32'))
+EMBEDDING_THREADS = int(os.getenv('EMBEDDING_THREADS', '0'))  # 0 keeps torch's default (all cores)
+# Vector store for RAG: memory-mapped float32 vectors plus a JSON-lines sidecar
+VECTOR_DB_PATH = os.getenv('VECTOR_DB_PATH', str(BASE_DIR / 'data' / 'vector_db'))
+# Share of deleted (replaced or removed) rows at which indexing compacts the vector store
+VECTOR_COMPACT_DELETED_RATIO = float(os.getenv('VECTOR_COMPACT_DELETED_RATIO', '0.2'))
+# Similarity search index kept next to the vectors: 'hnsw' or 'ivf' (FAISS, approximate) or 'brute' (exact scan)
+VECTOR_INDEX = os.getenv('VECTOR_INDEX', 'hnsw')
+VECTOR_INDEX_SAVE_EVERY = int(os.getenv('VECTOR_INDEX_SAVE_EVERY', '1000'))  # rows added between index file rewrites
+# Missing rows a query adds to the index itself; further behind, it is built in the background meanwhile
+VECTOR_INDEX_MAX_QUERY_ROWS = int(os.getenv('VECTOR_INDEX_MAX_QUERY_ROWS', '1000'))
+VECTOR_INDEX_HNSW_M = int(os.getenv('VECTOR_INDEX_HNSW_M', '32'))
+VECTOR_INDEX_HNSW_EF_CONSTRUCTION = int(os.getenv('VECTOR_INDEX_HNSW_EF_CONSTRUCTION', '80'))
+VECTOR_INDEX_HNSW_EF_SEARCH = int(os.getenv('VECTOR_INDEX_HNSW_EF_SEARCH', '64'))
+VECTOR_INDEX_IVF_NLIST = int(os.getenv('VECTOR_INDEX_IVF_NLIST', '1024'))
+VECTOR_INDEX_IVF_NPROBE = int(os.getenv('VECTOR_INDEX_IVF_NPROBE', '16'))
+# Local category head (train_category_head): emails it is not confident about go to the LLM
+LOCAL_CLASSIFIER_ENABLED = os.getenv('LOCAL_CLASSIFIER_ENABLED', 'True') == 'True'
+LOCAL_CLASSIFIER_PATH = os.getenv('LOCAL_CLASSIFIER_PATH', str(BASE_DIR / 'data' / 'category_head.npz'))
+LOCAL_CLASSIFIER_TARGET_ACCURACY = float(os.getenv('LOCAL_CLASSIFIER_TARGET_ACCURACY', '0.95'))
 
 # Slack settings
 SLACK_BOT_TOKEN = os.getenv('SLACK_BOT_TOKEN')
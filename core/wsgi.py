@@ -3,4 +3,11 @@ from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
 
-application = get_wsgi_application() 
\ No newline at end of file
+application = get_wsgi_application() 
+
+from django.conf import settings
+
+if settings.EMBEDDING_WARMUP:
+    from emails.services.embedding_runtime import start_warmup
+
+    start_warmup()
@@ -15,6 +15,10 @@ class EmailAccountAdmin(admin.ModelAdmin):
         (None, {
             'fields': ('email', 'password', 'imap_server', 'imap_port', 'use_ssl')
         }),
+        ('Folders', {
+            'fields': ('folder_include', 'folder_exclude'),
+            'description': 'Comma-separated folder patterns, e.g. "INBOX, [Gmail]/Sent Mail, Clients/*".'
+        }),
         ('Status', {
             'fields': ('is_active', 'last_sync')
         }),
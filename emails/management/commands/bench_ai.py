@@ -0,0 +1,157 @@
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.utils import timezone
+from emails.models import Email, EmailAccount
+from emails.services.ai_service import AIService
+from emails.services.llm_client import LLMClient
+from emails.services.rag_service import RAGService
+from emails.testing.corpus import synthetic_emails
+from emails.testing.fake_llm import FakeLLMServer
+import numpy as np
+import time
+import uuid
+
+class Command(BaseCommand):
+    help = 'Replay synthetic emails through categorization and RAG reply generation and report latency percentiles'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--emails', type=int, default=400, help='Number of synthetic emails')
+        parser.add_argument('--replies', type=int, default=50, help='Reply suggestions to generate')
+        parser.add_argument('--batch-size', type=int, default=20, help='Emails per categorize_batch call (one ingest batch)')
+        parser.add_argument('--concurrency', type=int, default=8, help='Calls made at once')
+        parser.add_argument('--max-in-flight', type=int, help='LLM client concurrency limit')
+        parser.add_argument('--unlimited', action='store_true', help='Disable the client request/token rate limits')
+        parser.add_argument('--base-url', help='Benchmark an already running server instead of a local fake')
+        parser.add_argument('--latency', type=float, default=0.3, help='Fake server: seconds before the first token')
+        parser.add_argument('--jitter', type=float, default=0.2, help='Fake server: mean extra delay (exponential tail)')
+        parser.add_argument('--token-latency', type=float, default=0.005, help='Fake server: seconds per token')
+        parser.add_argument('--error-rate', type=float, default=0.0, help='Fake server: share of 500 answers')
+        parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='Fake server: share of 429 answers')
+        parser.add_argument('--seed', type=int, default=0, help='Corpus random seed')
+
+    def handle(self, *args, **options):
+        server = None
+        base_url = options['base_url']
+        if not base_url:
+            server = FakeLLMServer(
+                latency=options['latency'],
+                jitter=options['jitter'],
+                token_latency=options['token_latency'],
+                error_rate=options['error_rate'],
+                rate_limit_rate=options['rate_limit_rate'],
+                seed=options['seed'],
+            ).start()
+            base_url = server.base_url
+
+        limits = {'requests_per_minute': 0, 'tokens_per_minute': 0} if options['unlimited'] else {}
+        client = LLMClient(api_key='bench', base_url=base_url, max_in_flight=options['max_in_flight'], **limits)
+        # No category cache: every email should cost a real request
+        service = AIService(client=client)
+        service.category_cache = None
+
+        corpus = list(synthetic_emails(options['emails'], seed=options['seed']))
+        try:
+            self.bench_categorize(service, corpus, options)
+            self.bench_replies(service, corpus[:options['replies']], options)
+        finally:
+            client.close()
+            if server:
+                server.stop()
+                self.stdout.write(
+                    f"Fake server: {dict(server.counts)}, peak {server.peak_active} requests in flight"
+                )
+
+    def bench_categorize(self, service, corpus, options):
+        size = options['batch_size']
+        batches = [corpus[i:i + size] for i in range(0, len(corpus), size)]
+
+        def run(batch):
+            start = time.perf_counter()
+            categories = service.categorize_batch(batch)
+            return time.perf_counter() - start, categories
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(options['concurrency']) as pool:
+            results = list(pool.map(run, batches))
+        elapsed = time.perf_counter() - start
+
+        predicted = [category for _, categories in results for category in categories]
+        correct = sum(1 for p, email in zip(predicted, corpus) if p == email['category'])
+        self.report(
+            f'categorize ({size}/call)', [latency for latency, _ in results], elapsed,
+            f"{len(corpus) / elapsed:,.1f} emails/s, accuracy {correct / len(corpus):.1%}",
+        )
+
+    def bench_replies(self, service, corpus, options):
+        """Time the RAG reply path the views use, on throwaway emails saved for the run."""
+        account = EmailAccount.objects.create(
+            email=f'bench-{uuid.uuid4().hex[:12]}@example.invalid',
+            password='bench',
+            imap_server='imap.example.invalid',
+        )
+        try:
+            emails = Email.objects.bulk_create([
+                Email(
+                    account=account,
+                    message_id=f'<bench-{account.pk}-{index}@example.invalid>',
+                    subject=e['subject'],
+                    sender=e['sender'],
+                    recipient=account.email,
+                    body=e['body'],
+                    folder='INBOX',
+                    received_date=timezone.now(),
+                    category=e['category'],
+                )
+                for index, e in enumerate(corpus)
+            ])
+            rag_service = RAGService()
+            rag_service.ai_service = service
+            self.stdout.write(f"Retrieving context from {rag_service.vector_db.store.count} indexed emails")
+            # Load the embedding model before timing so the first call does not pay for it
+            rag_service._reply_prompt(emails[0])
+            self.time_replies(rag_service, emails, options)
+        finally:
+            account.delete()
+
+    def time_replies(self, rag_service, emails, options):
+        def complete(email):
+            start = time.perf_counter()
+            rag_service.generate_reply_suggestion(email.id)
+            return time.perf_counter() - start
+
+        def stream(email):
+            start = time.perf_counter()
+            first = None
+            for _ in rag_service.stream_reply_suggestion(email):
+                if first is None:
+                    first = time.perf_counter() - start
+            return first, time.perf_counter() - start
+
+        def in_thread(call):
+            def run(email):
+                try:
+                    return call(email)
+                finally:
+                    connections.close_all()
+            return run
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(options['concurrency']) as pool:
+            latencies = list(pool.map(in_thread(complete), emails))
+        elapsed = time.perf_counter() - start
+        self.report('reply suggestion', latencies, elapsed, f'{len(emails) / elapsed:,.1f} replies/s')
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(options['concurrency']) as pool:
+            timings = list(pool.map(in_thread(stream), emails))
+        elapsed = time.perf_counter() - start
+        self.report('stream first token', [first for first, _ in timings if first is not None], elapsed, '')
+        self.report('stream complete', [total for _, total in timings], elapsed, f'{len(emails) / elapsed:,.1f} replies/s')
+
+    def report(self, name, latencies, elapsed, extra):
+        p50, p95, p99 = np.percentile(np.asarray(latencies) * 1000, [50, 95, 99])
+        self.stdout.write(self.style.SUCCESS(
+            f"{name:>22}: p50 {p50:7.1f} ms  p95 {p95:7.1f} ms  p99 {p99:7.1f} ms  "
+            f"({len(latencies)} calls in {elapsed:.2f}s) {extra}"
+        ))
@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+from emails.services.embedding_runtime import EmbeddingRuntime
+from emails.testing.corpus import synthetic_emails
+import numpy as np
+import time
+import torch
+
+class Command(BaseCommand):
+    help = 'Measure embedding throughput (texts/s) one text at a time and in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--texts', type=int, default=512, help='Number of synthetic emails to embed')
+        parser.add_argument('--batch-sizes', default='8,32,64', help='Comma separated batch sizes to try')
+        parser.add_argument('--threads', type=int, help='torch threads (defaults to EMBEDDING_THREADS)')
+        parser.add_argument('--model', help='Model to load (defaults to EMBEDDING_MODEL)')
+        parser.add_argument('--device', help='Device to run on (defaults to EMBEDDING_DEVICE)')
+        parser.add_argument('--seed', type=int, default=0, help='Corpus random seed')
+
+    def handle(self, *args, **options):
+        runtime = EmbeddingRuntime(options['model'], options['device'], threads=options['threads'])
+        if not runtime.warmup():
+            self.stdout.write(self.style.ERROR(f"Could not load {runtime.model_name}: {runtime.error}"))
+            return
+        self.stdout.write(
+            f"{runtime.model_name} on {runtime.device} with {torch.get_num_threads()} threads "
+            f"(loaded in {runtime.load_seconds:.1f}s)"
+        )
+
+        texts = [
+            f"Subject: {email['subject']}\n\nBody: {email['body']}"
+            for email in synthetic_emails(options['texts'], seed=options['seed'])
+        ]
+
+        start = time.perf_counter()
+        single = np.asarray([runtime.embed(text) for text in texts], dtype=np.float32)
+        baseline = len(texts) / (time.perf_counter() - start)
+        self.stdout.write(f"  one at a time: {baseline:,.1f} texts/s")
+
+        for batch_size in [int(size) for size in options['batch_sizes'].split(',') if size.strip()]:
+            start = time.perf_counter()
+            batched = runtime.embed_batch(texts, batch_size)
+            rate = len(texts) / (time.perf_counter() - start)
+            drift = float(np.abs(batched - single).max()) if len(texts) else 0.0
+            self.stdout.write(
+                f"  batch {batch_size:>4}: {rate:,.1f} texts/s ({rate / baseline:.1f}x), "
+                f"max difference {drift:.1e}"
+            )
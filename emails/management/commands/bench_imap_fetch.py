@@ -0,0 +1,62 @@
+from django.core.management.base import BaseCommand
+from emails.models import EmailAccount
+from emails.services.imap_service import IMAPService
+from emails.services.mime_parser import parse_message
+from emails.testing.fake_imap import FakeIMAPServer, make_message
+import time
+
+class Command(BaseCommand):
+    help = 'Benchmark IMAP fetch throughput for different FETCH batch sizes against a local fake server'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=2000, help='Number of messages in the fake mailbox')
+        parser.add_argument('--body-size', type=int, default=2048, help='Approximate body size in bytes')
+        parser.add_argument('--latency', type=float, default=0.005, help='Simulated round-trip time per command in seconds')
+        parser.add_argument('--batch-sizes', default='1,50,200', help='Comma-separated FETCH batch sizes to compare')
+
+    def handle(self, *args, **options):
+        batch_sizes = [int(size) for size in options['batch_sizes'].split(',')]
+        filler = 'x' * options['body_size']
+
+        with FakeIMAPServer(latency=options['latency']) as server:
+            inbox = server.mailbox('INBOX')
+            for i in range(options['messages']):
+                inbox.append(make_message(i, body=filler))
+
+            # Unsaved account: the fetch engine itself never touches the database
+            account = EmailAccount(
+                email='bench@example.com',
+                password='bench',
+                imap_server=server.host,
+                imap_port=server.port,
+                use_ssl=False,
+            )
+
+            self.stdout.write(
+                f"{options['messages']} messages, ~{options['body_size']} B bodies, "
+                f"{options['latency'] * 1000:.1f} ms simulated RTT"
+            )
+            for batch_size in batch_sizes:
+                imap_service = IMAPService(account)
+                imap_service.connect()
+                imap_service.select_folder('INBOX')
+                uids = imap_service.search_uids('ALL')
+
+                fetches_before = server.command_counts['UID FETCH']
+                received = 0
+                total_bytes = 0
+                start = time.perf_counter()
+                for message in imap_service.iter_messages(uids, batch_size=batch_size):
+                    raw = message.get('BODY[]') or b''
+                    parse_message(raw)
+                    received += 1
+                    total_bytes += len(raw)
+                elapsed = time.perf_counter() - start
+                imap_service.disconnect()
+
+                round_trips = server.command_counts['UID FETCH'] - fetches_before
+                self.stdout.write(self.style.SUCCESS(
+                    f"batch={batch_size:>5}: {received} msgs in {elapsed:.2f}s "
+                    f"({received / elapsed:.0f} msg/s, {total_bytes / elapsed / 1e6:.2f} MB/s, "
+                    f"{round_trips} FETCH round trips)"
+                ))
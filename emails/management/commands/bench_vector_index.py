@@ -0,0 +1,78 @@
+from django.core.management.base import BaseCommand
+from emails.services.vector_index import BACKENDS, VectorIndex
+from emails.services.vector_store import VectorStore
+import numpy as np
+import tempfile
+import time
+
+class Command(BaseCommand):
+    help = 'Compare similarity search backends against exact search: build time, query latency and recall'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--vectors', type=int, default=100000, help='Synthetic vectors to generate')
+        parser.add_argument('--dim', type=int, default=384, help='Synthetic vector dimension')
+        parser.add_argument('--clusters', type=int, default=500, help='Topics the synthetic vectors gather around')
+        parser.add_argument('--path', help='Benchmark an existing vector store instead of synthetic vectors')
+        parser.add_argument('--kinds', default=','.join(BACKENDS), help='Comma separated backends to compare')
+        parser.add_argument('--queries', type=int, default=200, help='Queries to run per backend')
+        parser.add_argument('--top-k', type=int, default=10, help='Neighbours returned per query')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed')
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(options['seed'])
+        with tempfile.TemporaryDirectory() as tmp:
+            if options['path']:
+                store = VectorStore(options['path'])
+            else:
+                store = VectorStore(tmp)
+                self.stdout.write(f"Generating {options['vectors']:,} vectors of dimension {options['dim']}...")
+                self.generate(store, rng, options)
+            if not store.count:
+                self.stdout.write(self.style.WARNING('The vector store is empty.'))
+                return
+
+            # Queries are stored vectors with noise, like a new email on a known topic
+            vectors = store.vectors()
+            picks = rng.choice(store.count, options['queries'])
+            queries = vectors[picks] + rng.normal(0, 0.05, (options['queries'], store.dim)).astype(np.float32)
+
+            k = options['top_k']
+            exact = VectorIndex(tmp, 'brute')
+            exact.sync(store)
+            truth = [set(exact.search(store, query, k)[1].tolist()) for query in queries]
+
+            self.stdout.write(f"{store.count:,} vectors, {len(queries)} queries, top {k}")
+            for kind in options['kinds'].split(','):
+                kind = kind.strip()
+                # A fresh directory so nothing is loaded from a saved index
+                with tempfile.TemporaryDirectory() as index_dir:
+                    self.bench(VectorIndex(index_dir, kind), store, queries, truth, k)
+
+    def generate(self, store, rng, options):
+        centers = rng.normal(0, 1, (options['clusters'], options['dim'])).astype(np.float32)
+        chunk = 50000
+        for start in range(0, options['vectors'], chunk):
+            size = min(chunk, options['vectors'] - start)
+            topics = rng.integers(0, options['clusters'], size)
+            vectors = centers[topics] + rng.normal(0, 0.6, (size, options['dim'])).astype(np.float32)
+            store.append(vectors, [{'text': '', 'metadata': {'row': start + i}} for i in range(size)])
+
+    def bench(self, index, store, queries, truth, k):
+        start = time.perf_counter()
+        index.sync(store)
+        build = time.perf_counter() - start
+        index.search(store, queries[0], k)  # first query pays for any lazy setup
+
+        latencies, hits = [], 0
+        for query, expected in zip(queries, truth):
+            start = time.perf_counter()
+            _, rows = index.search(store, query, k)
+            latencies.append(time.perf_counter() - start)
+            hits += len(expected & set(rows.tolist()))
+
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+        label = index.kind if index.kind == index.backend.kind else f'{index.kind} (fell back to {index.backend.kind})'
+        self.stdout.write(
+            f"  {label:<6} build {build:6.1f}s  p50 {p50:7.2f} ms  p95 {p95:7.2f} ms  p99 {p99:7.2f} ms  "
+            f"recall@{k} {hits / sum(len(expected) for expected in truth):.3f}"
+        )
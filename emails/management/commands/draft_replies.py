@@ -0,0 +1,39 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from emails.services.reply_drafter import ReplyDrafter
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Drafts reply suggestions in the background for interested and meeting_booked emails, newest first'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Draft what is pending now, then exit')
+        parser.add_argument('--workers', type=int, help='Replies drafted concurrently')
+        parser.add_argument('--poll', type=float, help='Seconds between checks for new emails')
+        parser.add_argument('--max-age-days', type=int, help='Skip emails received longer ago than this')
+
+    def handle(self, *args, **options):
+        poll = options['poll'] or settings.REPLY_DRAFT_POLL_SECONDS
+        drafter = ReplyDrafter(workers=options['workers'], max_age_days=options['max_age_days'])
+        self.stdout.write(f'Drafting replies with {drafter.workers} workers...')
+
+        with drafter:
+            try:
+                while True:
+                    added = drafter.enqueue_pending()
+                    if added:
+                        logger.info(f"Queued {added} emails for reply drafting")
+                    if options['once']:
+                        drafter.join()
+                        break
+                    time.sleep(poll)
+            except KeyboardInterrupt:
+                pass
+
+        stats = drafter.stats()
+        self.stdout.write(self.style.SUCCESS(
+            f"Drafted {stats['drafted']} replies ({stats['failed']} failed, {stats['skipped']} skipped)"
+        ))
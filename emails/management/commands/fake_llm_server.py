@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from emails.testing.fake_llm import FakeLLMServer
+
+class Command(BaseCommand):
+    help = 'Run a local OpenAI-compatible stand-in server; point OPENAI_BASE_URL at it'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8001)
+        parser.add_argument('--latency', type=float, default=0.3, help='Seconds before the first token')
+        parser.add_argument('--jitter', type=float, default=0.2, help='Mean extra delay in seconds (exponential tail)')
+        parser.add_argument('--token-latency', type=float, default=0.01, help='Seconds per generated token')
+        parser.add_argument('--error-rate', type=float, default=0.0, help='Share of requests answered with 500')
+        parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='Share of requests answered with 429')
+        parser.add_argument('--max-concurrent', type=int, default=0, help='Answer 429 above this many requests in flight')
+
+    def handle(self, *args, **options):
+        server = FakeLLMServer(
+            host=options['host'],
+            port=options['port'],
+            latency=options['latency'],
+            jitter=options['jitter'],
+            token_latency=options['token_latency'],
+            error_rate=options['error_rate'],
+            rate_limit_rate=options['rate_limit_rate'],
+            max_concurrent=options['max_concurrent'],
+        )
+        self.stdout.write(self.style.SUCCESS(f'Fake LLM listening; set OPENAI_BASE_URL={server.base_url}'))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.stop()
+        self.stdout.write(f'Served {dict(server.counts)}')
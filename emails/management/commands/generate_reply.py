@@ -22,7 +22,7 @@ class Command(BaseCommand):
         self.stdout.write(f'Generating reply suggestion for email: {email.subject}')
         
         # Check if we already have a reply suggestion
-        if email.reply_suggestion:
+        if email.has_current_reply_suggestion():
             self.stdout.write(self.style.WARNING('Email already has a reply suggestion:'))
             self.stdout.write(self.style.SUCCESS(email.reply_suggestion))
             return
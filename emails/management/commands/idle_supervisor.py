@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from emails.services.idle_service import IdleSupervisor
+from emails.services.pipeline import IngestPipeline
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Keeps a persistent IMAP IDLE connection per active account and ingests new emails as they arrive'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--refresh', type=float, default=60, help='Seconds between account list refreshes')
+
+    def handle(self, *args, **options):
+        self.stdout.write('Starting IDLE supervisor...')
+
+        stop_event = threading.Event()
+        with IngestPipeline() as pipeline:
+            supervisor = IdleSupervisor(pipeline.submit, refresh_seconds=options['refresh'])
+            try:
+                supervisor.run(stop_event)
+            except KeyboardInterrupt:
+                # run() shuts the workers down on its way out
+                pass
+
+        self.stdout.write(self.style.SUCCESS('IDLE supervisor stopped'))
@@ -5,16 +5,23 @@ from emails.services.rag_service import RAGService
 logger = logging.getLogger(__name__)
 
 class Command(BaseCommand):
-    help = 'Index all emails in the vector database for RAG-based suggestions'
+    help = 'Index new and changed emails in the vector database for RAG-based suggestions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--compact', action='store_true', help='Drop replaced and deleted vectors even below the usual threshold')
 
     def handle(self, *args, **options):
         self.stdout.write(self.style.SUCCESS('Starting email indexing process...'))
         
         try:
             rag_service = RAGService()
-            indexed_count = rag_service.index_all_emails()
+            indexed_count = rag_service.index_all_emails(compact=options['compact'])
+            stats = rag_service.last_index_stats
             
-            self.stdout.write(self.style.SUCCESS(f'Successfully indexed {indexed_count} emails'))
+            self.stdout.write(self.style.SUCCESS(
+                f'Successfully indexed {indexed_count} emails '
+                f'({stats["unchanged"]} unchanged, {stats["deleted"]} deleted, {stats["compacted"]} vectors compacted away)'
+            ))
         except Exception as e:
             logger.error(f"Error during email indexing: {e}")
-            self.stdout.write(self.style.ERROR(f'Error during email indexing: {str(e)}')) 
\ No newline at end of file
+            self.stdout.write(self.style.ERROR(f'Error during email indexing: {str(e)}'))
@@ -0,0 +1,63 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from emails.services.vector_db_service import LEGACY_VECTORS_FILE, content_hash
+from emails.services.vector_store import VectorStore
+from pathlib import Path
+import json
+import numpy as np
+
+class Command(BaseCommand):
+    help = 'Move embeddings from the old vectors.json file into the memory-mapped vector store'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--source', help='JSON file to migrate (defaults to vectors.json in VECTOR_DB_PATH)')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Documents written per append')
+        parser.add_argument('--keep', action='store_true', help='Leave the JSON file in place afterwards')
+        parser.add_argument('--force', action='store_true', help='Append even if the store already has vectors')
+
+    def handle(self, *args, **options):
+        store_path = Path(settings.VECTOR_DB_PATH)
+        source = Path(options['source']) if options['source'] else store_path / LEGACY_VECTORS_FILE
+        if not source.exists():
+            raise CommandError(f'{source} does not exist')
+
+        store = VectorStore(store_path)
+        if store.count and not options['force']:
+            raise CommandError(
+                f'The vector store in {store_path} already has {store.count} vectors; use --force to append anyway'
+            )
+
+        with open(source, 'r') as f:
+            documents = json.load(f)
+        self.stdout.write(f'Migrating {len(documents)} documents from {source}...')
+
+        migrated = skipped = 0
+        dim = store.dim
+        size = max(1, options['chunk_size'])
+        for start in range(0, len(documents), size):
+            vectors, records, keys, hashes = [], [], [], []
+            for doc in documents[start:start + size]:
+                embedding = doc.get('embedding')
+                if not embedding or (dim and len(embedding) != dim):
+                    skipped += 1
+                    continue
+                dim = dim or len(embedding)
+                text, metadata = doc.get('text', ''), doc.get('metadata') or {}
+                vectors.append(embedding)
+                records.append({'text': text, 'metadata': metadata})
+                # Keyed like index_all_emails does, so it reuses these vectors instead of re-embedding
+                key = metadata.get('email_id')
+                keyed = isinstance(key, int) and not isinstance(key, bool) and key > 0
+                keys.append(key if keyed else 0)
+                hashes.append(content_hash(text, metadata) if keyed else 0)
+            if records:
+                store.append(np.asarray(vectors, dtype=np.float32), records, keys=keys, hashes=hashes)
+                migrated += len(records)
+
+        if not options['keep']:
+            source.rename(source.with_name(source.name + '.migrated'))
+        size_mb = sum((store_path / name).stat().st_size for name in (store.VECTORS, store.RECORDS, store.OFFSETS)
+                      if (store_path / name).exists()) / 1e6
+        self.stdout.write(self.style.SUCCESS(
+            f'Migrated {migrated} documents ({skipped} skipped) into {store_path}: {size_mb:.1f} MB, dimension {store.dim}'
+        ))
@@ -0,0 +1,64 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from emails.models import Email
+from emails.services.local_classifier import CentroidClassifier, email_text
+from emails.services.vector_db_service import VectorDBService
+import numpy as np
+
+class Command(BaseCommand):
+    help = 'Train the local category head from categorized emails and report escalation rate and agreement'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=5000, help='Most recent categorized emails to learn from')
+        parser.add_argument('--holdout', type=float, default=0.2, help='Share of emails kept aside to calibrate the threshold')
+        parser.add_argument('--target-accuracy', type=float, help='Accuracy local answers must reach on the holdout')
+        parser.add_argument('--min-per-category', type=int, default=5, help='Skip categories with fewer examples')
+        parser.add_argument('--output', help='Where to write the head (defaults to LOCAL_CLASSIFIER_PATH)')
+
+    def handle(self, *args, **options):
+        target = options['target_accuracy'] or settings.LOCAL_CLASSIFIER_TARGET_ACCURACY
+        output = options['output'] or settings.LOCAL_CLASSIFIER_PATH
+
+        emails = list(
+            Email.objects.exclude(category=Email.Category.UNCATEGORIZED)
+            .order_by('-received_date')[:options['limit']]
+        )
+        counts = {}
+        for email in emails:
+            counts[email.category] = counts.get(email.category, 0) + 1
+        categories = {category for category, count in counts.items() if count >= options['min_per_category']}
+        emails = [email for email in emails if email.category in categories]
+        if len(categories) < 2:
+            self.stdout.write(self.style.WARNING('Need at least two categories with enough examples to train.'))
+            return
+
+        self.stdout.write(f'Embedding {len(emails)} emails...')
+        vectors = VectorDBService().get_embeddings([email_text(email) for email in emails])
+        if vectors is None:
+            self.stdout.write(self.style.ERROR('Could not embed emails; is the embedding model available?'))
+            return
+        labels = [email.category for email in emails]
+
+        order = np.random.default_rng(0).permutation(len(labels))
+        split = max(1, int(len(order) * options['holdout']))
+        holdout, train = order[:split], order[split:]
+        labels = np.asarray(labels)
+
+        head = CentroidClassifier.train(vectors[train], labels[train])
+        threshold = head.calibrate(vectors[holdout], labels[holdout], target)
+        report = head.evaluate(vectors[holdout], labels[holdout])
+
+        # Keep the calibrated threshold but learn the centroids from everything
+        final = CentroidClassifier.train(vectors, labels)
+        final.threshold = threshold
+        final.save(output)
+
+        for category in sorted(categories):
+            self.stdout.write(f'  {category}: {counts[category]} examples')
+        self.stdout.write(
+            f'Holdout of {report["total"]}: margin threshold {threshold:.3f}, '
+            f'escalation rate {report["escalation_rate"]:.1%}, '
+            f'agreement {report["agreement"]:.1%} on local answers '
+            f'(accuracy {report["accuracy"]:.1%} without escalation)'
+        )
+        self.stdout.write(self.style.SUCCESS(f'Category head saved to {output}'))
@@ -0,0 +1,39 @@
+# Generated by Django 5.0.2 on 2026-10-18 10:44
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emails', '0002_alter_email_options_alter_emailaccount_options_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='email',
+            name='uid',
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='FolderSyncState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('folder', models.CharField(max_length=255)),
+                ('uidvalidity', models.PositiveBigIntegerField(blank=True, null=True)),
+                ('last_uid', models.PositiveBigIntegerField(default=0)),
+                ('last_sync', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sync_states', to='emails.emailaccount')),
+            ],
+            options={
+                'verbose_name': 'Folder Sync State',
+                'verbose_name_plural': 'Folder Sync States',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='foldersyncstate',
+            constraint=models.UniqueConstraint(fields=('account', 'folder'), name='unique_account_folder_sync_state'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.2 on 2026-10-18 10:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emails', '0003_folder_sync_state'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='email',
+            name='body_complete',
+            field=models.BooleanField(default=True),
+        ),
+    ]
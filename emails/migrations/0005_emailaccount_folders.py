@@ -0,0 +1,23 @@
+# Generated by Django 5.0.2 on 2026-10-18 10:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emails', '0004_email_body_complete'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='emailaccount',
+            name='folder_exclude',
+            field=models.CharField(blank=True, default='', max_length=1000),
+        ),
+        migrations.AddField(
+            model_name='emailaccount',
+            name='folder_include',
+            field=models.CharField(default='INBOX', max_length=1000),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.0.2 on 2026-10-18 11:09
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emails', '0005_emailaccount_folders'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategoryCacheEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True)),
+                ('category', models.CharField(choices=[('interested', 'Interested'), ('meeting_booked', 'Meeting Booked'), ('not_interested', 'Not Interested'), ('spam', 'Spam'), ('out_of_office', 'Out of Office'), ('uncategorized', 'Uncategorized')], max_length=20)),
+                ('model', models.CharField(max_length=100)),
+                ('prompt_version', models.PositiveIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_used', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name': 'Category Cache Entry',
+                'verbose_name_plural': 'Category Cache Entries',
+                'indexes': [models.Index(fields=['created_at'], name='emails_cate_created_6d6a55_idx'), models.Index(fields=['last_used'], name='emails_cate_last_us_90cdfc_idx')],
+            },
+        ),
+    ]
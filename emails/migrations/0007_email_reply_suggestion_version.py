@@ -0,0 +1,18 @@
+# Generated by Django 5.0.2 on 2026-10-18 14:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emails', '0006_category_cache'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='email',
+            name='reply_suggestion_version',
+            field=models.CharField(blank=True, default='', max_length=150),
+        ),
+    ]
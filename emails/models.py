@@ -1,5 +1,6 @@
 from django.db import models
 from django.utils import timezone
+import fnmatch
 import logging
 
 logger = logging.getLogger(__name__)
@@ -10,6 +11,9 @@ class EmailAccount(models.Model):
     imap_server = models.CharField(max_length=255)
     imap_port = models.IntegerField(default=993)
     use_ssl = models.BooleanField(default=True)
+    # Comma-separated folder name patterns (fnmatch style, e.g. "INBOX, [Gmail]/Sent*")
+    folder_include = models.CharField(max_length=1000, default='INBOX')
+    folder_exclude = models.CharField(max_length=1000, blank=True, default='')
     last_sync = models.DateTimeField(null=True, blank=True)
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -18,10 +22,43 @@ class EmailAccount(models.Model):
     def __str__(self):
         return self.email
 
+    def wants_folder(self, folder):
+        """Check a folder name against the include/exclude patterns."""
+        def patterns(value):
+            return [pattern.strip() for pattern in value.split(',') if pattern.strip()]
+
+        if any(fnmatch.fnmatchcase(folder, pattern) for pattern in patterns(self.folder_exclude)):
+            return False
+        return any(fnmatch.fnmatchcase(folder, pattern) for pattern in patterns(self.folder_include))
+
+    def update_last_sync(self):
+        """Record that the account has just been synced."""
+        self.last_sync = timezone.now()
+        self.save(update_fields=['last_sync', 'updated_at'])
+
     class Meta:
         verbose_name = 'Email Account'
         verbose_name_plural = 'Email Accounts'
 
+class FolderSyncState(models.Model):
+    """IMAP sync checkpoint for one folder of an account."""
+    account = models.ForeignKey(EmailAccount, on_delete=models.CASCADE, related_name='sync_states')
+    folder = models.CharField(max_length=255)
+    uidvalidity = models.PositiveBigIntegerField(null=True, blank=True)
+    last_uid = models.PositiveBigIntegerField(default=0)
+    last_sync = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.account.email}:{self.folder} (uid {self.last_uid})"
+
+    class Meta:
+        verbose_name = 'Folder Sync State'
+        verbose_name_plural = 'Folder Sync States'
+        constraints = [
+            models.UniqueConstraint(fields=['account', 'folder'], name='unique_account_folder_sync_state'),
+        ]
+
 class Email(models.Model):
     class Category(models.TextChoices):
         INTERESTED = 'interested', 'Interested'
@@ -37,7 +74,9 @@ class Email(models.Model):
     sender = models.CharField(max_length=255)
     recipient = models.CharField(max_length=255)
     body = models.TextField()
+    body_complete = models.BooleanField(default=True)
     folder = models.CharField(max_length=255)
+    uid = models.PositiveBigIntegerField(null=True, blank=True)
     received_date = models.DateTimeField()
     category = models.CharField(
         max_length=20,
@@ -45,6 +84,8 @@ class Email(models.Model):
         default=Category.UNCATEGORIZED
     )
     reply_suggestion = models.TextField(blank=True, null=True)
+    # Category, model and prompt version the suggestion was written for; see reply_version()
+    reply_suggestion_version = models.CharField(max_length=150, blank=True, default='')
     is_processed = models.BooleanField(default=False)
     slack_notification_sent = models.BooleanField(default=False)
     webhook_triggered = models.BooleanField(default=False)
@@ -55,16 +96,53 @@ class Email(models.Model):
     def __str__(self):
         return f"{self.subject} - {self.sender}"
 
+    def ensure_full_body(self):
+        """Download the full text body if only a preview was synced.
+
+        Runs inside API requests, so a server that stops answering gives up
+        after IMAP_BODY_FETCH_TIMEOUT and the stored preview is kept.
+        """
+        if self.body_complete:
+            return True
+
+        from django.conf import settings
+        from emails.services.imap_service import IMAPService
+
+        imap_service = IMAPService(self.account, timeout=settings.IMAP_BODY_FETCH_TIMEOUT)
+        try:
+            body = imap_service.fetch_full_body(self)
+        finally:
+            imap_service.disconnect()
+
+        if body is None:
+            logger.error(f"Could not fetch full body for email ID {self.id}")
+            return False
+        self.body = body
+        self.body_complete = True
+        self.save(update_fields=['body', 'body_complete', 'updated_at'])
+        return True
+
+    def has_current_reply_suggestion(self):
+        """Whether the saved suggestion was written for this category with the current model and prompt."""
+        from emails.services.rag_service import reply_version
+
+        return bool(self.reply_suggestion) and self.reply_suggestion_version == reply_version(self.category)
+
     def generate_reply_suggestion(self):
         """Generate and save a reply suggestion using RAG"""
-        from emails.services.rag_service import RAGService
+        from emails.services.rag_service import RAGService, reply_version
+        from emails.services.singleflight import flight_key, get_singleflight
         
         try:
-            rag_service = RAGService()
-            suggestion = rag_service.generate_reply_suggestion(self.id)
+            # Double clicks and overlapping admin selections share one generation
+            suggestion = get_singleflight('reply').do(
+                flight_key(self.id, reply_version(self.category)),
+                lambda: RAGService().generate_reply_suggestion(self.id),
+            )
             if suggestion:
                 self.reply_suggestion = suggestion
-                self.save(update_fields=['reply_suggestion'])
+                self.reply_suggestion_version = reply_version(self.category)
+                self.save(update_fields=['reply_suggestion', 'reply_suggestion_version'])
                 logger.info(f"Generated reply suggestion for email ID {self.id}")
                 return True
             return False
@@ -82,5 +160,25 @@ class Email(models.Model):
             models.Index(fields=['received_date']),
         ]
 
+class CategoryCacheEntry(models.Model):
+    """Cached LLM category for a normalized subject+body, model and prompt version."""
+    key = models.CharField(max_length=64, unique=True)
+    category = models.CharField(max_length=20, choices=Email.Category.choices)
+    model = models.CharField(max_length=100)
+    prompt_version = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.key[:12]}: {self.category}"
+
+    class Meta:
+        verbose_name = 'Category Cache Entry'
+        verbose_name_plural = 'Category Cache Entries'
+        indexes = [
+            models.Index(fields=['created_at']),
+            models.Index(fields=['last_used']),
+        ]
+
 # Add debug logging
 logger.info("Email and EmailAccount models loaded") 
\ No newline at end of file
@@ -4,7 +4,7 @@ from .models import EmailAccount, Email
 class EmailAccountSerializer(serializers.ModelSerializer):
     class Meta:
         model = EmailAccount
-        fields = ['id', 'email', 'password', 'imap_server', 'imap_port', 'use_ssl', 'last_sync', 'is_active']
+        fields = ['id', 'email', 'password', 'imap_server', 'imap_port', 'use_ssl', 'folder_include', 'folder_exclude', 'last_sync', 'is_active']
         extra_kwargs = {
             'password': {'write_only': True}
         }
@@ -14,7 +14,7 @@ class EmailSerializer(serializers.ModelSerializer):
         model = Email
         fields = [
             'id', 'message_id', 'subject', 'sender', 'recipient',
-            'body', 'folder', 'received_date', 'category',
+            'body', 'body_complete', 'folder', 'received_date', 'category',
             'reply_suggestion', 'is_processed', 'created_at', 'updated_at'
         ]
 
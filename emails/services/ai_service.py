@@ -1,72 +1,104 @@
-import openai
 from django.conf import settings
 from ..models import Email
+from .category_cache import cache_key, get_category_cache
+from .llm_client import LLMError, estimate_tokens, get_llm_client
+from .rule_engine import get_rule_engine
+from .singleflight import flight_key, get_singleflight
+from .text_reduction import get_text_reducer
+import json
 import logging
-import re
 import random
 
 # Set up logging
 logger = logging.getLogger(__name__)
 
+# Bump whenever the categorization prompt changes so cached answers are not reused
+CATEGORIZE_PROMPT_VERSION = 1
+
+CATEGORY_DESCRIPTIONS = """
+- interested: The sender shows interest in our product/service
+- meeting_booked: The sender confirms or requests a meeting
+- not_interested: The sender explicitly states they are not interested
+- spam: The email is spam or promotional
+- out_of_office: An out-of-office auto-reply
+- uncategorized: None of the above categories fit
+"""
+
+BATCH_CATEGORIZE_PROMPT = """Please categorize each of the following emails into one of these categories:
+{categories}
+Return ONLY a JSON object of the form {{"results": [{{"id": <email id>, "category": "<category>"}}]}} with one entry per email.
+
+{emails}"""
+
 class AIService:
-    def __init__(self):
-        self.client = None
-        self.use_fallback = False
-        try:
-            # Log the API key presence (not the actual key)
-            api_key = settings.OPENAI_API_KEY
-            logger.info(f"API key present: {bool(api_key)}")
-            if not api_key:
-                logger.error("OpenAI API key is not configured")
-                self.use_fallback = True
-                return
-
-            # Initialize OpenAI client
-            try:
-                openai.api_key = api_key
-                openai.api_base = settings.OPENAI_BASE_URL
-                self.client = openai
-                logger.info("OpenAI client initialized successfully")
-            except Exception as e:
-                logger.error(f"Failed to initialize OpenAI client: {str(e)}")
-                self.client = None
-                self.use_fallback = True
+    def __init__(self, category_cache=None, client=None, text_reducer=None):
+        if category_cache is None and settings.CATEGORY_CACHE_ENABLED:
+            category_cache = get_category_cache()
+        self.category_cache = category_cache
+        self.text_reducer = text_reducer or get_text_reducer()
 
-        except Exception as e:
-            logger.error(f"Error in AIService initialization: {str(e)}")
-            self.client = None
-            self.use_fallback = True
-
-    def get_completion(self, prompt, max_tokens=500, temperature=0.7):
-        """Get a completion from OpenAI."""
-        if not self.client or self.use_fallback:
-            if not self.client:
-                logger.error("OpenAI client is not initialized")
-            if self.use_fallback:
-                logger.info("Using fallback completion")
-            
+        # One LLMClient per process, so concurrency and rate limits are shared
+        self.client = client or get_llm_client()
+        if not self.client:
+            logger.error("OpenAI API key is not configured")
+
+    def llm_available(self):
+        """Whether requests can go to the LLM now (configured and circuit breaker not open)."""
+        return self.client is not None and self.client.available()
+
+    def get_completion(self, prompt, max_tokens=500, temperature=0.7, fallback=True):
+        """Get a completion from OpenAI.
+
+        With fallback=False errors raise LLMError instead of returning a canned text.
+        """
+        if not self.llm_available():
+            if not fallback:
+                raise LLMError("LLM is not available")
+            logger.info("Using fallback completion")
             return self._fallback_completion(prompt)
 
         try:
-            # Get completion from OpenAI
-            completion = self.client.ChatCompletion.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": "You are a helpful assistant."},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=max_tokens,
-                temperature=temperature
+            # Get completion from OpenAI; identical prompts in flight at the same time share one request
+            return get_singleflight('completion').do(
+                flight_key(settings.OPENAI_MODEL, prompt, max_tokens, temperature),
+                lambda: self._chat(self._completion_messages(prompt), max_tokens=max_tokens, temperature=temperature),
             )
 
-            # Extract text from response
-            response_text = completion.choices[0].message.content.strip()
-            return response_text
-
         except Exception as e:
+            if not fallback:
+                raise
             logger.error(f"Error getting completion: {str(e)}")
             return self._fallback_completion(prompt)
+
+    def stream_completion(self, prompt, max_tokens=500, temperature=0.7):
+        """Yield a completion as it is generated; a fallback arrives as a single chunk."""
+        if not self.llm_available():
+            logger.info("Using fallback completion")
+            yield self._fallback_completion(prompt)
+            return
+
+        started = False
+        try:
+            for delta in self.client.stream(self._completion_messages(prompt), max_tokens=max_tokens, temperature=temperature):
+                started = True
+                yield delta
+        except Exception as e:
+            if started:
+                # Part of the answer is already out; let the caller decide what to do with it
+                raise
+            logger.error(f"Error streaming completion: {str(e)}")
+            yield self._fallback_completion(prompt)
+
+    def _completion_messages(self, prompt):
+        return [
+            {"role": "system", "content": "You are a helpful assistant."},
+            {"role": "user", "content": prompt}
+        ]
             
+    def _chat(self, messages, max_tokens, temperature):
+        """Send one chat completion request and return the reply text."""
+        return self.client.chat(messages, max_tokens=max_tokens, temperature=temperature)
+
     def _fallback_completion(self, prompt):
         """Generate a fallback completion when OpenAI is unavailable."""
         # Extract the type of content requested from the prompt
@@ -80,181 +112,212 @@ Best regards,
 
     def _fallback_categorize(self, text):
         """
-        Simple rule-based fallback categorization when OpenAI API is unavailable
+        Rule-based fallback categorization when OpenAI API is unavailable
         """
-        text = (text or "").lower()
-        
-        # Simple rule-based categorization
-        if re.search(r'(out\s*of\s*office|ooo|vacation|holiday|leave|away|not\s+available)', text):
-            return 'out_of_office'
-        
-        if re.search(r'(meeting|appointment|schedule|calendar|meet|discuss|call|zoom|teams|google\s*meet)', text):
-            return 'meeting_booked'
-        
-        if re.search(r'(unsubscribe|promotion|offer|deal|discount|sale|marketing|subscribe|newsletter)', text):
-            return 'spam'
-        
-        if re.search(r'(not\s+interested|no\s+thank|decline|sorry|won\'t|cannot|won\'t\s+be|no\s+interest)', text):
-            return 'not_interested'
-        
-        if re.search(r'(interest|inquiry|question|learn\s+more|tell\s+me|information|service|product)', text):
-            return 'interested'
-        
-        # Default fallback
-        return 'uncategorized'
-
-    def _handle_api_error(self, exception, email_data=None, email=None):
-        """
-        Handle OpenAI API errors and decide if we should switch to fallback mode
-        """
-        error_msg = str(exception)
-        logger.error(f"OpenAI API error: {error_msg}")
-        
-        # Check for quota error
-        if "exceeded your current quota" in error_msg or "insufficient_quota" in error_msg:
-            logger.warning("OpenAI API quota exceeded, switching to fallback mode")
-            self.use_fallback = True
-            
-            # Get text to categorize
-            if email_data:
-                text = f"{email_data.get('subject', '')} {email_data.get('body', '')}"
-            elif email:
-                text = f"{email.subject} {email.body}"
-            else:
-                return 'uncategorized'
-                
-            return self._fallback_categorize(text)
-        
-        return 'uncategorized'
+        return get_rule_engine().categorize(text)
 
     def process_email(self, email_data):
         """Process an email using OpenAI."""
-        if not self.client or self.use_fallback:
-            if not self.client:
-                logger.error("OpenAI client is not initialized")
-            if self.use_fallback:
-                logger.info("Using fallback categorization")
-            
-            # Use fallback categorization
-            text = f"{email_data.get('subject', '')} {email_data.get('body', '')}"
-            category = self._fallback_categorize(text)
-            return category, None
+        logger.info(f"Processing email: {email_data.get('subject', '')}")
+        category = self.categorize_batch([email_data])[0]
+        logger.info(f"Categorized email as: {category}")
+        return category, None
 
-        try:
-            # Log the email being processed
-            logger.info(f"Processing email: {email_data['subject']}")
-
-            # Prepare prompt for categorization
-            categorize_prompt = f"""
-            Please categorize the following email into one of these categories:
-            - interested: The sender shows interest in our product/service
-            - meeting_booked: The sender confirms or requests a meeting
-            - not_interested: The sender explicitly states they are not interested
-            - spam: The email is spam or promotional
-            - out_of_office: An out-of-office auto-reply
-            - uncategorized: None of the above categories fit
-
-            Subject: {email_data['subject']}
-            From: {email_data['sender']}
-            Body:
-            {email_data['body']}
+    def categorize_email(self, email: Email):
+        """Categorize an email using OpenAI."""
+        return self.categorize_batch([email])[0]
 
-            Return ONLY the category name, nothing else.
-            """
+    def categorize_batch(self, emails):
+        """Categorize many emails (dicts or Email objects) with as few requests as possible.
 
-            # Get completion from OpenAI for categorization
-            try:
-                completion = self.client.ChatCompletion.create(
-                    model="gpt-3.5-turbo",
-                    messages=[
-                        {"role": "system", "content": "You are a helpful assistant that categorizes emails."},
-                        {"role": "user", "content": categorize_prompt}
-                    ],
-                    max_tokens=10,
-                    temperature=0
-                )
-                logger.info("Successfully got completion from OpenAI")
-            except Exception as e:
-                return self._handle_api_error(e, email_data=email_data), None
-
-            # Extract category from response
-            category = completion.choices[0].message.content.strip().lower()
-            logger.info(f"Categorized email as: {category}")
-
-            return category, None
+        Emails are packed into requests of at most OPENAI_CATEGORIZE_BATCH_SIZE
+        items within OPENAI_CATEGORIZE_BATCH_TOKENS, and the model answers
+        with one JSON entry per email. Entries that are missing or carry an
+        unknown category are retried on their own, up to
+        OPENAI_CATEGORIZE_RETRIES times. Returns categories in input order.
 
-        except Exception as e:
-            logger.error(f"Error processing email: {str(e)}")
-            return self._handle_api_error(e, email_data=email_data), None
+        Answers are cached by content hash, and identical emails in one
+        call are only sent once.
+        """
+        items = [self._categorize_fields(email) for email in emails]
+        if not self.llm_available():
+            logger.info("Using fallback categorization")
+            return get_rule_engine().categorize_batch(f"{item['subject']} {item['body']}" for item in items)
+
+        categories = ['uncategorized'] * len(items)
+        keys = [
+            cache_key(item['subject'], item['body'], settings.OPENAI_MODEL, CATEGORIZE_PROMPT_VERSION)
+            for item in items
+        ]
+        cached = self.category_cache.get_many(keys) if self.category_cache else {}
+        duplicates = {}  # key -> indices of the emails sharing it
+        for index, key in enumerate(keys):
+            if key in cached:
+                categories[index] = cached[key]
+            else:
+                duplicates.setdefault(key, []).append(index)
+        asked = [indices[0] for indices in duplicates.values()]
+
+        pending = list(asked)
+        for attempt in range(settings.OPENAI_CATEGORIZE_RETRIES + 1):
+            if not pending or not self.llm_available():
+                break
+            if attempt:
+                logger.info(f"Retrying categorization of {len(pending)} emails")
+            chunks = list(self._pack_batches(items, pending))
+            # The requests of a round go out concurrently, within the client's limits
+            answers = self.client.chat_many([self._categorize_request(items, chunk) for chunk in chunks])
+            pending = []
+            for chunk, answer in zip(chunks, answers):
+                if isinstance(answer, Exception):
+                    logger.error(f"Error categorizing {len(chunk)} emails: {answer}")
+                    pending.extend(chunk)
+                else:
+                    pending.extend(self._apply_labels(answer, chunk, categories))
+
+        use_rules = not self.llm_available()
+        for index in pending:
+            if use_rules:
+                item = items[index]
+                categories[index] = self._fallback_categorize(f"{item['subject']} {item['body']}")
+            else:
+                logger.warning(f"Could not categorize email: {items[index]['subject']}")
+
+        answered = set(asked) - set(pending)
+        for index in asked:
+            for duplicate in duplicates[keys[index]]:
+                categories[duplicate] = categories[index]
+        if self.category_cache:
+            self.category_cache.set_many(
+                {keys[index]: categories[index] for index in answered},
+                settings.OPENAI_MODEL,
+                CATEGORIZE_PROMPT_VERSION,
+            )
+        return categories
+
+    def _categorize_fields(self, email):
+        if isinstance(email, Email):
+            email = {'subject': email.subject, 'sender': email.sender, 'body': email.body}
+        return {
+            'subject': email.get('subject') or '',
+            'sender': email.get('sender') or '',
+            # The opening of a message is what decides its category
+            'body': self.text_reducer.reduce(
+                (email.get('body') or '')[:settings.OPENAI_CATEGORIZE_BODY_CHARS], 'categorize'
+            ),
+        }
+
+    def _pack_batches(self, items, indices):
+        """Group item indices into requests bounded by item count and token budget."""
+        budget = settings.OPENAI_CATEGORIZE_BATCH_TOKENS - estimate_tokens(BATCH_CATEGORIZE_PROMPT + CATEGORY_DESCRIPTIONS)
+        chunk, tokens = [], 0
+        for index in indices:
+            item = items[index]
+            cost = estimate_tokens(item['subject'] + item['sender'] + item['body']) + 10
+            if chunk and (len(chunk) >= settings.OPENAI_CATEGORIZE_BATCH_SIZE or tokens + cost > budget):
+                yield chunk
+                chunk, tokens = [], 0
+            chunk.append(index)
+            tokens += cost
+        if chunk:
+            yield chunk
+
+    def _categorize_request(self, items, chunk):
+        """Build the chat request for one packed group of emails."""
+        emails_text = '\n'.join(
+            f"### Email {position}\nSubject: {items[index]['subject']}\nFrom: {items[index]['sender']}\nBody:\n{items[index]['body']}\n"
+            for position, index in enumerate(chunk, start=1)
+        )
+        prompt = BATCH_CATEGORIZE_PROMPT.format(categories=CATEGORY_DESCRIPTIONS, emails=emails_text)
+        return {
+            'messages': [
+                {"role": "system", "content": "You are a helpful assistant that categorizes emails."},
+                {"role": "user", "content": prompt}
+            ],
+            'max_tokens': 20 * len(chunk) + 20,
+            'temperature': 0,
+        }
+
+    def _apply_labels(self, content, chunk, categories):
+        """Store the categories answered for one request; returns the indices that failed."""
+        labels = self._parse_labels(content)
+        failed = []
+        for position, index in enumerate(chunk, start=1):
+            label = labels.get(position)
+            if label in Email.Category.values:
+                categories[index] = label
+            else:
+                failed.append(index)
+        return failed
+
+    def _parse_labels(self, content):
+        """Read {id: category} from the model's JSON answer, tolerating code fences and chatter."""
+        start, end = content.find('{'), content.rfind('}')
+        if start == -1 or end < start:
+            return {}
+        try:
+            data = json.loads(content[start:end + 1])
+        except ValueError:
+            return {}
+
+        labels = {}
+        results = data.get('results', []) if isinstance(data, dict) else []
+        for entry in results if isinstance(results, list) else []:
+            if not isinstance(entry, dict):
+                continue
+            try:
+                labels[int(entry.get('id'))] = str(entry.get('category', '')).strip().lower()
+            except (TypeError, ValueError):
+                continue
+        return labels
 
-    def categorize_email(self, email: Email):
-        """Categorize an email using OpenAI."""
-        if not self.client or self.use_fallback:
-            if not self.client:
-                logger.error("OpenAI client is not initialized")
-            if self.use_fallback:
-                logger.info("Using fallback categorization")
-            
-            # Use fallback categorization
-            text = f"{email.subject} {email.body}"
-            return self._fallback_categorize(text)
+    def suggest_reply(self, email: Email):
+        """Suggest a reply for an email."""
+        if not self.llm_available():
+            logger.info("Using fallback reply suggestion")
+            return self._fallback_reply(email)
 
         try:
             # Prepare prompt
             prompt = f"""
-            Please categorize the following email into one of these categories:
-            - interested: The sender shows interest in our product/service
-            - meeting_booked: The sender confirms or requests a meeting
-            - not_interested: The sender explicitly states they are not interested
-            - spam: The email is spam or promotional
-            - out_of_office: An out-of-office auto-reply
-            - uncategorized: None of the above categories fit
+            Please suggest a professional and friendly reply to the following email:
 
             Subject: {email.subject}
             From: {email.sender}
             Body:
-            {email.body}
+            {self.text_reducer.reduce(email.body, 'reply')}
 
-            Return ONLY the category name, nothing else.
+            The reply should be:
+            1. Professional and courteous
+            2. Address the main points in the email
+            3. Include a clear next step or call to action
+            4. End with a professional signature
             """
 
             # Get completion from OpenAI
-            completion = self.client.ChatCompletion.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": "You are a helpful assistant that categorizes emails."},
+            reply = self._chat(
+                [
+                    {"role": "system", "content": "You are a helpful assistant that drafts email replies."},
                     {"role": "user", "content": prompt}
                 ],
-                max_tokens=10,
-                temperature=0
+                max_tokens=500,
+                temperature=0.7
             )
 
-            # Extract category from response
-            category = completion.choices[0].message.content.strip().lower()
-
-            # Validate category
-            valid_categories = [choice[0] for choice in Email.Category.choices]
-            if category not in valid_categories:
-                category = 'uncategorized'
-
-            return category
+            return reply
 
         except Exception as e:
-            return self._handle_api_error(e, email=email)
+            logger.error(f"Error suggesting reply: {str(e)}")
+            # Fall back to generic reply
+            return self._fallback_reply(email)
 
-    def suggest_reply(self, email: Email):
-        """Suggest a reply for an email."""
-        if not self.client or self.use_fallback:
-            if not self.client:
-                logger.error("OpenAI client is not initialized")
-            if self.use_fallback:
-                logger.info("Using fallback reply suggestion")
-            
-            # Return a generic reply based on the email category
-            category = email.category if email.category else self._fallback_categorize(f"{email.subject} {email.body}")
-            
-            generic_replies = {
-                'interested': f"""
+    def _fallback_reply(self, email: Email):
+        """Generic reply for the email's category, used when the LLM is unavailable."""
+        # Return a generic reply based on the email category
+        category = email.category if email.category else self._fallback_categorize(f"{email.subject} {email.body}")
+        
+        generic_replies = {
+            'interested': f"""
 Dear {email.sender.split('@')[0]},
 
 Thank you for your interest in our services. We appreciate you reaching out to us.
@@ -264,8 +327,8 @@ I'd be happy to provide more information and answer any questions you may have.
 Best regards,
 Your Name
 Company Name
-                """,
-                'meeting_booked': f"""
+            """,
+            'meeting_booked': f"""
 Dear {email.sender.split('@')[0]},
 
 Thank you for scheduling a meeting with us. I'm looking forward to our conversation.
@@ -275,8 +338,8 @@ I've added the appointment to my calendar. Please let me know if you need any sp
 Best regards,
 Your Name
 Company Name
-                """,
-                'not_interested': f"""
+            """,
+            'not_interested': f"""
 Dear {email.sender.split('@')[0]},
 
 Thank you for your response. I understand that our services may not be what you're looking for at this time.
@@ -286,10 +349,10 @@ We appreciate your consideration and would be happy to assist you in the future
 Best regards,
 Your Name
 Company Name
-                """,
-                'out_of_office': "",  # No need to reply to out-of-office messages
-                'spam': "",  # No need to reply to spam
-                'uncategorized': f"""
+            """,
+            'out_of_office': "",  # No need to reply to out-of-office messages
+            'spam': "",  # No need to reply to spam
+            'uncategorized': f"""
 Dear {email.sender.split('@')[0]},
 
 Thank you for your email. I've received your message and will get back to you with a more detailed response soon.
@@ -297,45 +360,7 @@ Thank you for your email. I've received your message and will get back to you wi
 Best regards,
 Your Name
 Company Name
-                """
-            }
-            
-            return generic_replies.get(category, generic_replies['uncategorized'])
-
-        try:
-            # Prepare prompt
-            prompt = f"""
-            Please suggest a professional and friendly reply to the following email:
-
-            Subject: {email.subject}
-            From: {email.sender}
-            Body:
-            {email.body}
-
-            The reply should be:
-            1. Professional and courteous
-            2. Address the main points in the email
-            3. Include a clear next step or call to action
-            4. End with a professional signature
             """
-
-            # Get completion from OpenAI
-            completion = self.client.ChatCompletion.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": "You are a helpful assistant that drafts email replies."},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=500,
-                temperature=0.7
-            )
-
-            # Extract reply from response
-            reply = completion.choices[0].message.content.strip()
-
-            return reply
-
-        except Exception as e:
-            logger.error(f"Error suggesting reply: {str(e)}")
-            # Fall back to generic reply
-            return self._handle_api_error(e, email=email) 
\ No newline at end of file
+        }
+        
+        return generic_replies.get(category, generic_replies['uncategorized']) 
\ No newline at end of file
@@ -0,0 +1,173 @@
+import hashlib
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from django.conf import settings
+from django.utils import timezone
+from ..models import CategoryCacheEntry
+
+logger = logging.getLogger(__name__)
+
+REPLY_PREFIX = re.compile(r'^\s*((re|fwd?|aw|wg)\s*:\s*)+', re.IGNORECASE)
+DIGITS = re.compile(r'\d+')
+WHITESPACE = re.compile(r'\s+')
+# Keys per UPDATE/DELETE, below SQLite's bound parameter limit
+TOUCH_CHUNK = 500
+
+def normalize_text(text):
+    """Lower-case, mask numbers and collapse whitespace so templated mail hashes alike."""
+    text = DIGITS.sub('#', (text or '').lower())
+    return WHITESPACE.sub(' ', text).strip()
+
+def cache_key(subject, body, model, prompt_version):
+    """Hash a normalized subject+body together with the model and prompt version."""
+    subject = REPLY_PREFIX.sub('', subject or '')
+    raw = '\x00'.join([model, str(prompt_version), normalize_text(subject), normalize_text(body)])
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+class CategoryCache:
+    """Category lookups by content hash: an in-process LRU in front of CategoryCacheEntry.
+
+    Entries expire after `max_age_days`. The table is pruned to the
+    `max_entries` most recently used rows every `prune_every` writes.
+    Memory hits are remembered and written to `last_used` with the next
+    table lookup or prune, so hot entries are not pruned first.
+    """
+
+    def __init__(self, lru_size=None, max_entries=None, max_age_days=None, prune_every=1000):
+        self.lru_size = settings.CATEGORY_CACHE_LRU_SIZE if lru_size is None else lru_size
+        self.max_entries = settings.CATEGORY_CACHE_MAX_ENTRIES if max_entries is None else max_entries
+        self.max_age = timedelta(days=settings.CATEGORY_CACHE_MAX_AGE_DAYS if max_age_days is None else max_age_days)
+        self.prune_every = prune_every
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+        self._lru = OrderedDict()  # key -> (category, monotonic time stored)
+        self._touched = set()  # keys served from memory since last_used was written
+        self._writes = 0
+        self._lock = threading.Lock()
+
+    def get_many(self, keys):
+        """Return {key: category} for the keys that are cached and not expired."""
+        found = {}
+        missing = []
+        max_age = self.max_age.total_seconds()
+        with self._lock:
+            for key in dict.fromkeys(keys):
+                entry = self._lru.get(key)
+                if entry and time.monotonic() - entry[1] <= max_age:
+                    self._lru.move_to_end(key)
+                    found[key] = entry[0]
+                    self._touched.add(key)
+                    self.memory_hits += 1
+                else:
+                    self._lru.pop(key, None)
+                    missing.append(key)
+
+        if missing:
+            try:
+                rows = CategoryCacheEntry.objects.filter(
+                    key__in=missing, created_at__gte=timezone.now() - self.max_age
+                ).values_list('key', 'category', 'created_at')
+                rows = list(rows)
+                self._touch([row[0] for row in rows])
+            except Exception as e:
+                logger.error(f"Error reading category cache: {e}")
+                rows = []
+
+            with self._lock:
+                for key, category, created_at in rows:
+                    found[key] = category
+                    age = (timezone.now() - created_at).total_seconds()
+                    self._remember(key, category, time.monotonic() - age)
+                self.db_hits += len(rows)
+                self.misses += len(missing) - len(rows)
+        return found
+
+    def set_many(self, entries, model, prompt_version):
+        """Store {key: category} in memory and in the table."""
+        if not entries:
+            return
+        now = time.monotonic()
+        with self._lock:
+            for key, category in entries.items():
+                self._remember(key, category, now)
+            self._writes += len(entries)
+            prune = self._writes >= self.prune_every
+            if prune:
+                self._writes = 0
+
+        try:
+            CategoryCacheEntry.objects.bulk_create(
+                [
+                    CategoryCacheEntry(key=key, category=category, model=model, prompt_version=prompt_version)
+                    for key, category in entries.items()
+                ],
+                update_conflicts=True,
+                unique_fields=['key'],
+                update_fields=['category', 'model', 'prompt_version', 'created_at', 'last_used'],
+            )
+            if prune:
+                self.prune()
+        except Exception as e:
+            logger.error(f"Error writing category cache: {e}")
+
+    def prune(self):
+        """Drop expired rows and the least recently used ones beyond max_entries."""
+        self._touch()
+        deleted, _ = CategoryCacheEntry.objects.filter(created_at__lt=timezone.now() - self.max_age).delete()
+        # By pk, so rows sharing last_used with the last kept one survive
+        stale = list(
+            CategoryCacheEntry.objects.order_by('-last_used', '-pk')
+            .values_list('pk', flat=True)[self.max_entries:]
+        )
+        for start in range(0, len(stale), TOUCH_CHUNK):
+            extra, _ = CategoryCacheEntry.objects.filter(pk__in=stale[start:start + TOUCH_CHUNK]).delete()
+            deleted += extra
+        return deleted
+
+    def clear(self):
+        with self._lock:
+            self._lru.clear()
+        CategoryCacheEntry.objects.all().delete()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.memory_hits + self.db_hits + self.misses
+            return {
+                'memory_hits': self.memory_hits,
+                'db_hits': self.db_hits,
+                'misses': self.misses,
+                'hit_rate': (self.memory_hits + self.db_hits) / lookups if lookups else 0.0,
+                'memory_entries': len(self._lru),
+            }
+
+    def _touch(self, keys=()):
+        """Write last_used for `keys` and every key served from memory since the last call."""
+        with self._lock:
+            keys = list(self._touched.union(keys))
+            self._touched.clear()
+        now = timezone.now()
+        for start in range(0, len(keys), TOUCH_CHUNK):
+            CategoryCacheEntry.objects.filter(key__in=keys[start:start + TOUCH_CHUNK]).update(last_used=now)
+
+    def _remember(self, key, category, stored_at):
+        # Caller holds the lock
+        self._lru[key] = (category, stored_at)
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.lru_size:
+            self._lru.popitem(last=False)
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+def get_category_cache():
+    """Return the process-wide CategoryCache."""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = CategoryCache()
+        return _default_cache
@@ -1,4 +1,4 @@
-from elasticsearch import Elasticsearch
+from elasticsearch import Elasticsearch, helpers
 from django.conf import settings
 from ..models import Email
 
@@ -58,35 +58,59 @@ class ElasticsearchService:
             return False
 
         try:
-            # Prepare document
-            doc = {
-                'message_id': email.message_id,
-                'subject': email.subject,
-                'sender': email.sender,
-                'recipient': email.recipient,
-                'body': email.body,
-                'folder': email.folder,
-                'category': email.category,
-                'received_date': email.received_date.isoformat(),
-                'account_id': str(email.account.id)
-            }
-            
             # Index document
             self.es.index(
                 index=self.index_name,
                 id=email.message_id,
-                document=doc
+                document=self._document(email)
             )
             
             # Mark email as indexed
+            Email.objects.filter(pk=email.pk).update(es_indexed=True)
             email.es_indexed = True
-            email.save()
             
             return True
         except Exception as e:
             print(f"Error indexing email: {e}")
             return False
 
+    def index_emails(self, emails):
+        """Index a batch of emails with one bulk request; returns how many were indexed."""
+        if not self.es or not emails:
+            return 0
+
+        actions = [
+            {'_index': self.index_name, '_id': email.message_id, '_source': self._document(email)}
+            for email in emails
+        ]
+        try:
+            _, errors = helpers.bulk(self.es, actions, raise_on_error=False)
+        except Exception as e:
+            print(f"Error bulk indexing emails: {e}")
+            return 0
+
+        failed = {error.get('index', {}).get('_id') for error in errors}
+        indexed = [email for email in emails if email.message_id not in failed]
+        Email.objects.filter(pk__in=[email.pk for email in indexed]).update(es_indexed=True)
+        for email in indexed:
+            email.es_indexed = True
+        if failed:
+            print(f"Error indexing {len(failed)} emails in bulk")
+        return len(indexed)
+
+    def _document(self, email):
+        return {
+            'message_id': email.message_id,
+            'subject': email.subject,
+            'sender': email.sender,
+            'recipient': email.recipient,
+            'body': email.body,
+            'folder': email.folder,
+            'category': email.category,
+            'received_date': email.received_date.isoformat(),
+            'account_id': str(email.account_id)
+        }
+
     def search_emails(self, query: str, folder: str = None, account_id: str = None):
         """Search for emails in Elasticsearch."""
         try:
@@ -0,0 +1,77 @@
+import hashlib
+from django.db import transaction
+from django.db.models import Case, Value, When
+from django.utils import timezone
+from ..models import Email
+
+# Columns refreshed when a message we already store is synced again
+UPSERT_FIELDS = [
+    'account', 'subject', 'sender', 'recipient', 'body', 'body_complete',
+    'folder', 'uid', 'received_date', 'category', 'updated_at',
+]
+# A full body downloaded on demand is never replaced by a re-synced preview
+BODY_FIELDS = ('body', 'body_complete')
+
+def fallback_message_id(account, record):
+    """Build a stable Message-ID for mail that arrived without one."""
+    key = '\x00'.join([
+        str(account.pk),
+        record.get('sender') or '',
+        record.get('subject') or '',
+        str(record.get('received_date') or ''),
+    ])
+    return f"<{hashlib.sha1(key.encode('utf-8')).hexdigest()}@{account.imap_server}>"
+
+def upsert_emails(account, records):
+    """Insert or update parsed messages of an account in one transaction.
+
+    Each record is a dict as produced by the IMAP parser, optionally with
+    a 'category'. Records repeating a Message-ID within the batch collapse
+    to the last one. Returns the stored Email rows in record order.
+    """
+    now = timezone.now()
+    emails = {}
+    for record in records:
+        message_id = (record.get('message_id') or '').strip() or fallback_message_id(account, record)
+        message_id = message_id[:255]
+        emails.pop(message_id, None)  # keep the order of the last occurrence
+        emails[message_id] = Email(
+            account=account,
+            message_id=message_id,
+            subject=(record.get('subject') or '')[:1000],
+            sender=(record.get('sender') or '')[:255],
+            recipient=(record.get('recipient') or '')[:255],
+            body=record.get('body') or '',
+            body_complete=record.get('body_complete', True),
+            folder=record.get('folder', 'INBOX'),
+            uid=record.get('uid'),
+            received_date=record.get('received_date') or now,
+            category=record.get('category') or Email.Category.UNCATEGORIZED,
+        )
+    if not emails:
+        return []
+
+    with transaction.atomic():
+        complete = [email for email in emails.values() if email.body_complete]
+        previews = [email for email in emails.values() if not email.body_complete]
+        if complete:
+            Email.objects.bulk_create(
+                complete,
+                update_conflicts=True,
+                unique_fields=['message_id'],
+                update_fields=UPSERT_FIELDS,
+            )
+        if previews:
+            Email.objects.bulk_create(
+                previews,
+                update_conflicts=True,
+                unique_fields=['message_id'],
+                update_fields=[field for field in UPSERT_FIELDS if field not in BODY_FIELDS],
+            )
+            # Refresh the preview only where no full body was downloaded; writes only, no read-then-write
+            Email.objects.filter(message_id__in=[email.message_id for email in previews], body_complete=False).update(
+                body=Case(*[When(message_id=email.message_id, then=Value(email.body)) for email in previews]),
+            )
+        # Re-read so callers get primary keys and server-side values on every backend
+        stored = Email.objects.select_related('account').in_bulk(emails.keys(), field_name='message_id')
+    return [stored[message_id] for message_id in emails if message_id in stored]
@@ -0,0 +1,144 @@
+import logging
+import threading
+import time
+import numpy as np
+import torch
+from django.conf import settings
+from transformers import AutoModel, AutoTokenizer
+
+logger = logging.getLogger(__name__)
+
+# After a failed load, wait this long before trying again instead of failing every request slowly
+LOAD_RETRY_SECONDS = 60
+
+def _load_pretrained(model_name, device):
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModel.from_pretrained(model_name)
+    model.to(device)
+    model.eval()
+    return tokenizer, model
+
+class EmbeddingRuntime:
+    """The sentence embedding model, loaded once per process and shared by every caller.
+
+    The model is loaded on first use, or up front by warmup() when
+    EMBEDDING_WARMUP is set. status() reports whether it is ready for the
+    readiness endpoint.
+    """
+
+    NOT_LOADED, LOADING, READY, FAILED = 'not_loaded', 'loading', 'ready', 'failed'
+
+    def __init__(self, model_name=None, device=None, loader=None, threads=None):
+        self.model_name = model_name or settings.EMBEDDING_MODEL
+        self.device = device or settings.EMBEDDING_DEVICE or None
+        self.threads = settings.EMBEDDING_THREADS if threads is None else threads
+        # loader(model_name, device) -> (tokenizer, model); tests pass their own
+        self._loader = loader or _load_pretrained
+        self.tokenizer = None
+        self.model = None
+        self.state = self.NOT_LOADED
+        self.error = None
+        self.load_seconds = None
+        self._failed_at = 0.0
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Load the model if needed; returns True when it is ready to use."""
+        if self.state == self.READY:
+            return True
+        with self._lock:
+            if self.state == self.READY:
+                return True
+            if self.state == self.FAILED and time.monotonic() - self._failed_at < LOAD_RETRY_SECONDS:
+                return False
+            self.state = self.LOADING
+            if self.threads:
+                # Process-wide; without it torch takes every core and competes with the web workers
+                torch.set_num_threads(self.threads)
+            if self.device is None:
+                self.device = 'cuda' if torch.cuda.is_available() else 'cpu'
+            start = time.perf_counter()
+            try:
+                self.tokenizer, self.model = self._loader(self.model_name, self.device)
+            except Exception as e:
+                logger.error(f"Error initializing embedding model: {e}")
+                self.state = self.FAILED
+                self.error = str(e)
+                self._failed_at = time.monotonic()
+                return False
+            self.load_seconds = time.perf_counter() - start
+            self.state = self.READY
+            self.error = None
+            logger.info(f"Embedding model {self.model_name} loaded on {self.device} in {self.load_seconds:.1f}s")
+            return True
+
+    def embed(self, text):
+        """Return the mean-pooled embedding of one text as a list of floats."""
+        return self.embed_batch([text])[0].tolist()
+
+    def embed_batch(self, texts, batch_size=None):
+        """Embed many texts; returns a (len(texts), dim) float32 array in input order.
+
+        Texts are sorted by length so each batch is padded only to its own
+        longest text, then run `batch_size` at a time.
+        """
+        if not self.load():
+            raise RuntimeError("Embedding model not initialized")
+        texts = list(texts)
+        batch_size = max(1, batch_size or settings.EMBEDDING_BATCH_SIZE)
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        embeddings = None
+        for start in range(0, len(order), batch_size):
+            rows = order[start:start + batch_size]
+            batch = self._forward([texts[i] for i in rows])
+            if embeddings is None:
+                embeddings = np.empty((len(texts), batch.shape[1]), dtype=np.float32)
+            embeddings[rows] = batch
+        if embeddings is None:
+            return np.empty((0, self.model.config.hidden_size), dtype=np.float32)
+        return embeddings
+
+    def _forward(self, texts):
+        # Tokenize and get model outputs
+        inputs = self.tokenizer(texts, padding=True, truncation=True, return_tensors="pt").to(self.device)
+        with torch.no_grad():
+            outputs = self.model(**inputs)
+
+        # Mean pooling
+        attention_mask = inputs['attention_mask']
+        token_embeddings = outputs.last_hidden_state
+        input_mask_expanded = attention_mask.unsqueeze(-1).expand(token_embeddings.size()).float()
+        embeddings = torch.sum(token_embeddings * input_mask_expanded, 1) / torch.clamp(input_mask_expanded.sum(1), min=1e-9)
+        return embeddings.cpu().numpy().astype(np.float32, copy=False)
+
+    def warmup(self):
+        """Load the model and run one forward pass so the first request pays nothing."""
+        if self.load():
+            self.embed('warmup')
+        return self.state == self.READY
+
+    def status(self):
+        return {
+            'state': self.state,
+            'model': self.model_name,
+            'device': self.device,
+            'load_seconds': self.load_seconds,
+            'error': self.error,
+        }
+
+_runtime = None
+_runtime_lock = threading.Lock()
+
+def get_embedding_runtime():
+    """Return the process-wide EmbeddingRuntime (not loaded until first use)."""
+    global _runtime
+    with _runtime_lock:
+        if _runtime is None:
+            _runtime = EmbeddingRuntime()
+        return _runtime
+
+def start_warmup():
+    """Load the embedding model in a background thread, e.g. from wsgi.py/asgi.py at startup."""
+    thread = threading.Thread(target=get_embedding_runtime().warmup, name='embedding-warmup', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,127 @@
+import logging
+import random
+import threading
+from django.conf import settings
+from django.db import close_old_connections, connections
+from ..models import EmailAccount
+from .imap_service import IMAPService
+from .sync_service import ingest_folder
+
+logger = logging.getLogger(__name__)
+
+CONNECTION_FIELDS = ('email', 'password', 'imap_server', 'imap_port', 'use_ssl')
+
+class Backoff:
+    """Exponential reconnect delay with full jitter."""
+
+    def __init__(self, base=None, cap=None):
+        self.base = base or settings.IMAP_RECONNECT_BACKOFF_BASE
+        self.cap = cap or settings.IMAP_RECONNECT_BACKOFF_MAX
+        self.attempt = 0
+
+    def next_delay(self):
+        delay = random.uniform(0, min(self.cap, self.base * 2 ** self.attempt))
+        self.attempt += 1
+        return delay
+
+    def reset(self):
+        self.attempt = 0
+
+class IdleWorker(threading.Thread):
+    """Keeps one IDLE connection open for an account and ingests new mail.
+
+    IDLE is re-issued every IMAP_IDLE_RENEW_SECONDS, before the 29-minute
+    server limit. On EXISTS only UIDs above the folder checkpoint are
+    fetched. Dropped connections are retried with jittered backoff.
+    """
+
+    def __init__(self, account, process_batch, folder='INBOX', renew_seconds=None):
+        super().__init__(name=f'idle-{account.email}', daemon=True)
+        self.account = account
+        self.process_batch = process_batch
+        self.folder = folder
+        self.renew_seconds = renew_seconds or settings.IMAP_IDLE_RENEW_SECONDS
+        self.stop_event = threading.Event()
+        self.backoff = Backoff()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def run(self):
+        while not self.stop_event.is_set():
+            imap_service = IMAPService(self.account, timeout=settings.IMAP_ACCOUNT_TIMEOUT)
+            try:
+                if not imap_service.connect():
+                    raise ConnectionError(imap_service.last_error)
+                # Catch up on anything that arrived while we were disconnected
+                self.sync(imap_service)
+                self.backoff.reset()
+
+                while not self.stop_event.is_set():
+                    responses = imap_service.idle(self.renew_seconds, self.stop_event)
+                    if any(line.endswith(b'EXISTS') for line in responses):
+                        self.sync(imap_service)
+            except Exception as e:
+                delay = self.backoff.next_delay()
+                logger.warning(f"IDLE connection for {self.account.email} failed: {e}; reconnecting in {delay:.1f}s")
+                self.stop_event.wait(delay)
+            finally:
+                imap_service.disconnect()
+        connections.close_all()
+
+    def sync(self, imap_service):
+        """Fetch and process new emails of the watched folder."""
+        close_old_connections()
+        fetched, _ = ingest_folder(imap_service, self.folder, self.process_batch)
+        if fetched:
+            self.account.update_last_sync()
+            logger.info(f"Ingested {fetched} new emails for {self.account.email}")
+
+class IdleSupervisor:
+    """Runs one IdleWorker per active account.
+
+    The account list is re-read every `refresh_seconds`: workers are
+    started for new accounts, stopped for deactivated ones and restarted
+    when connection settings change or a worker died.
+    """
+
+    def __init__(self, process_batch, refresh_seconds=60):
+        self.process_batch = process_batch
+        self.refresh_seconds = refresh_seconds
+        self.workers = {}
+
+    def refresh(self):
+        close_old_connections()
+        accounts = {account.id: account for account in EmailAccount.objects.filter(is_active=True)}
+
+        for account_id, worker in list(self.workers.items()):
+            account = accounts.get(account_id)
+            if account is None or not worker.is_alive() or _connection_key(account) != _connection_key(worker.account):
+                worker.stop()
+                del self.workers[account_id]
+
+        for account_id, account in accounts.items():
+            if account_id not in self.workers:
+                worker = IdleWorker(account, self.process_batch)
+                worker.start()
+                self.workers[account_id] = worker
+                logger.info(f"Started IDLE worker for {account.email}")
+
+    def run(self, stop_event):
+        """Supervise workers until `stop_event` is set."""
+        try:
+            while not stop_event.is_set():
+                self.refresh()
+                stop_event.wait(self.refresh_seconds)
+        finally:
+            self.shutdown()
+
+    def shutdown(self, timeout=5):
+        for worker in self.workers.values():
+            worker.stop()
+        for worker in self.workers.values():
+            worker.join(timeout)
+        self.workers = {}
+
+def _connection_key(account):
+    return tuple(getattr(account, field) for field in CONNECTION_FIELDS)
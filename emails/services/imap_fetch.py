@@ -0,0 +1,201 @@
+"""Helpers for batched IMAP FETCH: UID sets and FETCH response parsing."""
+import base64
+import binascii
+import quopri
+from collections import namedtuple
+
+ATOM_DELIMITERS = b' ()\r\n'
+
+TextPart = namedtuple('TextPart', ['section', 'encoding', 'charset', 'size'])
+
+
+def chunked(items, size):
+    """Split a list into consecutive chunks of at most `size` items."""
+    size = max(1, int(size))
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def compress_uids(uids):
+    """Turn UIDs into a compact IMAP sequence set, e.g. [1, 2, 3, 7] -> '1:3,7'."""
+    ranges = []
+    for uid in sorted(set(uids)):
+        if ranges and uid == ranges[-1][1] + 1:
+            ranges[-1][1] = uid
+        else:
+            ranges.append([uid, uid])
+    return ','.join(str(lo) if lo == hi else f'{lo}:{hi}' for lo, hi in ranges)
+
+
+def iter_fetch_response(data):
+    """Yield one dict per message from the data returned by imaplib FETCH.
+
+    imaplib hands back a list mixing plain lines and (line, literal) tuples
+    for every message in the response. Keys are upper-case item names
+    (``UID``, ``BODY[]``, ``BODYSTRUCTURE`` ...); literals stay bytes,
+    parenthesised lists become Python lists and NIL becomes None.
+    """
+    reader = _FetchReader(data)
+    while reader.skip_space():
+        if not reader.read_atom():  # message sequence number
+            reader.pos += 1  # stray delimiter, skip it
+            continue
+        reader.skip_space()
+        items = reader.read_value()
+        if not isinstance(items, list):
+            continue
+        message = {}
+        for key, value in zip(items[::2], items[1::2]):
+            key = key.upper() if isinstance(key, str) else key
+            if key == 'UID':
+                value = int(value)
+            message[key] = value
+        yield message
+
+
+def parse_list_response(data):
+    """Parse imaplib LIST data into (flags, delimiter, name) tuples."""
+    folders = []
+    for element in data or []:
+        if not element:
+            continue
+        reader = _FetchReader([element])
+        flags = reader.read_value()
+        delimiter = reader.read_value()
+        name = reader.read_value()
+        folders.append(([_text(flag) for flag in flags or []], _text(delimiter), _text(name)))
+    return folders
+
+
+def find_text_part(structure, prefix=''):
+    """Locate the first text/plain part in a parsed BODYSTRUCTURE.
+
+    Returns a TextPart with the IMAP section number to fetch, or None when
+    the message has no plain-text part.
+    """
+    if not isinstance(structure, list) or not structure:
+        return None
+    if isinstance(structure[0], list):
+        # Multipart: child parts come first, followed by the subtype
+        for index, part in enumerate(structure):
+            if not isinstance(part, list):
+                break
+            found = find_text_part(part, f'{prefix}{index + 1}.')
+            if found:
+                return found
+        return None
+
+    media_type = f'{_text(structure[0])}/{_text(structure[1])}'.lower()
+    if media_type != 'text/plain':
+        return None
+    params = structure[2] if isinstance(structure[2], list) else []
+    charset = None
+    for name, value in zip(params[::2], params[1::2]):
+        if _text(name).lower() == 'charset':
+            charset = _text(value)
+    try:
+        size = int(structure[6])
+    except (IndexError, TypeError, ValueError):
+        size = 0
+    encoding = _text(structure[5]) if len(structure) > 5 else '7BIT'
+    return TextPart(prefix.rstrip('.') or '1', encoding or '7BIT', charset, size)
+
+
+def decode_section(data, encoding, charset):
+    """Decode a (possibly truncated) body section to text."""
+    data = data or b''
+    encoding = (encoding or '7BIT').upper()
+    try:
+        if encoding == 'BASE64':
+            data = b''.join(data.split())
+            # A byte-limited fetch can stop mid-quantum
+            data = base64.b64decode(data[:len(data) - len(data) % 4])
+        elif encoding == 'QUOTED-PRINTABLE':
+            data = quopri.decodestring(data)
+    except (binascii.Error, ValueError):
+        pass
+    try:
+        return data.decode(charset or 'utf-8')
+    except (LookupError, UnicodeDecodeError):
+        return data.decode('utf-8', errors='replace')
+
+
+def _text(value):
+    if isinstance(value, bytes):
+        return value.decode('utf-8', errors='replace')
+    return value or ''
+
+
+class _FetchReader:
+    """Tokenizer over imaplib FETCH data with literals kept out of band."""
+
+    def __init__(self, data):
+        texts = []
+        self.literals = []
+        for element in data or []:
+            if isinstance(element, tuple):
+                texts.append(element[0])
+                self.literals.append(element[1])
+            elif element:
+                texts.append(element)
+        self.text = b' '.join(texts)
+        self.pos = 0
+        self.literal_index = 0
+
+    def skip_space(self):
+        """Skip whitespace; return False at the end of the data."""
+        while self.pos < len(self.text) and self.text[self.pos] in b' \r\n':
+            self.pos += 1
+        return self.pos < len(self.text)
+
+    def read_value(self):
+        self.skip_space()
+        char = self.text[self.pos:self.pos + 1]
+        if char == b'(':
+            self.pos += 1
+            values = []
+            while self.skip_space() and self.text[self.pos:self.pos + 1] != b')':
+                values.append(self.read_value())
+            self.pos += 1
+            return values
+        if char == b'"':
+            return self.read_quoted()
+        if char == b'{':
+            return self.read_literal()
+        atom = self.read_atom()
+        return None if atom.upper() == 'NIL' else atom
+
+    def read_quoted(self):
+        self.pos += 1
+        out = bytearray()
+        while self.pos < len(self.text):
+            char = self.text[self.pos]
+            self.pos += 1
+            if char == 0x5C:  # backslash
+                out.append(self.text[self.pos])
+                self.pos += 1
+            elif char == 0x22:  # closing quote
+                break
+            else:
+                out.append(char)
+        return out.decode('utf-8', errors='replace')
+
+    def read_literal(self):
+        end = self.text.index(b'}', self.pos)
+        self.pos = end + 1
+        literal = self.literals[self.literal_index]
+        self.literal_index += 1
+        return literal
+
+    def read_atom(self):
+        """Read an atom, keeping section specs like BODY[HEADER.FIELDS (TO)] whole."""
+        start = self.pos
+        while self.pos < len(self.text):
+            char = self.text[self.pos:self.pos + 1]
+            if char == b'[':
+                self.pos = self.text.index(b']', self.pos) + 1
+                continue
+            if char in ATOM_DELIMITERS:
+                break
+            self.pos += 1
+        return self.text[start:self.pos].decode('ascii', errors='replace')
@@ -0,0 +1,67 @@
+import logging
+from ..models import Email
+from .local_classifier import TieredCategorizer
+from .email_store import upsert_emails
+from .elasticsearch_service import ElasticsearchService
+from .notification_service import NotificationService
+
+logger = logging.getLogger(__name__)
+
+NOTIFY_CATEGORIES = ('interested', 'meeting_booked')
+
+class IngestService:
+    """Categorize, store, index and notify for freshly fetched emails."""
+
+    def __init__(self, ai_service=None, elasticsearch_service=None, notification_service=None):
+        # Anything with categorize_batch(); the tiered categorizer wraps AIService
+        self.ai_service = ai_service or TieredCategorizer.from_settings()
+        self.elasticsearch_service = elasticsearch_service or ElasticsearchService()
+        self.notification_service = notification_service or NotificationService()
+
+    def process_email(self, imap_service, email_data):
+        """Run one fetched email through the ingestion steps; returns the saved Email."""
+        try:
+            emails = self.persist(imap_service.account, self.categorize([email_data]))
+            self.index(emails)
+            self.notify(emails)
+            return emails[0] if emails else None
+        except Exception as e:
+            logger.error(f"Error processing email {email_data.get('message_id')}: {e}")
+            return None
+
+    def process_batch(self, imap_service, batch):
+        """Process a batch of fetched emails with one write transaction; returns how many were stored."""
+        emails = self.persist(imap_service.account, self.categorize(batch))
+        self.index(emails)
+        self.notify(emails)
+        return len(emails)
+
+    def categorize(self, batch):
+        """Return copies of the fetched emails with a valid 'category' set."""
+        try:
+            categories = self.ai_service.categorize_batch(batch)
+        except Exception as e:
+            logger.error(f"Error categorizing {len(batch)} emails: {e}")
+            categories = [None] * len(batch)
+
+        records = []
+        for email_data, category in zip(batch, categories):
+            if category not in Email.Category.values:
+                category = Email.Category.UNCATEGORIZED
+            records.append(dict(email_data, category=category))
+        return records
+
+    def persist(self, account, records):
+        """Upsert categorized emails; errors propagate so the checkpoint is not advanced."""
+        return upsert_emails(account, records)
+
+    def index(self, emails):
+        if self.elasticsearch_service and emails:
+            self.elasticsearch_service.index_emails(emails)
+
+    def notify(self, emails):
+        if not self.notification_service:
+            return
+        for email in emails:
+            if email.category in NOTIFY_CATEGORIES:
+                self.notification_service.send_notification(email)
@@ -0,0 +1,338 @@
+import asyncio
+import logging
+import queue
+import random
+import threading
+import time
+import httpx
+import openai
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+def estimate_tokens(text):
+    """Rough token count for budgeting requests (about 4 characters per token)."""
+    return len(text or '') // 4 + 1
+
+class LLMError(Exception):
+    """Raised when a chat request fails for good."""
+
+class CircuitOpenError(LLMError):
+    """Raised instead of calling the provider while the circuit breaker is open."""
+
+class TokenBucket:
+    """Async token bucket refilled continuously at `per_minute` tokens per minute.
+
+    A rate of 0 disables the limit.
+    """
+
+    def __init__(self, per_minute, capacity=None):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity or per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = None
+
+    async def acquire(self, amount=1):
+        if self.rate <= 0:
+            return
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        amount = min(amount, self.capacity)
+        # Waiters queue up so a large request is not starved by small ones
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+class CircuitBreaker:
+    """Stops calling a failing provider and probes it again after a cool-down.
+
+    After `failure_threshold` consecutive failures the breaker opens and
+    every call is refused for `reset_timeout` seconds. Then a single probe
+    request is let through (half-open): success closes the breaker,
+    failure opens it again.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, failure_threshold=None, reset_timeout=None):
+        self.failure_threshold = failure_threshold or settings.OPENAI_BREAKER_FAILURES
+        self.reset_timeout = settings.OPENAI_BREAKER_RESET_SECONDS if reset_timeout is None else reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def available(self):
+        """Whether a call could go through now, without claiming the probe."""
+        with self._lock:
+            if self.state == self.OPEN:
+                return time.monotonic() - self.opened_at >= self.reset_timeout
+            return not (self.state == self.HALF_OPEN and self._probing)
+
+    def allow(self):
+        """Claim permission for one call."""
+        with self._lock:
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self._probing = False
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.info("LLM circuit breaker closed")
+            self.state = self.CLOSED
+            self.failures = 0
+            self._probing = False
+
+    def release(self):
+        """Give back a probe claimed by allow() whose call was abandoned."""
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self, trip=False):
+        """Count a failure; `trip` opens the breaker right away (e.g. quota exhausted)."""
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if trip or self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logger.warning(f"LLM circuit breaker opened after {self.failures} failures")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+class LLMClient:
+    """Chat completions over AsyncOpenAI, shared by every thread of the process.
+
+    Requests run on a private event loop thread. At most `max_in_flight`
+    are sent at once, requests and tokens per minute are paced by token
+    buckets, 429/5xx/connection errors are retried with jittered
+    exponential backoff, and a CircuitBreaker stops calls to a provider
+    that keeps failing. Use achat()/achat_many()/astream() from async
+    code and chat()/chat_many()/stream() from sync code.
+    """
+
+    def __init__(self, api_key=None, base_url=None, model=None, max_in_flight=None,
+                 requests_per_minute=None, tokens_per_minute=None, max_retries=None,
+                 breaker=None, create=None):
+        self.api_key = api_key if api_key is not None else settings.OPENAI_API_KEY
+        self.base_url = base_url or settings.OPENAI_BASE_URL
+        self.model = model or settings.OPENAI_MODEL
+        self.max_in_flight = max_in_flight or settings.OPENAI_MAX_IN_FLIGHT
+        self.max_retries = settings.OPENAI_MAX_RETRIES if max_retries is None else max_retries
+        self.requests = TokenBucket(
+            settings.OPENAI_REQUESTS_PER_MINUTE if requests_per_minute is None else requests_per_minute
+        )
+        self.tokens = TokenBucket(
+            settings.OPENAI_TOKENS_PER_MINUTE if tokens_per_minute is None else tokens_per_minute
+        )
+        self.breaker = breaker or CircuitBreaker()
+        # create(**kwargs) -> completion; tests and benchmarks pass their own
+        self._create = create
+        self._semaphore = None
+        self._loop = None
+        self._lock = threading.Lock()
+
+    def available(self):
+        return self.breaker.available()
+
+    async def achat(self, messages, max_tokens=500, temperature=0.7):
+        """Send one chat request and return the reply text."""
+        if not self.breaker.allow():
+            raise CircuitOpenError("LLM circuit breaker is open")
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+
+        prompt_tokens = sum(estimate_tokens(message['content']) for message in messages)
+        attempt = 0
+        while True:
+            await self.requests.acquire()
+            await self.tokens.acquire(prompt_tokens + max_tokens)
+            try:
+                async with self._semaphore:
+                    completion = await self._get_create()(
+                        model=self.model,
+                        messages=messages,
+                        max_tokens=max_tokens,
+                        temperature=temperature,
+                    )
+                self.breaker.record_success()
+                return (completion.choices[0].message.content or '').strip()
+            except Exception as e:
+                await self._retry_or_raise(e, attempt)
+                attempt += 1
+
+    async def astream(self, messages, max_tokens=500, temperature=0.7):
+        """Send one streaming chat request and yield the reply text as it arrives.
+
+        Failures before the first chunk are retried like achat(); once text
+        has been yielded a failure ends the stream with LLMError.
+        """
+        if not self.breaker.allow():
+            raise CircuitOpenError("LLM circuit breaker is open")
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+
+        prompt_tokens = sum(estimate_tokens(message['content']) for message in messages)
+        attempt = 0
+        while True:
+            await self.requests.acquire()
+            await self.tokens.acquire(prompt_tokens + max_tokens)
+            started = False
+            try:
+                async with self._semaphore:
+                    stream = await self._get_create()(
+                        model=self.model,
+                        messages=messages,
+                        max_tokens=max_tokens,
+                        temperature=temperature,
+                        stream=True,
+                    )
+                    async for chunk in stream:
+                        delta = chunk.choices[0].delta.content if chunk.choices else None
+                        if delta:
+                            started = True
+                            yield delta
+                self.breaker.record_success()
+                return
+            except (GeneratorExit, asyncio.CancelledError):
+                # The reader went away; that says nothing about the provider
+                self.breaker.release()
+                raise
+            except Exception as e:
+                await self._retry_or_raise(e, attempt, give_up=started)
+                attempt += 1
+
+    async def _retry_or_raise(self, error, attempt, give_up=False):
+        """Wait before retrying a failed request, or raise LLMError if it should not be retried."""
+        retryable, quota = _classify_error(error)
+        if give_up or quota or not retryable or attempt >= self.max_retries:
+            if retryable or quota:
+                self.breaker.record_failure(trip=quota)
+            else:
+                # The request was bad, not the provider
+                self.breaker.record_success()
+            raise LLMError(str(error)) from error
+        delay = _retry_after(error) or random.uniform(
+            0, min(settings.OPENAI_RETRY_MAX_DELAY, settings.OPENAI_RETRY_BASE_DELAY * 2 ** attempt)
+        )
+        logger.info(f"LLM request failed ({error}), retry {attempt + 1} in {delay:.1f}s")
+        await asyncio.sleep(delay)
+
+    async def achat_many(self, requests):
+        """Run several chat requests concurrently; returns texts or exceptions in order."""
+        return await asyncio.gather(
+            *(self.achat(**request) for request in requests),
+            return_exceptions=True,
+        )
+
+    def chat(self, messages, max_tokens=500, temperature=0.7):
+        return self._run(self.achat(messages, max_tokens=max_tokens, temperature=temperature))
+
+    def chat_many(self, requests):
+        return self._run(self.achat_many(requests))
+
+    def stream(self, messages, max_tokens=500, temperature=0.7):
+        """Iterate over astream() from sync code; closing the iterator cancels the request."""
+        chunks = queue.Queue()
+        done = object()
+
+        async def pump():
+            try:
+                async for delta in self.astream(messages, max_tokens=max_tokens, temperature=temperature):
+                    chunks.put(delta)
+            except Exception as e:
+                chunks.put(e)
+            finally:
+                chunks.put(done)
+
+        future = self._submit(pump())
+        try:
+            while True:
+                item = chunks.get()
+                if item is done:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            future.cancel()
+
+    def close(self):
+        with self._lock:
+            if self._loop is not None:
+                self._loop.call_soon_threadsafe(self._loop.stop)
+                self._loop = None
+
+    def _get_create(self):
+        if self._create is None:
+            client = openai.AsyncOpenAI(
+                api_key=self.api_key,
+                base_url=self.base_url,
+                timeout=settings.OPENAI_TIMEOUT,
+                max_retries=0,  # retries are handled here so they respect the limits
+                # One pooled connection per request we may have in flight
+                http_client=httpx.AsyncClient(
+                    timeout=settings.OPENAI_TIMEOUT,
+                    limits=httpx.Limits(
+                        max_connections=self.max_in_flight,
+                        max_keepalive_connections=self.max_in_flight,
+                    ),
+                ),
+            )
+            self._create = client.chat.completions.create
+        return self._create
+
+    def _submit(self, coroutine):
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name='llm-client', daemon=True).start()
+            loop = self._loop
+        return asyncio.run_coroutine_threadsafe(coroutine, loop)
+
+    def _run(self, coroutine):
+        return self._submit(coroutine).result()
+
+def _classify_error(error):
+    """Return (retryable, quota_exhausted) for an exception from the provider."""
+    if isinstance(error, openai.RateLimitError):
+        body = error.body if isinstance(error.body, dict) else {}
+        quota = body.get('code') == 'insufficient_quota' or 'insufficient_quota' in str(error)
+        return not quota, quota
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code >= 500, False
+    if isinstance(error, (openai.APIConnectionError, asyncio.TimeoutError, ConnectionError)):
+        return True, False
+    return False, False
+
+def _retry_after(error):
+    response = getattr(error, 'response', None)
+    try:
+        return min(float(response.headers.get('retry-after')), settings.OPENAI_RETRY_MAX_DELAY)
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+_default_client = None
+_default_client_lock = threading.Lock()
+
+def get_llm_client():
+    """Return the process-wide LLMClient, or None when no API key is configured."""
+    global _default_client
+    with _default_client_lock:
+        if _default_client is None and settings.OPENAI_API_KEY:
+            _default_client = LLMClient()
+        return _default_client
@@ -0,0 +1,183 @@
+import logging
+import threading
+from datetime import datetime, timezone as dt_timezone
+from pathlib import Path
+import numpy as np
+from django.conf import settings
+from ..models import Email
+
+logger = logging.getLogger(__name__)
+
+def email_text(email):
+    """Text embedded for an email (dict or Email), matching what RAG indexes."""
+    if isinstance(email, Email):
+        subject, body = email.subject, email.body
+    else:
+        subject, body = email.get('subject') or '', email.get('body') or ''
+    return f"Subject: {subject}\n\nBody: {body[:settings.OPENAI_CATEGORIZE_BODY_CHARS]}"
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-9)
+
+class CentroidClassifier:
+    """Nearest-centroid category head over sentence embeddings.
+
+    Confidence is the cosine margin between the best and the second best
+    category; predictions below `threshold` are meant to go to the LLM.
+    """
+
+    def __init__(self, labels=None, centroids=None, threshold=1.0, trained_at=''):
+        self.labels = list(labels or [])
+        self.centroids = centroids
+        self.threshold = threshold
+        self.trained_at = trained_at
+
+    @classmethod
+    def train(cls, embeddings, labels):
+        embeddings = _normalize(embeddings)
+        labels = np.asarray(labels)
+        names = sorted(set(labels.tolist()))
+        centroids = _normalize([embeddings[labels == name].mean(axis=0) for name in names])
+        return cls(names, centroids, trained_at=datetime.now(dt_timezone.utc).isoformat())
+
+    def predict(self, embeddings):
+        """Return (labels, margins) for a matrix of embeddings."""
+        if not len(embeddings):
+            return [], np.zeros(0, dtype=np.float32)
+        scores = _normalize(embeddings) @ self.centroids.T
+        order = np.argsort(scores, axis=1)
+        rows = np.arange(len(scores))
+        best = scores[rows, order[:, -1]]
+        second = scores[rows, order[:, -2]] if len(self.labels) > 1 else np.zeros(len(scores), dtype=np.float32)
+        return [self.labels[i] for i in order[:, -1]], best - second
+
+    def calibrate(self, embeddings, labels, target_accuracy):
+        """Pick the lowest margin at which local answers still meet `target_accuracy`.
+
+        Walks held-out predictions from most to least confident and keeps
+        the widest prefix whose accuracy is at least the target.
+        """
+        predicted, margins = self.predict(embeddings)
+        correct = np.array([p == label for p, label in zip(predicted, labels)], dtype=np.float32)
+        order = np.argsort(-margins)
+        accuracy = np.cumsum(correct[order]) / np.arange(1, len(order) + 1)
+        # Only cut between distinct margins, tied items land on the same side
+        ranked = margins[order]
+        boundary = np.append(ranked[:-1] > ranked[1:], True)
+        passing = np.nonzero((accuracy >= target_accuracy) & boundary)[0]
+        # Nothing is reliable enough: escalate everything
+        self.threshold = float(margins[order[passing[-1]]]) if len(passing) else float('inf')
+        return self.threshold
+
+    def evaluate(self, embeddings, labels):
+        """Report escalation rate and agreement with known labels at the current threshold."""
+        predicted, margins = self.predict(embeddings)
+        confident = margins >= self.threshold
+        correct = np.array([p == label for p, label in zip(predicted, labels)], dtype=bool)
+        total = len(labels)
+        return {
+            'total': total,
+            'escalation_rate': 1.0 - confident.mean() if total else 0.0,
+            'agreement': correct[confident].mean() if confident.any() else 0.0,
+            'accuracy': correct.mean() if total else 0.0,
+        }
+
+    def save(self, path):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'wb') as f:
+            np.savez(
+                f,
+                labels=np.array(self.labels),
+                centroids=self.centroids,
+                threshold=np.array(self.threshold),
+                trained_at=np.array(self.trained_at),
+            )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            return cls(
+                data['labels'].tolist(),
+                data['centroids'],
+                float(data['threshold']),
+                str(data['trained_at']),
+            )
+
+class TieredCategorizer:
+    """Categorize locally when the category head is confident, else ask the LLM.
+
+    Exposes the same categorize_batch() as AIService. Without a trained
+    head every email escalates, so behaviour matches plain AIService.
+    """
+
+    def __init__(self, ai_service=None, classifier=None, embed=None):
+        if ai_service is None:
+            from .ai_service import AIService
+            ai_service = AIService()
+        self.ai_service = ai_service
+        self.classifier = classifier
+        self._embed = embed
+        self._vector_db = None
+        self.local = 0
+        self.escalated = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls, ai_service=None):
+        classifier = None
+        path = Path(settings.LOCAL_CLASSIFIER_PATH)
+        if settings.LOCAL_CLASSIFIER_ENABLED and path.exists():
+            try:
+                classifier = CentroidClassifier.load(path)
+            except Exception as e:
+                logger.error(f"Error loading category head from {path}: {e}")
+        return cls(ai_service, classifier)
+
+    def embed(self, texts):
+        if self._embed is not None:
+            return [self._embed(text) for text in texts]
+        if self._vector_db is None:
+            from .vector_db_service import VectorDBService
+            self._vector_db = VectorDBService()
+        vectors = self._vector_db.get_embeddings(texts)
+        return list(vectors) if vectors is not None else [None] * len(texts)
+
+    def categorize_batch(self, emails):
+        emails = list(emails)
+        categories = [None] * len(emails)
+        escalate = list(range(len(emails)))
+
+        if self.classifier and emails:
+            try:
+                vectors = self.embed([email_text(email) for email in emails])
+                usable = [i for i, vector in enumerate(vectors) if vector is not None]
+                if usable:
+                    labels, margins = self.classifier.predict([vectors[i] for i in usable])
+                    for i, label, margin in zip(usable, labels, margins):
+                        if margin >= self.classifier.threshold:
+                            categories[i] = label
+                    escalate = [i for i in range(len(emails)) if categories[i] is None]
+            except Exception as e:
+                logger.error(f"Local categorization failed, escalating {len(emails)} emails: {e}")
+
+        if escalate:
+            answers = self.ai_service.categorize_batch([emails[i] for i in escalate])
+            for i, category in zip(escalate, answers):
+                categories[i] = category
+
+        with self._lock:
+            self.local += len(emails) - len(escalate)
+            self.escalated += len(escalate)
+        return categories
+
+    def stats(self):
+        with self._lock:
+            total = self.local + self.escalated
+            return {
+                'local': self.local,
+                'escalated': self.escalated,
+                'escalation_rate': self.escalated / total if total else 0.0,
+            }
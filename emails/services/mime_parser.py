@@ -0,0 +1,115 @@
+import atexit
+import email
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone as dt_timezone
+from email.policy import compat32
+from email.utils import parsedate_to_datetime
+from django.conf import settings
+
+# Everything here runs in worker processes too, so it must not touch the ORM.
+
+def parse_headers(msg):
+    """Extract the stored header fields from a parsed message."""
+    return {
+        'message_id': msg['message-id'] or '',
+        'subject': msg['subject'] or '',
+        'sender': msg['from'] or '',
+        'recipient': msg['to'] or '',
+        'received_date': _parse_date(msg['date']),
+    }
+
+def parse_message(raw):
+    """Parse a raw RFC822 message into the compact record we store.
+
+    Only the first inline text/plain part is decoded; attachments and
+    other parts are skipped without touching their payload.
+    """
+    msg = email.message_from_bytes(raw or b'', policy=compat32)
+    record = parse_headers(msg)
+    record['body'] = ''
+
+    for part in msg.walk():
+        if part.is_multipart() or part.get_content_type() != 'text/plain':
+            continue
+        if (part.get('Content-Disposition') or '').lower().startswith('attachment'):
+            continue
+        try:
+            payload = part.get_payload(decode=True)
+        except Exception:
+            continue
+        record['body'] = decode_text(payload, part.get_content_charset())
+        break
+
+    return record
+
+def decode_text(payload, charset):
+    """Decode bytes with the declared charset, falling back to utf-8."""
+    if not payload:
+        return ''
+    try:
+        return payload.decode(charset or 'utf-8')
+    except (LookupError, UnicodeDecodeError):
+        return payload.decode('utf-8', errors='replace')
+
+def _parse_date(value):
+    if not value:
+        return datetime.now(dt_timezone.utc)
+    try:
+        parsed = parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return datetime.now(dt_timezone.utc)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=dt_timezone.utc)
+    return parsed
+
+class ParserPool:
+    """Parses raw messages, fanning larger batches out to worker processes.
+
+    With `workers=0`, or for batches smaller than `min_batch`, parsing
+    happens inline: shipping a handful of messages to another process
+    costs more than parsing them.
+    """
+
+    def __init__(self, workers=None, min_batch=None):
+        self.workers = settings.IMAP_PARSE_WORKERS if workers is None else workers
+        self.min_batch = settings.IMAP_PARSE_POOL_MIN_BATCH if min_batch is None else min_batch
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def parse_many(self, raws):
+        """Parse raw messages, returning records in the same order."""
+        raws = list(raws)
+        if self.workers <= 0 or len(raws) < self.min_batch:
+            return [parse_message(raw) for raw in raws]
+        chunksize = max(1, len(raws) // (self.workers * 4))
+        return list(self._get_executor().map(parse_message, raws, chunksize=chunksize))
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # spawn, not fork: ingestion runs many threads and forking those is unsafe
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                )
+            return self._executor
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+_default_pool = None
+_default_pool_lock = threading.Lock()
+
+def get_parser_pool():
+    """Return the process-wide ParserPool."""
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is None:
+            _default_pool = ParserPool()
+            atexit.register(_default_pool.shutdown)
+        return _default_pool
@@ -0,0 +1,157 @@
+import logging
+import queue
+import threading
+from concurrent.futures import Future
+from django.conf import settings
+from django.db import connections
+from .ingest_service import IngestService
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+class PipelineJob:
+    """One fetched batch travelling through the pipeline."""
+
+    def __init__(self, account, records):
+        self.account = account
+        self.records = records
+        self.emails = []
+        # Resolves with the number of stored emails once the batch is persisted
+        self.future = Future()
+
+    def fail(self, error):
+        if not self.future.done():
+            self.future.set_exception(error)
+
+class Stage:
+    """A pool of worker threads fed by a bounded queue.
+
+    `handler(job)` returns True to pass the job on to the next stage.
+    put() blocks while the queue is full, so a slow stage holds back the
+    stages feeding it instead of letting batches pile up in memory.
+    """
+
+    def __init__(self, name, handler, workers=1, queue_size=None):
+        self.name = name
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.queue = queue.Queue(maxsize=queue_size or self.workers * 2)
+        self.next_stage = None
+        self.processed = 0
+        self.failed = 0
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def start(self):
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f'ingest-{self.name}-{index}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def put(self, job):
+        self.queue.put(job)
+
+    def close(self):
+        """Let the workers drain the queue, then stop them."""
+        for _ in self._threads:
+            self.queue.put(_STOP)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def _run(self):
+        try:
+            while True:
+                job = self.queue.get()
+                if job is _STOP:
+                    break
+                try:
+                    forward = self.handler(job)
+                except Exception as e:
+                    logger.error(f"Ingest stage {self.name} failed for {job.account.email}: {e}")
+                    with self._lock:
+                        self.failed += 1
+                    job.fail(e)
+                    continue
+                with self._lock:
+                    self.processed += 1
+                if forward and self.next_stage:
+                    self.next_stage.put(job)
+        finally:
+            connections.close_all()
+
+class IngestPipeline:
+    """Categorize, persist, index and notify fetched emails in overlapping stages.
+
+    Each stage has its own worker threads and is connected to the next by
+    a bounded queue, so a slow LLM call overlaps with IMAP fetches instead
+    of stalling them. Every stage works on whole batches.
+
+    submit() matches the `process_batch(imap_service, batch)` signature
+    used by SyncEngine and returns a Future that resolves once the batch
+    is persisted; ingest_folder() only advances the folder checkpoint then.
+    Indexing and notifications carry on in the background.
+    """
+
+    def __init__(self, ingest_service=None, categorize_workers=None, persist_workers=None,
+                 index_workers=None, notify_workers=None, queue_size=None):
+        self.ingest_service = ingest_service or IngestService()
+        queue_size = queue_size or settings.INGEST_QUEUE_SIZE
+        self.stages = [
+            Stage('categorize', self._categorize, categorize_workers or settings.INGEST_CATEGORIZE_WORKERS, queue_size),
+            # SQLite allows a single writer, so more persist workers only add lock waits there
+            Stage('persist', self._persist, persist_workers or settings.INGEST_PERSIST_WORKERS, queue_size),
+            Stage('index', self._index, index_workers or settings.INGEST_INDEX_WORKERS, queue_size),
+            Stage('notify', self._notify, notify_workers or settings.INGEST_NOTIFY_WORKERS, queue_size),
+        ]
+        for stage, next_stage in zip(self.stages, self.stages[1:]):
+            stage.next_stage = next_stage
+        self._started = False
+
+    def start(self):
+        if not self._started:
+            for stage in self.stages:
+                stage.start()
+            self._started = True
+        return self
+
+    def submit(self, imap_service, batch):
+        """Queue a fetched batch; blocks while the first stage is full."""
+        self.start()
+        job = PipelineJob(imap_service.account, list(batch))
+        self.stages[0].put(job)
+        return job.future
+
+    def close(self):
+        """Drain every stage in order and stop the workers."""
+        if self._started:
+            for stage in self.stages:
+                stage.close()
+            self._started = False
+
+    def stats(self):
+        return {stage.name: {'processed': stage.processed, 'failed': stage.failed} for stage in self.stages}
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _categorize(self, job):
+        job.records = self.ingest_service.categorize(job.records)
+        return True
+
+    def _persist(self, job):
+        job.emails = self.ingest_service.persist(job.account, job.records)
+        job.future.set_result(len(job.emails))
+        return bool(job.emails)
+
+    def _index(self, job):
+        self.ingest_service.index(job.emails)
+        return True
+
+    def _notify(self, job):
+        self.ingest_service.notify(job.emails)
+        return False
@@ -1,35 +1,38 @@
 import logging
 from .vector_db_service import VectorDBService
 from .ai_service import AIService
+from .text_reduction import get_text_reducer
 from django.conf import settings
 from emails.models import Email
 
 logger = logging.getLogger(__name__)
 
+# Bump whenever the reply prompts change so saved suggestions are redrafted
+REPLY_PROMPT_VERSION = 1
+
+# Emails embedded and appended to the vector store at a time by index_all_emails
+INDEX_CHUNK_SIZE = 512
+
+def reply_version(category):
+    """Version key for a reply suggestion; it changes with the category, model or prompt."""
+    return f"{settings.OPENAI_MODEL}/{REPLY_PROMPT_VERSION}/{category}"
+
 class RAGService:
     def __init__(self):
         self.vector_db = VectorDBService()
         self.ai_service = AIService()
+        self.text_reducer = get_text_reducer()
+        self.last_index_stats = None
         
     def index_email(self, email):
-        """Index an email in the vector database."""
+        """Index an email in the vector database, replacing its previous version if it changed."""
         try:
-            # Combine subject and body for better context
-            text = f"Subject: {email.subject}\n\nBody: {email.body}"
-            
-            # Store metadata about the email
-            metadata = {
-                "email_id": email.id,
-                "sender": email.sender,
-                "recipient": email.recipient,
-                "subject": email.subject,
-                "received_date": str(email.received_date),
-                "category": email.category
-            }
+            text, metadata = self._document(email)
             
-            # Add to vector database
-            success = self.vector_db.add_document(text, metadata)
-            if success:
+            # Add to vector database; upsert_documents records the email's row in `indexed`
+            indexed = self.vector_db.indexed([email.id])
+            self.vector_db.upsert_documents([email.id], [text], [metadata], indexed)
+            if email.id in indexed:
                 logger.info(f"Successfully indexed email ID {email.id}")
                 return True
             else:
@@ -39,44 +42,136 @@ class RAGService:
             logger.error(f"Error indexing email: {e}")
             return False
     
-    def index_all_emails(self):
-        """Index all emails in the database."""
-        emails = Email.objects.all()
+    def index_all_emails(self, chunk_size=INDEX_CHUNK_SIZE, compact=False):
+        """Bring the vector database in line with the emails table.
+        
+        New and changed emails are embedded in batches, unchanged ones are
+        skipped and deleted ones are tombstoned, so a re-run only pays for
+        what changed. Returns the number of emails (re)indexed; the full
+        counts are kept in `last_index_stats`.
+        """
+        indexed = self.vector_db.indexed()
+        existing = set(indexed)
+        emails = Email.objects.order_by('id')
+        total = 0
         count = 0
-        for email in emails:
-            if self.index_email(email):
-                count += 1
-        logger.info(f"Indexed {count} out of {len(emails)} emails")
+        chunk = []
+        for email in emails.iterator(chunk_size=chunk_size):
+            total += 1
+            existing.discard(email.id)
+            chunk.append(email)
+            if len(chunk) == chunk_size:
+                count += self._index_chunk(chunk, indexed)
+                chunk = []
+        if chunk:
+            count += self._index_chunk(chunk, indexed)
+        
+        # Emails deleted since the last run, then leftovers of unkeyed or interrupted indexing
+        deleted = self.vector_db.delete_documents(existing, indexed)
+        deleted += self.vector_db.store.delete(self.vector_db.stale_rows())
+        compacted = self.vector_db.compact(force=compact)
+        # Build the search index now rather than on the first similarity search
+        self.vector_db.update_index()
+        
+        self.last_index_stats = {
+            'indexed': count,
+            'unchanged': total - count,
+            'deleted': deleted,
+            'compacted': compacted,
+        }
+        logger.info(f"Indexed {count} out of {total} emails ({deleted} deleted, {compacted} compacted away)")
         return count
     
+    def _index_chunk(self, emails, indexed):
+        documents = [self._document(email) for email in emails]
+        return self.vector_db.upsert_documents(
+            [email.id for email in emails],
+            [text for text, _ in documents],
+            [metadata for _, metadata in documents],
+            indexed,
+        )
+    
+    def _document(self, email):
+        """Text and metadata stored in the vector database for an email."""
+        # Combine subject and body for better context
+        text = f"Subject: {email.subject}\n\nBody: {email.body}"
+        
+        # Store metadata about the email
+        metadata = {
+            "email_id": email.id,
+            "sender": email.sender,
+            "recipient": email.recipient,
+            "subject": email.subject,
+            "received_date": str(email.received_date),
+            "category": email.category
+        }
+        return text, metadata
+    
     def generate_reply_suggestion(self, email_id):
         """Generate a reply suggestion for an email using RAG."""
         try:
             # Get the email
             email = Email.objects.get(id=email_id)
-            
-            # Prepare query text
-            query_text = f"Subject: {email.subject}\n\nBody: {email.body}"
-            
-            # Search for similar emails
-            similar_emails = self.vector_db.similarity_search(query_text, top_k=3)
-            
-            if not similar_emails:
-                logger.info(f"No similar emails found for email ID {email_id}")
-                # Fall back to regular AI completion without RAG
+            email.ensure_full_body()
+
+            completion = self.ai_service.get_completion(self._reply_prompt(email))
+            if completion:
+                logger.info(f"Generated RAG-based reply suggestion for email ID {email_id}")
+                return completion
+            else:
+                logger.error(f"Failed to generate RAG-based reply for email ID {email_id}")
                 return self.generate_simple_reply(email)
-            
-            # Prepare context from similar emails
-            context = self._prepare_context(similar_emails)
-            
-            # Generate reply using context
-            prompt = f"""
+        except Email.DoesNotExist:
+            logger.error(f"Email with ID {email_id} does not exist")
+            return None
+        except Exception as e:
+            logger.error(f"Error generating reply suggestion: {e}")
+            return None
+
+    def stream_reply_suggestion(self, email):
+        """Yield a RAG reply suggestion as it is generated, then save it on the email."""
+        email.ensure_full_body()
+        parts = []
+        for delta in self.ai_service.stream_completion(self._reply_prompt(email)):
+            parts.append(delta)
+            yield delta
+
+        reply = ''.join(parts).strip()
+        if reply:
+            email.reply_suggestion = reply
+            email.reply_suggestion_version = reply_version(email.category)
+            email.save(update_fields=['reply_suggestion', 'reply_suggestion_version'])
+            logger.info(f"Generated reply suggestion for email ID {email.id}")
+
+    def draft_reply(self, email):
+        """Write a reply suggestion for an email; raises LLMError rather than returning a canned reply."""
+        email.ensure_full_body()
+        return self.ai_service.get_completion(self._reply_prompt(email), fallback=False)
+
+    def _reply_prompt(self, email):
+        """Build the RAG prompt for an email, or the plain one when nothing similar is indexed."""
+        # Prepare query text
+        query_text = f"Subject: {email.subject}\n\nBody: {email.body}"
+
+        # Search for similar emails
+        similar_emails = self.vector_db.similarity_search(query_text, top_k=3)
+
+        if not similar_emails:
+            logger.info(f"No similar emails found for email ID {email.id}")
+            # Fall back to regular AI completion without RAG
+            return self._simple_reply_prompt(email)
+
+        # Prepare context from similar emails
+        context = self._prepare_context(similar_emails)
+
+        # Generate reply using context
+        return f"""
 You are an AI assistant helping to draft email replies. Use the following context from similar emails to craft a response to the current email.
 
 Current Email:
 From: {email.sender}
 Subject: {email.subject}
-Body: {email.body}
+Body: {self.text_reducer.reduce(email.body, 'reply')}
 
 Similar Email Context:
 {context}
@@ -85,39 +180,28 @@ Based on the context and the current email, draft a professional and helpful rep
 
 Reply:
 """
-            
-            completion = self.ai_service.get_completion(prompt)
-            if completion:
-                logger.info(f"Generated RAG-based reply suggestion for email ID {email_id}")
-                return completion
-            else:
-                logger.error(f"Failed to generate RAG-based reply for email ID {email_id}")
-                return self.generate_simple_reply(email)
-        except Email.DoesNotExist:
-            logger.error(f"Email with ID {email_id} does not exist")
-            return None
-        except Exception as e:
-            logger.error(f"Error generating reply suggestion: {e}")
-            return None
-    
+
     def _prepare_context(self, similar_emails):
         """Prepare context from similar emails."""
         context = ""
         for i, email_data in enumerate(similar_emails):
             context += f"--- Similar Email {i+1} (Similarity: {email_data['similarity']:.2f}) ---\n"
             context += f"Subject: {email_data['metadata'].get('subject', 'N/A')}\n"
-            context += f"Body: {email_data['text'].replace('Subject:', '').replace('Body:', '')}\n\n"
+            body = email_data['text'].replace('Subject:', '').replace('Body:', '')
+            context += f"Body: {self.text_reducer.reduce(body, 'context')}\n\n"
         return context
     
     def generate_simple_reply(self, email):
         """Generate a simple reply without RAG for fallback."""
-        prompt = f"""
+        return self.ai_service.get_completion(self._simple_reply_prompt(email))
+
+    def _simple_reply_prompt(self, email):
+        return f"""
 Draft a professional and helpful reply to the following email:
 
 From: {email.sender}
 Subject: {email.subject}
-Body: {email.body}
+Body: {self.text_reducer.reduce(email.body, 'reply')}
 
 Reply:
 """
-        return self.ai_service.get_completion(prompt) 
\ No newline at end of file
@@ -0,0 +1,155 @@
+import itertools
+import logging
+import queue
+import threading
+from datetime import timedelta
+from django.conf import settings
+from django.db import connections
+from django.db.models import Q
+from django.utils import timezone
+from ..models import Email
+from .rag_service import RAGService, reply_version
+
+logger = logging.getLogger(__name__)
+
+DRAFT_CATEGORIES = ('interested', 'meeting_booked')
+
+_STOP = None
+
+class ReplyDrafter:
+    """Drafts reply suggestions ahead of time for hot leads, newest first.
+
+    Emails wait in a priority queue ordered by received_date and `workers`
+    threads draft them, so drafting never has more than that many LLM
+    requests in flight. A draft is redone when its reply_suggestion_version
+    no longer matches the email's category and the current model and
+    prompt version.
+    """
+
+    def __init__(self, rag_service=None, workers=None, max_age_days=None, categories=DRAFT_CATEGORIES):
+        self.rag_service = rag_service or RAGService()
+        self.workers = max(1, workers or settings.REPLY_DRAFT_WORKERS)
+        self.max_age = timedelta(days=settings.REPLY_DRAFT_MAX_AGE_DAYS if max_age_days is None else max_age_days)
+        self.categories = categories
+        self.drafted = 0
+        self.failed = 0
+        self.skipped = 0
+        self._queue = queue.PriorityQueue()
+        self._queued = set()
+        self._order = itertools.count()  # tie-breaker so entries never compare email ids
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def pending(self):
+        """Emails in the draft categories without a current suggestion, newest first."""
+        stale = Q()
+        for category in self.categories:
+            stale |= Q(category=category) & ~Q(reply_suggestion_version=reply_version(category))
+        return (
+            Email.objects.filter(stale, received_date__gte=timezone.now() - self.max_age)
+            .order_by('-received_date')
+        )
+
+    def enqueue(self, emails):
+        """Queue emails that need a draft; returns how many were added."""
+        added = 0
+        with self._lock:
+            for email in emails:
+                if email.id in self._queued or not self._needs_draft(email):
+                    continue
+                self._queued.add(email.id)
+                # Newest first: the lead that just wrote in is the one a rep opens next
+                self._queue.put((-email.received_date.timestamp(), next(self._order), email.id))
+                added += 1
+        return added
+
+    def enqueue_pending(self, limit=None):
+        emails = self.pending().only('id', 'category', 'received_date', 'reply_suggestion', 'reply_suggestion_version')
+        return self.enqueue(emails[:limit] if limit else emails)
+
+    def start(self):
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f'reply-drafter-{index}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def join(self):
+        """Wait until everything queued so far has been drafted."""
+        self._queue.join()
+
+    def close(self):
+        """Stop the workers once they finish the email they are drafting."""
+        for _ in self._threads:
+            self._queue.put((float('-inf'), next(self._order), _STOP))
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'queued': len(self._queued),
+                'drafted': self.drafted,
+                'failed': self.failed,
+                'skipped': self.skipped,
+            }
+
+    def draft(self, email_id):
+        """Draft and save a suggestion for one email; returns True if one was saved."""
+        email = Email.objects.filter(id=email_id).first()
+        if email is None or not self._needs_draft(email):
+            self._count('skipped')
+            return False
+        if not self.rag_service.ai_service.llm_available():
+            # Never save a canned reply as a draft; the next pass picks the email up again
+            self._count('skipped')
+            return False
+        version = reply_version(email.category)
+        try:
+            reply = self.rag_service.draft_reply(email)
+        except Exception as e:
+            logger.error(f"Error drafting reply for email ID {email_id}: {e}")
+            self._count('failed')
+            return False
+        if not reply:
+            self._count('failed')
+            return False
+
+        # Only save if the email was not recategorized while we were drafting
+        saved = Email.objects.filter(id=email_id, category=email.category).update(
+            reply_suggestion=reply,
+            reply_suggestion_version=version,
+        )
+        self._count('drafted' if saved else 'skipped')
+        return bool(saved)
+
+    def _needs_draft(self, email):
+        return email.category in self.categories and not email.has_current_reply_suggestion()
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def _run(self):
+        try:
+            while True:
+                _, _, email_id = self._queue.get()
+                try:
+                    if email_id is _STOP:
+                        return
+                    self.draft(email_id)
+                except Exception as e:
+                    logger.error(f"Reply drafter failed on email ID {email_id}: {e}")
+                finally:
+                    with self._lock:
+                        self._queued.discard(email_id)
+                    self._queue.task_done()
+        finally:
+            connections.close_all()
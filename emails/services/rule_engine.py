@@ -0,0 +1,163 @@
+import json
+import logging
+import re
+import threading
+from django.conf import settings
+from ..models import Email
+
+logger = logging.getLogger(__name__)
+
+# Earlier rules win ties. A trailing * matches any word ending ("holiday*" -> "holidays").
+DEFAULT_RULES = [
+    {'category': 'out_of_office', 'weight': 3, 'patterns': [
+        'out of office', 'ooo', 'automatic reply', 'auto-reply', 'autoreply',
+    ]},
+    {'category': 'out_of_office', 'weight': 2, 'patterns': [
+        'vacation', 'holiday*', 'on leave', 'not available', 'away from the office',
+    ]},
+    {'category': 'out_of_office', 'weight': 1, 'patterns': ['leave', 'away']},
+    {'category': 'meeting_booked', 'weight': 3, 'patterns': [
+        'calendar invite', 'meeting confirmed', 'booked a meeting', 'google meet',
+    ]},
+    {'category': 'meeting_booked', 'weight': 2, 'patterns': ['meeting*', 'appointment*', 'zoom']},
+    {'category': 'meeting_booked', 'weight': 1, 'patterns': [
+        'schedule*', 'calendar', 'meet', 'discuss', 'call', 'teams',
+    ]},
+    {'category': 'spam', 'weight': 3, 'patterns': ['unsubscribe', 'newsletter*', 'limited time']},
+    {'category': 'spam', 'weight': 2, 'patterns': ['promotion*', 'discount*']},
+    {'category': 'spam', 'weight': 1, 'patterns': ['offer*', 'deal*', 'sale', 'marketing', 'subscribe']},
+    {'category': 'not_interested', 'weight': 4, 'patterns': [
+        'not interested', 'no interest', 'not a fit', 'no thanks', 'no thank you', 'remove me',
+    ]},
+    {'category': 'not_interested', 'weight': 2, 'patterns': ['decline*', "won't be", 'not at this time']},
+    {'category': 'not_interested', 'weight': 1, 'patterns': ['sorry', "won't", 'cannot', 'unfortunately']},
+    {'category': 'interested', 'weight': 2, 'patterns': [
+        'interest*', 'learn more', 'tell me more', 'pricing', 'demo',
+    ]},
+    {'category': 'interested', 'weight': 1, 'patterns': [
+        'inquiry', 'question*', 'tell me', 'information', 'service*', 'product*',
+    ]},
+]
+
+def _trie_pattern(phrases):
+    """Compile phrases into one regex shaped like a character trie.
+
+    Branches share their prefixes, so the engine tests a handful of first
+    characters per position instead of every phrase, and a greedy optional
+    tail makes the longest phrase win. Phrases must start and end on a
+    word boundary; the leading (?<!\\w) lets one finditer() pass skip
+    matches that would begin mid-word.
+    """
+    trie = {}
+    for phrase in phrases:
+        node = trie
+        for char in phrase:
+            node = node.setdefault(char, {})
+        node[''] = True
+
+    def emit(node):
+        branches = []
+        for char, child in sorted(node.items()):
+            if char == '':
+                continue
+            if char == '*':
+                branches.append(r'\w*')
+            elif char == ' ':
+                branches.append(r'\s+' + emit(child))
+            else:
+                branches.append(re.escape(char) + emit(child))
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        return f'(?:{body})?' if '' in node else body
+
+    return re.compile(r'(?<!\w)(?:' + emit(trie) + r')\b') if trie else re.compile(r'(?!)')
+
+class RuleEngine:
+    """Keyword categorizer compiled into a single trie-shaped regular expression.
+
+    One left-to-right scan over the lower-cased text finds whole-word
+    phrases, longest first, so "not interested" is consumed before
+    "interest*" can match inside it. Weights are added up per category;
+    the best total wins and ties go to the category listed first.
+    """
+
+    def __init__(self, rules=None):
+        rules = DEFAULT_RULES if rules is None else rules
+        self.priority = {}
+        self.exact = {}
+        self.prefixes = []
+        for rule in rules:
+            category = rule['category']
+            if category not in Email.Category.values:
+                raise ValueError(f"Unknown category in rules: {category}")
+            self.priority.setdefault(category, len(self.priority))
+            weight = float(rule.get('weight', 1))
+            for phrase in rule['patterns']:
+                phrase = ' '.join(phrase.lower().split())
+                if not phrase:
+                    continue
+                if phrase.endswith('*'):
+                    self.prefixes.append((phrase[:-1], (category, weight)))
+                else:
+                    self.exact[phrase] = (category, weight)
+        # Longest prefix first so "newsletter*" beats "news*"
+        self.prefixes.sort(key=lambda item: len(item[0]), reverse=True)
+        self.pattern = _trie_pattern(list(self.exact) + [prefix + '*' for prefix, _ in self.prefixes])
+        self._resolved = {}
+
+    @classmethod
+    def from_file(cls, path):
+        """Load rules from a JSON file: {"rules": [{"category", "weight", "patterns"}]}."""
+        with open(path, 'r') as f:
+            data = json.load(f)
+        return cls(data['rules'] if isinstance(data, dict) else data)
+
+    def _resolve(self, matched):
+        """Map matched text (e.g. "holidays", "not  interested") to its rule."""
+        rule = self._resolved.get(matched)
+        if rule is None:
+            phrase = ' '.join(matched.split())
+            rule = self.exact.get(phrase)
+            if rule is None:
+                rule = next((rule for prefix, rule in self.prefixes if phrase.startswith(prefix)), None)
+            if len(self._resolved) > 50000:
+                self._resolved.clear()
+            self._resolved[matched] = rule
+        return rule
+
+    def scores(self, text):
+        """Return {category: total weight} for the phrases found in `text`."""
+        totals = {}
+        for match in self.pattern.finditer((text or '').lower()):
+            rule = self._resolve(match.group())
+            if rule:
+                totals[rule[0]] = totals.get(rule[0], 0.0) + rule[1]
+        return totals
+
+    def categorize(self, text):
+        totals = self.scores(text)
+        if not totals:
+            return 'uncategorized'
+        return min(totals, key=lambda category: (-totals[category], self.priority[category]))
+
+    def categorize_batch(self, texts):
+        return [self.categorize(text) for text in texts]
+
+_default_engine = None
+_default_engine_lock = threading.Lock()
+
+def get_rule_engine():
+    """Return the process-wide RuleEngine, built from FALLBACK_RULES_PATH when set."""
+    global _default_engine
+    with _default_engine_lock:
+        if _default_engine is None:
+            path = settings.FALLBACK_RULES_PATH
+            engine = None
+            if path:
+                try:
+                    engine = RuleEngine.from_file(path)
+                except Exception as e:
+                    logger.error(f"Error loading fallback rules from {path}, using defaults: {e}")
+            _default_engine = engine or RuleEngine()
+        return _default_engine
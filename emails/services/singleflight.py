@@ -0,0 +1,98 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from django.conf import settings
+
+def flight_key(*parts):
+    """Hash the parts of a call (prompt, model, options...) into a key."""
+    return hashlib.sha256('\x00'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+
+class SingleFlight:
+    """Runs one call per key at a time and lets concurrent callers share its result.
+
+    Results are also remembered for `ttl` seconds (up to `max_entries`),
+    so a repeat right after the call finished is free too. Exceptions are
+    passed to everyone waiting on the call; neither they nor None results
+    are remembered, so failures are retried.
+    """
+
+    def __init__(self, ttl=None, max_entries=None):
+        self.ttl = settings.SINGLEFLIGHT_TTL_SECONDS if ttl is None else ttl
+        self.max_entries = max_entries or settings.SINGLEFLIGHT_MAX_ENTRIES
+        self.executed = 0
+        self.coalesced = 0
+        self.memo_hits = 0
+        self._calls = {}  # key -> Future of the call in flight
+        self._memo = OrderedDict()  # key -> (value, monotonic expiry)
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        """Return fn(), sharing the call with anyone else asking for `key` meanwhile."""
+        with self._lock:
+            entry = self._memo.get(key)
+            if entry is not None:
+                if entry[1] > time.monotonic():
+                    self._memo.move_to_end(key)
+                    self.memo_hits += 1
+                    return entry[0]
+                del self._memo[key]
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = Future()
+                self.executed += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            return call.result()
+
+        try:
+            value = fn()
+        except BaseException as e:
+            with self._lock:
+                del self._calls[key]
+            call.set_exception(e)
+            raise
+        with self._lock:
+            del self._calls[key]
+            if self.ttl > 0 and value is not None:
+                self._memo[key] = (value, time.monotonic() + self.ttl)
+                while len(self._memo) > self.max_entries:
+                    self._memo.popitem(last=False)
+        call.set_result(value)
+        return value
+
+    def forget(self, key):
+        """Drop a remembered result, e.g. after the underlying data changed."""
+        with self._lock:
+            self._memo.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            calls = self.executed + self.coalesced + self.memo_hits
+            return {
+                'executed': self.executed,
+                'coalesced': self.coalesced,
+                'memo_hits': self.memo_hits,
+                'saved_rate': (self.coalesced + self.memo_hits) / calls if calls else 0.0,
+                'in_flight': len(self._calls),
+                'memo_entries': len(self._memo),
+            }
+
+_groups = {}
+_groups_lock = threading.Lock()
+
+def get_singleflight(name):
+    """Return the process-wide SingleFlight for one kind of call ('completion', 'embedding', 'reply')."""
+    with _groups_lock:
+        if name not in _groups:
+            _groups[name] = SingleFlight()
+        return _groups[name]
+
+def singleflight_stats():
+    """Counters of every SingleFlight group in this process."""
+    with _groups_lock:
+        groups = dict(_groups)
+    return {name: group.stats() for name, group in groups.items()}
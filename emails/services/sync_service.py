@@ -0,0 +1,224 @@
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
+from django.conf import settings
+from django.db import connections
+from .imap_service import IMAPService
+
+logger = logging.getLogger(__name__)
+
+class SyncTimeout(Exception):
+    """Raised when an account exceeds its sync time budget."""
+
+def iter_batches(emails, max_items=None, max_bytes=None):
+    """Group a stream of parsed emails into batches bounded by count and text size."""
+    max_items = max_items or settings.IMAP_INGEST_BATCH_SIZE
+    max_bytes = max_bytes or settings.IMAP_INGEST_MAX_BATCH_BYTES
+    batch, size = [], 0
+    for email_data in emails:
+        batch.append(email_data)
+        size += len(email_data.get('body') or '') + len(email_data.get('subject') or '')
+        if len(batch) >= max_items or size >= max_bytes:
+            yield batch
+            batch, size = [], 0
+    if batch:
+        yield batch
+
+def ingest_folder(imap_service, folder, process_batch, deadline=None, on_stored=None):
+    """Stream new emails of a folder into `process_batch`, one bounded batch at a time.
+
+    `process_batch` returns the number of stored emails, or a Future of it
+    when the batch was handed to an IngestPipeline; fetching then goes on
+    while earlier batches are processed. The folder checkpoint only
+    advances, in UID order, once a batch is stored; `on_stored(count)` is
+    called at that point. Returns (fetched, processed).
+    """
+    stream = imap_service.stream_folder(folder)
+    fetched = processed = 0
+    pending = deque()  # (last uid, future) of batches still in a pipeline
+
+    def stored(uid, count):
+        nonlocal processed
+        processed += count or 0
+        stream.commit(uid)
+        if on_stored:
+            on_stored(count or 0)
+
+    def settle(wait):
+        while pending and (wait or pending[0][1].done()):
+            uid, future = pending[0]
+            timeout = max(0.0, deadline - time.monotonic()) if deadline else None
+            try:
+                count = future.result(timeout=timeout)
+            except FutureTimeoutError:
+                raise SyncTimeout(f"time budget exceeded waiting for stored emails in {folder}")
+            pending.popleft()
+            stored(uid, count)
+
+    for batch in iter_batches(stream):
+        if deadline and time.monotonic() > deadline:
+            raise SyncTimeout(f"time budget exceeded after {fetched} emails in {folder}")
+        fetched += len(batch)
+        outcome = process_batch(imap_service, batch)
+        if isinstance(outcome, Future):
+            pending.append((batch[-1]['uid'], outcome))
+            settle(wait=False)
+        else:
+            settle(wait=True)
+            stored(batch[-1]['uid'], outcome)
+    settle(wait=True)
+    stream.finish()
+    return fetched, processed
+
+class AccountSyncResult:
+    """Outcome of syncing one account."""
+
+    def __init__(self, account):
+        self.account = account
+        self.status = 'pending'
+        self.fetched = 0
+        self.processed = 0
+        self.folders = {}
+        self.duration = 0.0
+        self.error = None
+
+    def __str__(self):
+        line = (
+            f"{self.account.email}: {self.status} - fetched {self.fetched}, "
+            f"processed {self.processed} in {self.duration:.1f}s"
+        )
+        return f"{line} ({self.error})" if self.error else line
+
+class SyncEngine:
+    """Sync several IMAP accounts in parallel.
+
+    Accounts run on a thread pool of `workers`. At most `per_server`
+    connections are open to the same IMAP host at once, since providers
+    like Gmail throttle parallel logins. Each account gets `timeout`
+    seconds; the same value is used as the socket timeout so a hung
+    server cannot block its worker forever.
+
+    Within an account, the folders discovered via LIST are synced over a
+    small pool of up to `folder_connections` IMAP connections. Emails are
+    streamed into `process_batch(imap_service, batch)` in bounded batches;
+    pass IngestPipeline.submit to overlap processing with fetching.
+    """
+
+    def __init__(self, process_batch, workers=None, per_server=None, timeout=None, folder_connections=None):
+        self.process_batch = process_batch
+        self.workers = workers or settings.IMAP_SYNC_WORKERS
+        self.per_server = per_server or settings.IMAP_MAX_CONNECTIONS_PER_SERVER
+        self.timeout = timeout or settings.IMAP_ACCOUNT_TIMEOUT
+        self.folder_connections = folder_connections or settings.IMAP_FOLDER_CONNECTIONS
+        self._server_slots = {}
+        self._lock = threading.Lock()
+
+    def run(self, accounts):
+        """Sync all accounts and return one AccountSyncResult per account, in order."""
+        accounts = list(accounts)
+        if not accounts:
+            return []
+
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(accounts)), thread_name_prefix='imap-sync') as executor:
+            futures = [executor.submit(self.sync_account, account) for account in accounts]
+            return [future.result() for future in futures]
+
+    @contextmanager
+    def _server_slot(self, server):
+        with self._lock:
+            slot = self._server_slots.setdefault(server.lower(), threading.BoundedSemaphore(self.per_server))
+        with slot:
+            yield
+
+    def sync_account(self, account):
+        """Fetch and process new emails in every configured folder of one account."""
+        result = AccountSyncResult(account)
+        with self._server_slot(account.imap_server):
+            start = time.monotonic()
+            deadline = start + self.timeout
+            imap_service = IMAPService(account, timeout=self.timeout)
+            opened = [imap_service]
+            try:
+                folders = imap_service.discover_folders()
+                errors = self._sync_folders(account, folders, imap_service, opened, result, deadline)
+                if errors:
+                    raise RuntimeError('; '.join(errors))
+
+                account.update_last_sync()
+                result.status = 'ok'
+            except SyncTimeout as e:
+                result.status = 'timeout'
+                result.error = str(e)
+            except Exception as e:
+                result.status = 'error'
+                result.error = str(e)
+                logger.error(f"Error syncing account {account.email}: {e}")
+            finally:
+                for service in opened:
+                    service.disconnect()
+                result.duration = time.monotonic() - start
+                # Worker threads open their own DB connections
+                connections.close_all()
+        return result
+
+    def _sync_folders(self, account, folders, first_service, opened, result, deadline):
+        """Sync folders concurrently over a small pool of connections; returns error messages."""
+        idle = queue.SimpleQueue()
+        idle.put(first_service)
+        lock = threading.Lock()
+
+        def sync_folder(folder):
+            try:
+                imap_service = idle.get_nowait()
+            except queue.Empty:
+                imap_service = IMAPService(account, timeout=self.timeout)
+                with lock:
+                    opened.append(imap_service)
+            def on_stored(count):
+                with lock:
+                    result.processed += count
+
+            def process(imap_service, batch):
+                outcome = self.process_batch(imap_service, batch)
+                with lock:
+                    result.fetched += len(batch)
+                    result.folders[folder] = result.folders.get(folder, 0) + len(batch)
+                return outcome
+
+            try:
+                with lock:
+                    result.folders.setdefault(folder, 0)
+                ingest_folder(imap_service, folder, process, deadline, on_stored)
+            except Exception:
+                # A broken connection must not be handed to the next folder
+                imap_service.disconnect()
+                raise
+            finally:
+                idle.put(imap_service)
+
+        def sync_folder_in_pool(folder):
+            try:
+                sync_folder(folder)
+            finally:
+                connections.close_all()
+
+        if len(folders) <= 1:
+            for folder in folders:
+                sync_folder(folder)
+            return []
+
+        errors = []
+        with ThreadPoolExecutor(max_workers=min(self.folder_connections, len(folders)), thread_name_prefix='imap-folder') as executor:
+            futures = {executor.submit(sync_folder_in_pool, folder): folder for folder in folders}
+            for future, folder in futures.items():
+                try:
+                    future.result()
+                except SyncTimeout:
+                    raise
+                except Exception as e:
+                    errors.append(f"{folder}: {e}")
+        return errors
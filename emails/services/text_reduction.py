@@ -0,0 +1,206 @@
+import logging
+import re
+import threading
+from urllib.parse import urlsplit
+from django.conf import settings
+from .llm_client import estimate_tokens
+
+try:
+    import tiktoken
+except ImportError:  # optional: token counts fall back to estimate_tokens
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+# Where quoted history starts: "On Mon, 3 Jun 2024, Alex <a@b.c> wrote:" (possibly
+# wrapped over two lines), Outlook's "-----Original Message-----" and header blocks
+QUOTE_HEADER = re.compile(
+    r'^(?:'
+    r'on\b[^\n]{0,300}(?:\n[^\n]{0,300})?\bwrote:[ \t]*$'
+    r'|-{2,}[ \t]*(?:original message|forwarded message)[ \t]*-{2,}'
+    r'|_{10,}[ \t]*$'
+    r'|from:[^\n]*\n(?:[^\n]*\n){0,3}?(?:sent|date):'
+    r')',
+    re.IGNORECASE | re.MULTILINE,
+)
+QUOTED_LINE = re.compile(r'^[ \t]*>[^\n]*(?:\n|$)', re.MULTILINE)
+# "-- " is the standard signature delimiter; mobile clients add their own line
+SIGNATURE_DELIMITER = re.compile(r'^(?:--[ \t]*|sent from my [^\n]*)$', re.IGNORECASE | re.MULTILINE)
+SIGN_OFF = re.compile(
+    r'^[ \t]*(?:(?:best|kind|warm|warmest)(?: regards)?|regards|cheers|thanks|many thanks|'
+    r'thank you|sincerely|yours(?: truly| sincerely)?|all the best)[ \t]*[,.!]?[ \t]*$',
+    re.IGNORECASE | re.MULTILINE,
+)
+LEGAL_FOOTER = re.compile(
+    r'confidential|privileged|intended (?:solely )?for the (?:use|addressee)|intended recipient'
+    r'|if you have received this (?:e-?mail|message) in error|disclaimer',
+    re.IGNORECASE,
+)
+URL = re.compile(r'https?://[^\s<>"\')\]]+', re.IGNORECASE)
+BLANK_LINES = re.compile(r'\n[ \t]*\n(?:[ \t]*\n)+')
+TRAILING_SPACE = re.compile(r'[ \t]+$', re.MULTILINE)
+
+# Lines allowed after a sign-off for it to count as the start of the signature
+SIGNATURE_MAX_LINES = 6
+# Signature lines: contact details, or names and titles ("Alex Morgan", "Head of Sales, Acme Inc.")
+CONTACT_DETAIL = re.compile(r'@|https?://|www\.|\+?\d[\d ()./-]{6,}')
+NAME_CONNECTORS = {'of', 'and', 'at', 'for', 'from', 'the', 'de', 'van', 'von'}
+
+def strip_quoted(text):
+    """Drop quoted reply history: everything from the first quote header, and "> " lines."""
+    match = QUOTE_HEADER.search(text)
+    if match and text[:match.start()].strip():
+        text = text[:match.start()]
+    return QUOTED_LINE.sub('', text)
+
+def is_signature_line(line):
+    """True for lines that look like a name, title or contact details rather than a sentence."""
+    line = line.strip()
+    if not line:
+        return True
+    if len(line) > 80:
+        return False
+    if CONTACT_DETAIL.search(line):
+        return True
+    if line[-1] in '?!' or re.search(r'[a-z]{2}[.!?]\s+\w', line):
+        return False
+    words = re.findall(r"[^\W\d_][\w'’.-]*", line)
+    return bool(words) and all(word[0].isupper() or word.lower() in NAME_CONNECTORS for word in words)
+
+def strip_signature(text):
+    """Cut the signature block: a "-- " delimiter, or a sign-off followed only by name and contact lines."""
+    match = SIGNATURE_DELIMITER.search(text)
+    if match and text[:match.start()].strip():
+        text = text[:match.start()]
+    for match in SIGN_OFF.finditer(text):
+        rest = text[match.end():].strip().splitlines()
+        # "Thanks.\nNot interested, please remove me." is the message, not a signature
+        if len(rest) <= SIGNATURE_MAX_LINES and all(is_signature_line(line) for line in rest):
+            if text[:match.start()].strip():
+                return text[:match.start()]
+            break
+    return text
+
+def strip_legal_footers(text):
+    """Remove paragraphs that read like confidentiality notices and disclaimers."""
+    paragraphs = re.split(r'\n[ \t]*\n', text)
+    kept = [p for p in paragraphs if not (len(p) > 80 and LEGAL_FOOTER.search(p))]
+    return '\n\n'.join(kept) if kept else text
+
+def shorten_urls(text, max_chars):
+    """Replace URLs longer than `max_chars` (tracking links mostly) with their host."""
+    def shorten(match):
+        url = match.group()
+        if len(url) <= max_chars:
+            return url
+        parts = urlsplit(url)
+        return f'{parts.scheme}://{parts.netloc}/…' if parts.netloc else url[:max_chars] + '…'
+    return URL.sub(shorten, text)
+
+class TextReducer:
+    """Shrinks email text before it goes into a prompt and keeps count of the tokens saved.
+
+    reduce() strips quoted history, signatures, legal footers and long
+    URLs, then cuts the result to the token limit of the task
+    ('categorize', 'reply' or 'context'). Tokens are counted with tiktoken
+    when it is installed, otherwise estimated.
+    """
+
+    def __init__(self, limits=None, enabled=None, url_max_chars=None):
+        self.limits = limits or {
+            'categorize': settings.PROMPT_TOKENS_CATEGORIZE,
+            'reply': settings.PROMPT_TOKENS_REPLY,
+            'context': settings.PROMPT_TOKENS_CONTEXT,
+        }
+        self.enabled = settings.PROMPT_REDUCTION_ENABLED if enabled is None else enabled
+        self.url_max_chars = url_max_chars or settings.PROMPT_URL_MAX_CHARS
+        self._encoding = None
+        self._encoding_loaded = False
+        self._counters = {}  # task -> [calls, tokens in, tokens out]
+        self._lock = threading.Lock()
+
+    def clean(self, text):
+        """Strip everything that costs tokens without telling the model anything."""
+        text = strip_quoted(text)
+        text = strip_legal_footers(text)
+        text = strip_signature(text)
+        text = shorten_urls(text, self.url_max_chars)
+        text = TRAILING_SPACE.sub('', text)
+        return BLANK_LINES.sub('\n\n', text).strip()
+
+    def reduce(self, text, task):
+        """Clean `text` and fit it into the token limit for `task`."""
+        text = text or ''
+        if not text:
+            return text
+        limit = self.limits[task]
+        # Nothing past this point can survive the budget, so don't scan it
+        raw = text[:limit * 16]
+        reduced = self.clean(raw) if self.enabled else raw
+        reduced = self.truncate(reduced, limit)
+
+        before = self.count_tokens(raw) + (len(text) - len(raw)) // 4
+        after = self.count_tokens(reduced)
+        with self._lock:
+            counters = self._counters.setdefault(task, [0, 0, 0])
+            counters[0] += 1
+            counters[1] += before
+            counters[2] += after
+        return reduced
+
+    def count_tokens(self, text):
+        encoding = self._get_encoding()
+        if encoding is None:
+            return estimate_tokens(text)
+        return len(encoding.encode(text, disallowed_special=()))
+
+    def truncate(self, text, limit):
+        """Keep the opening of `text` within `limit` tokens."""
+        encoding = self._get_encoding()
+        if encoding is not None:
+            tokens = encoding.encode(text, disallowed_special=())
+            if len(tokens) <= limit:
+                return text
+            return encoding.decode(tokens[:limit]).rstrip() + ' […]'
+        if estimate_tokens(text) <= limit:
+            return text
+        cut = text[:limit * 4]
+        # Prefer not to end mid-word
+        space = cut.rfind(' ', len(cut) // 2)
+        return (cut[:space] if space > 0 else cut).rstrip() + ' […]'
+
+    def _get_encoding(self):
+        if not self._encoding_loaded:
+            self._encoding_loaded = True
+            if tiktoken is not None:
+                try:
+                    try:
+                        self._encoding = tiktoken.encoding_for_model(settings.OPENAI_MODEL)
+                    except KeyError:
+                        self._encoding = tiktoken.get_encoding('cl100k_base')
+                except Exception as e:
+                    logger.warning(f"Could not load tiktoken encoding, estimating tokens: {e}")
+        return self._encoding
+
+    def stats(self):
+        with self._lock:
+            return {
+                task: {
+                    'calls': calls,
+                    'tokens_in': tokens_in,
+                    'tokens_out': tokens_out,
+                    'tokens_saved': tokens_in - tokens_out,
+                }
+                for task, (calls, tokens_in, tokens_out) in self._counters.items()
+            }
+
+_default_reducer = None
+_default_reducer_lock = threading.Lock()
+
+def get_text_reducer():
+    """Return the process-wide TextReducer, so token savings are counted in one place."""
+    global _default_reducer
+    with _default_reducer_lock:
+        if _default_reducer is None:
+            _default_reducer = TextReducer()
+        return _default_reducer
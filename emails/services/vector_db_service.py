@@ -1,77 +1,60 @@
-import os
+import hashlib
 import json
 import numpy as np
 from pathlib import Path
-from sklearn.metrics.pairwise import cosine_similarity
+from django.conf import settings
 import logging
-from transformers import AutoTokenizer, AutoModel
-import torch
+from .embedding_runtime import get_embedding_runtime
+from .singleflight import flight_key, get_singleflight
+from .vector_index import get_vector_index
+from .vector_store import VectorStore
 
 logger = logging.getLogger(__name__)
 
+# The JSON file vectors used to be kept in; migrate_vectors moves it into the VectorStore
+LEGACY_VECTORS_FILE = 'vectors.json'
+
+def content_hash(text, metadata=None):
+    """64-bit hash of a document, stored with its row to tell whether it changed."""
+    payload = json.dumps([text, metadata or {}], sort_keys=True, ensure_ascii=False, default=str)
+    return int.from_bytes(hashlib.blake2b(payload.encode('utf-8'), digest_size=8).digest(), 'little')
+
 class VectorDBService:
     def __init__(self):
-        self.data_path = Path("./data/vector_db")
-        self.data_path.mkdir(parents=True, exist_ok=True)
-        self.vectors_file = self.data_path / "vectors.json"
-        self.vectors = self._load_vectors()
+        self.data_path = Path(settings.VECTOR_DB_PATH)
+        self.store = VectorStore(self.data_path)
+        self.index = get_vector_index(self.data_path)
+        if not self.store.count and (self.data_path / LEGACY_VECTORS_FILE).exists():
+            logger.warning(
+                f"Found {LEGACY_VECTORS_FILE} but the vector store is empty; run `python manage.py migrate_vectors`"
+            )
         
-        # Initialize model for embeddings
-        try:
-            self.tokenizer = AutoTokenizer.from_pretrained("sentence-transformers/all-MiniLM-L6-v2")
-            self.model = AutoModel.from_pretrained("sentence-transformers/all-MiniLM-L6-v2")
-            self.device = "cuda" if torch.cuda.is_available() else "cpu"
-            self.model.to(self.device)
-            logger.info(f"Vector DB initialized with model on {self.device}")
-        except Exception as e:
-            logger.error(f"Error initializing embedding model: {e}")
-            self.tokenizer = None
-            self.model = None
+        # The model is loaded once per process, on first use
+        self.runtime = get_embedding_runtime()
     
-    def _load_vectors(self):
-        """Load vectors from file."""
-        if not self.vectors_file.exists():
-            return []
+    def get_embedding(self, text):
+        """Convert text to embedding vector."""
+        if not self.runtime.load():
+            logger.error("Embedding model not initialized")
+            return None
         
         try:
-            with open(self.vectors_file, 'r') as f:
-                return json.load(f)
-        except Exception as e:
-            logger.error(f"Error loading vectors: {e}")
-            return []
-    
-    def _save_vectors(self):
-        """Save vectors to file."""
-        try:
-            with open(self.vectors_file, 'w') as f:
-                json.dump(self.vectors, f)
-            return True
+            # The same text embedded twice in a row (similar_emails, then suggest_reply) is computed once
+            return get_singleflight('embedding').do(flight_key(text), lambda: self.runtime.embed(text))
         except Exception as e:
-            logger.error(f"Error saving vectors: {e}")
-            return False
+            logger.error(f"Error generating embedding: {e}")
+            return None
     
-    def get_embedding(self, text):
-        """Convert text to embedding vector."""
-        if not self.tokenizer or not self.model:
+    def get_embeddings(self, texts, batch_size=None):
+        """Convert many texts to a (len(texts), dim) array in batches, or None on failure."""
+        if not self.runtime.load():
             logger.error("Embedding model not initialized")
             return None
         
         try:
-            # Tokenize and get model outputs
-            inputs = self.tokenizer(text, padding=True, truncation=True, return_tensors="pt").to(self.device)
-            with torch.no_grad():
-                outputs = self.model(**inputs)
-            
-            # Mean pooling
-            attention_mask = inputs['attention_mask']
-            token_embeddings = outputs.last_hidden_state
-            input_mask_expanded = attention_mask.unsqueeze(-1).expand(token_embeddings.size()).float()
-            embeddings = torch.sum(token_embeddings * input_mask_expanded, 1) / torch.clamp(input_mask_expanded.sum(1), min=1e-9)
-            
-            # Convert to list for JSON serialization
-            return embeddings[0].cpu().numpy().tolist()
+            return self.runtime.embed_batch(texts, batch_size)
         except Exception as e:
-            logger.error(f"Error generating embedding: {e}")
+            logger.error(f"Error generating embeddings: {e}")
             return None
     
     def add_document(self, text, metadata=None):
@@ -83,46 +66,149 @@ class VectorDBService:
         if not embedding:
             return False
         
-        doc_id = len(self.vectors)
-        self.vectors.append({
-            "id": doc_id,
-            "text": text,
-            "embedding": embedding,
-            "metadata": metadata
-        })
+        try:
+            self.store.append(np.asarray([embedding], dtype=np.float32), [{"text": text, "metadata": metadata}])
+            return True
+        except Exception as e:
+            logger.error(f"Error saving vectors: {e}")
+            return False
+    
+    def add_documents(self, texts, metadatas=None):
+        """Embed documents in batches and add them with a single append; returns how many were added."""
+        texts = list(texts)
+        if not texts:
+            return 0
+        metadatas = metadatas or [{}] * len(texts)
+        
+        embeddings = self.get_embeddings(texts)
+        if embeddings is None:
+            return 0
+        
+        try:
+            records = [{"text": text, "metadata": metadata or {}} for text, metadata in zip(texts, metadatas)]
+            self.store.append(embeddings, records)
+            return len(records)
+        except Exception as e:
+            logger.error(f"Error saving vectors: {e}")
+            return 0
+    
+    def indexed(self, keys=None):
+        """Map each key in the store, or only the given keys, to the (row, content hash) of its live row."""
+        self.store.refresh()
+        labels = self.store.keys()
+        live = (labels['key'] > 0) & ~self.store.deleted_mask()
+        if keys is not None:
+            live &= np.isin(labels['key'], np.asarray(list(keys), dtype=labels['key'].dtype))
+        return {int(labels['key'][row]): (int(row), int(labels['hash'][row])) for row in np.flatnonzero(live)}
+    
+    def stale_rows(self):
+        """Live rows no key points to: added without a key (before upserts), or superseded
+        by a newer row of the same key when an upsert was interrupted before its delete."""
+        self.store.refresh()
+        keys = self.store.keys()['key']
+        live = np.flatnonzero(~self.store.deleted_mask())
+        keyed = live[keys[live] > 0]
+        # The last row of each key is current
+        _, last = np.unique(keys[keyed][::-1], return_index=True)
+        current = keyed[::-1][last]
+        return np.setdiff1d(live, current)
+    
+    def upsert_documents(self, keys, texts, metadatas, indexed=None):
+        """Add or replace documents by key; ones whose content hash is unchanged are skipped.
+        
+        Returns how many were written. `indexed` is the result
+        of indexed(), passed in by callers upserting many chunks.
+        """
+        if indexed is None:
+            indexed = self.indexed()
+        hashes = [content_hash(text, metadata) for text, metadata in zip(texts, metadatas)]
+        changed = [i for i, (key, hash) in enumerate(zip(keys, hashes)) if indexed.get(key, (None, None))[1] != hash]
+        if not changed:
+            return 0
         
-        return self._save_vectors()
+        # Metadata-only changes (e.g. a new category) reuse the stored vector
+        embeddings = [None] * len(changed)
+        previous = [(position, indexed[keys[i]][0]) for position, i in enumerate(changed) if keys[i] in indexed]
+        if previous:
+            stored = self.store.vectors()
+            for (position, row), record in zip(previous, self.store.records([row for _, row in previous])):
+                if record["text"] == texts[changed[position]]:
+                    embeddings[position] = stored[row]
+        
+        to_embed = [position for position, embedding in enumerate(embeddings) if embedding is None]
+        if to_embed:
+            computed = self.get_embeddings([texts[changed[position]] for position in to_embed])
+            if computed is None:
+                return 0
+            for position, embedding in zip(to_embed, computed):
+                embeddings[position] = embedding
+        
+        try:
+            rows = self.store.append(
+                np.asarray(embeddings, dtype=np.float32),
+                [{"text": texts[i], "metadata": metadatas[i] or {}} for i in changed],
+                keys=[keys[i] for i in changed],
+                hashes=[hashes[i] for i in changed],
+            )
+            # Only retire the old rows once their replacements are committed
+            self.store.delete(self._rows_of(indexed, [keys[i] for i in changed]))
+            for i, row in zip(changed, rows):
+                indexed[keys[i]] = (row, hashes[i])
+            return len(changed)
+        except Exception as e:
+            logger.error(f"Error saving vectors: {e}")
+            return 0
+    
+    def delete_documents(self, keys, indexed=None):
+        """Tombstone the rows of the given keys; returns how many were deleted."""
+        if indexed is None:
+            indexed = self.indexed()
+        rows = self._rows_of(indexed, keys)
+        for key in keys:
+            indexed.pop(key, None)
+        return self.store.delete(rows)
+    
+    def _rows_of(self, indexed, keys):
+        """Rows `indexed` has for the keys, skipping any that no longer hold that key (compacted meanwhile)."""
+        stored = self.store.keys()['key']
+        pairs = [(indexed[key][0], key) for key in keys if key in indexed]
+        return [row for row, key in pairs if row < len(stored) and stored[row] == key]
+    
+    def compact(self, force=False):
+        """Drop deleted rows once they make up VECTOR_COMPACT_DELETED_RATIO of the store (or always with force)."""
+        self.store.refresh()
+        if not self.store.deleted:
+            return 0
+        if not force and self.store.deleted < settings.VECTOR_COMPACT_DELETED_RATIO * self.store.count:
+            return 0
+        return self.store.compact()
+    
+    def update_index(self):
+        """Add newly stored vectors to the search index and write it to disk."""
+        self.index.sync(self.store)
+        self.index.save(self.store)
     
     def similarity_search(self, query, top_k=3):
         """Search for similar documents."""
-        if not self.vectors:
+        self.store.refresh()
+        if not self.store.count:
             return []
         
         query_embedding = self.get_embedding(query)
         if not query_embedding:
             return []
         
-        # Convert query embedding to numpy array
-        query_embedding = np.array(query_embedding).reshape(1, -1)
-        
-        # Get all document embeddings
-        doc_embeddings = np.array([doc["embedding"] for doc in self.vectors])
-        
-        # Calculate similarities
-        similarities = cosine_similarity(query_embedding, doc_embeddings)[0]
-        
-        # Get indices of top_k most similar documents
-        top_indices = np.argsort(similarities)[::-1][:top_k]
+        # The index follows rows appended by any process and only touches the candidates it visits
+        similarities, top_indices = self.index.search(self.store, query_embedding, top_k)
         
         # Return top_k documents with their similarity scores
         results = []
-        for idx in top_indices:
-            doc = self.vectors[idx]
+        for idx, similarity, doc in zip(top_indices, similarities, self.store.records(top_indices)):
             results.append({
-                "id": doc["id"],
+                "id": int(idx),
                 "text": doc["text"],
-                "similarity": float(similarities[idx]),
+                "similarity": float(similarity),
                 "metadata": doc["metadata"]
             })
         
-        return results 
\ No newline at end of file
+        return results
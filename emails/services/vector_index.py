@@ -0,0 +1,345 @@
+import logging
+import os
+from abc import ABC, abstractmethod
+import threading
+import time
+from pathlib import Path
+import numpy as np
+from django.conf import settings
+from .vector_store import VectorStore
+
+try:
+    import faiss
+except ImportError:  # optional: without it every index kind falls back to brute force
+    faiss = None
+
+logger = logging.getLogger(__name__)
+
+# Rows read from the store at a time while adding or scanning, to bound memory
+CHUNK_ROWS = 65536
+
+def normalize(vectors):
+    """Return float32 copies of the rows scaled to unit length, so inner product is cosine similarity."""
+    vectors = np.array(vectors, dtype=np.float32, ndmin=2)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+class BruteForceIndex:
+    """Exact search: scans the store's memory-mapped vectors on every query.
+
+    Only the row norms are kept in memory, so there is nothing to persist.
+    """
+
+    kind = 'brute'
+    persistent = False
+
+    def __init__(self, dim):
+        self.dim = dim
+        self._norms = np.empty(0, dtype=np.float32)
+
+    @property
+    def count(self):
+        return len(self._norms)
+
+    def needs_rebuild(self, total):
+        return False
+
+    def train(self, sample):
+        pass
+
+    def add(self, vectors):
+        norms = np.linalg.norm(np.asarray(vectors, dtype=np.float32), axis=1)
+        self._norms = np.concatenate([self._norms, np.maximum(norms, 1e-12)])
+
+    def search(self, query, k, vectors):
+        query = normalize(query)[0]
+        scores = np.empty(self.count, dtype=np.float32)
+        for start in range(0, self.count, CHUNK_ROWS):
+            end = min(start + CHUNK_ROWS, self.count)
+            scores[start:end] = (vectors[start:end] @ query) / self._norms[start:end]
+        k = min(k, self.count)
+        if not k:
+            return np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int64)
+        # Partial selection instead of sorting every score
+        rows = np.argpartition(-scores, k - 1)[:k]
+        rows = rows[np.argsort(-scores[rows])]
+        return scores[rows], rows
+
+class FaissIndex(ABC):
+    """Approximate search with a FAISS inner-product index over normalized vectors."""
+
+    persistent = True
+
+    def __init__(self, dim, index=None):
+        self.dim = dim
+        self.index = index
+
+    @property
+    def count(self):
+        return self.index.ntotal if self.index is not None else 0
+
+    def needs_rebuild(self, total):
+        return False
+
+    def train(self, sample):
+        pass
+
+    def add(self, vectors):
+        if self.index is None:
+            self.index = self._create()
+        self.index.add(normalize(vectors))
+
+    def search(self, query, k, vectors):
+        if not self.count:
+            return np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int64)
+        self._tune()
+        scores, rows = self.index.search(normalize(query), min(k, self.count))
+        found = rows[0] >= 0
+        return scores[0][found], rows[0][found]
+
+    def save(self, path):
+        tmp = Path(str(path) + '.tmp')
+        faiss.write_index(self.index, str(tmp))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path, dim):
+        index = faiss.read_index(str(path))
+        if index.d != dim:
+            raise ValueError(f"Index dimension {index.d} does not match the store ({dim})")
+        return cls(dim, index)
+
+    @abstractmethod
+    def _create(self):
+        """Return a new, empty FAISS index for `dim`-dimensional normalized vectors."""
+
+    def _tune(self):
+        pass
+
+class HNSWIndex(FaissIndex):
+    """Graph index: no training, rows can be added one at a time."""
+
+    kind = 'hnsw'
+
+    def _create(self):
+        index = faiss.IndexHNSWFlat(self.dim, settings.VECTOR_INDEX_HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = settings.VECTOR_INDEX_HNSW_EF_CONSTRUCTION
+        return index
+
+    def _tune(self):
+        self.index.hnsw.efSearch = settings.VECTOR_INDEX_HNSW_EF_SEARCH
+
+class IVFIndex(FaissIndex):
+    """Inverted file index: clusters rows into `nlist` lists and scans `nprobe` of them per query.
+
+    The clusters are learned from the rows present when the index is built,
+    so it is rebuilt once the store has grown enough to afford twice as many.
+    """
+
+    kind = 'ivf'
+    # FAISS wants about this many training rows per cluster
+    ROWS_PER_LIST = 39
+
+    def needs_rebuild(self, total):
+        return self.index is not None and self.nlist_for(total) >= 2 * self.index.nlist
+
+    @staticmethod
+    def nlist_for(total):
+        return max(1, min(settings.VECTOR_INDEX_IVF_NLIST, total // IVFIndex.ROWS_PER_LIST))
+
+    def train(self, sample):
+        self.index = self._create(self.nlist_for(len(sample)))
+        self.index.train(normalize(sample))
+
+    def _create(self, nlist=1):
+        quantizer = faiss.IndexFlatIP(self.dim)
+        return faiss.IndexIVFFlat(quantizer, self.dim, nlist, faiss.METRIC_INNER_PRODUCT)
+
+    def add(self, vectors):
+        if self.index is None:
+            self.train(vectors)
+        super().add(vectors)
+
+    def _tune(self):
+        self.index.nprobe = min(settings.VECTOR_INDEX_IVF_NPROBE, self.index.nlist)
+
+BACKENDS = {backend.kind: backend for backend in (BruteForceIndex, HNSWIndex, IVFIndex)}
+
+class VectorIndex:
+    """Keeps a search backend in step with a VectorStore and persists it next to the vectors.
+
+    Rows of the store are the index ids. sync() adds the rows appended since
+    the last call (by this or another process), and the index file is
+    rewritten every VECTOR_INDEX_SAVE_EVERY added rows; rows missing from a
+    saved file are simply added again when it is loaded. Deleted rows stay
+    in the index and are filtered out of results; compacting the store
+    starts a new generation, which is indexed from scratch.
+
+    A query adds at most VECTOR_INDEX_MAX_QUERY_ROWS missing rows itself.
+    When the index is further behind (e.g. no saved file yet), it is built
+    in a background thread and queries use exact search until it is done.
+    """
+
+    def __init__(self, path, kind=None):
+        self.path = Path(path)
+        kind = kind or settings.VECTOR_INDEX
+        if kind not in BACKENDS:
+            raise ValueError(f"Unknown vector index {kind!r}; expected one of {', '.join(BACKENDS)}")
+        if kind != 'brute' and faiss is None:
+            logger.warning(f"faiss is not installed, using brute-force search instead of {kind}")
+            kind = 'brute'
+        self.kind = kind
+        self.backend = None
+        self.generation = None
+        self.unsaved = 0
+        self.builder = None
+        self._exact = None
+        self._exact_generation = None
+        self._lock = threading.Lock()
+
+    def file(self, store):
+        return store.file(f'index.{self.kind}.faiss')
+
+    def sync(self, store):
+        """Bring the index up to the store's committed rows."""
+        store.refresh()
+        with self._lock:
+            self._sync(store)
+
+    def search(self, store, query, k):
+        """Return (similarities, rows) of the k live rows most similar to query, best first."""
+        store.refresh()
+        with self._lock:
+            if self._behind(store):
+                self._build_in_background(store.path)
+                backend = self._exact_backend(store)
+            else:
+                self._sync(store)
+                backend = self.backend
+            vectors = store.vectors()
+            if not store.deleted:
+                return backend.search(query, k, vectors)
+            deleted = store.deleted_mask()
+            # Ask for more than k and drop deleted rows, widening until enough are left
+            fetch = 2 * k
+            while True:
+                similarities, rows = backend.search(query, fetch, vectors)
+                live = ~deleted[rows]
+                if live.sum() >= k or fetch >= backend.count:
+                    return similarities[live][:k], rows[live][:k]
+                fetch *= 4
+
+    def save(self, store):
+        with self._lock:
+            if self.backend is not None and self.backend.persistent and self.unsaved:
+                self._save(store)
+
+    def _sync(self, store):
+        # Caller holds the lock
+        if self._stale(store):
+            self.backend = self._open(store)
+            self.generation = store.generation
+            self.unsaved = 0
+        if self.backend.needs_rebuild(store.count):
+            logger.info(f"Rebuilding {self.kind} index for {store.count} vectors")
+            self.backend = BACKENDS[self.kind](store.dim)
+        if self.backend.count < store.count:
+            self.unsaved += self._catch_up(self.backend, store)
+        if self.backend.persistent and self.unsaved >= settings.VECTOR_INDEX_SAVE_EVERY:
+            self._save(store)
+
+    def _stale(self, store):
+        return (self.backend is None or self.generation != store.generation
+                or self.backend.dim != store.dim or self.backend.count > store.count)
+
+    def _behind(self, store):
+        """Whether a query would have to build much of the index itself; caller holds the lock."""
+        if self.kind == 'brute':
+            return False
+        if self._stale(store):
+            self.backend = self._open(store)
+            self.generation = store.generation
+            self.unsaved = 0
+        return (self.backend.needs_rebuild(store.count)
+                or store.count - self.backend.count > settings.VECTOR_INDEX_MAX_QUERY_ROWS)
+
+    def _build_in_background(self, path):
+        # Caller holds the lock
+        if self.builder is None or not self.builder.is_alive():
+            self.builder = threading.Thread(target=self._build, args=(path,), name='vector-index-build', daemon=True)
+            self.builder.start()
+
+    def _build(self, path):
+        """Catch up a copy of the index outside the lock, then swap it in."""
+        try:
+            store = VectorStore(path)
+            backend = self._open(store)
+            if backend.needs_rebuild(store.count):
+                backend = BACKENDS[self.kind](store.dim)
+            start = time.monotonic()
+            added = self._catch_up(backend, store)
+            logger.info(f"Built {self.kind} index for {store.count} vectors in {time.monotonic() - start:.1f}s")
+            with self._lock:
+                if self.generation != store.generation or self.backend.count >= backend.count:
+                    return  # compacted or caught up meanwhile
+                self.backend = backend
+                self.unsaved = added
+                self._exact = None
+                self._save(store)
+        except Exception as e:
+            logger.error(f"Error building {self.kind} index for {path}: {e}")
+
+    def _exact_backend(self, store):
+        """Brute-force search over the same rows, used while the index is being built."""
+        if (self._exact is None or self._exact_generation != store.generation
+                or self._exact.dim != store.dim or self._exact.count > store.count):
+            self._exact = BruteForceIndex(store.dim)
+            self._exact_generation = store.generation
+        self._catch_up(self._exact, store)
+        return self._exact
+
+    def _open(self, store):
+        backend_class = BACKENDS[self.kind]
+        file = self.file(store)
+        if backend_class.persistent and file.exists():
+            try:
+                backend = backend_class.load(file, store.dim)
+                if backend.count <= store.count:
+                    return backend
+                logger.warning(f"{file} has more rows than the vector store; rebuilding it")
+            except Exception as e:
+                logger.error(f"Error loading {file}, rebuilding it: {e}")
+        return backend_class(store.dim)
+
+    def _catch_up(self, backend, store):
+        """Add the store rows the backend is missing; returns how many were added."""
+        vectors = store.vectors()
+        if not backend.count and backend.kind == 'ivf':
+            # Learn the clusters from a sample of everything rather than the first chunk
+            sample_size = min(store.count, settings.VECTOR_INDEX_IVF_NLIST * 256)
+            sample = np.sort(np.random.default_rng(0).choice(store.count, sample_size, replace=False))
+            backend.train(vectors[sample])
+        added = store.count - backend.count
+        for start in range(backend.count, store.count, CHUNK_ROWS):
+            backend.add(vectors[start:min(start + CHUNK_ROWS, store.count)])
+        return added
+
+    def _save(self, store):
+        if store.generation != self.generation:
+            return  # compacted meanwhile; the next sync rebuilds for the new generation
+        try:
+            self.backend.save(self.file(store))
+            self.unsaved = 0
+        except Exception as e:
+            logger.error(f"Error saving {self.file(store)}: {e}")
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def get_vector_index(path, kind=None):
+    """Return the process-wide VectorIndex for a vector store directory."""
+    key = (str(Path(path).resolve()), kind or settings.VECTOR_INDEX)
+    with _indexes_lock:
+        if key not in _indexes:
+            _indexes[key] = VectorIndex(path, kind)
+        return _indexes[key]
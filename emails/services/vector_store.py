@@ -0,0 +1,283 @@
+import json
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # not on Windows; appends are then only serialized within one process
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+
+# Per-row key (0 for rows added without one) and 64-bit content hash
+KEY_DTYPE = np.dtype([('key', '<i8'), ('hash', '<u8')])
+
+class VectorStore:
+    """Append-only float32 vectors in a memory-mapped file, with a JSON-lines sidecar.
+
+    Layout of the directory:
+        manifest.json   format, dimension, generation and number of committed rows
+        vectors.f32     row-major float32 matrix, `dim` values per row
+        records.jsonl   one JSON record (text and metadata) per row
+        records.idx     uint64 end offset of each record in records.jsonl
+        keys.bin        key and content hash of each row (KEY_DTYPE)
+        deleted.u8      one byte per row, 1 once the row is deleted
+
+    An append writes and fsyncs the data files, then commits by atomically
+    replacing the manifest. Rows past the manifest's count are leftovers
+    of an append that crashed; readers ignore them and the next append
+    overwrites them. Deleted rows stay in place until compact() copies the
+    live rows into a new generation of the data files (named gen<N>-*).
+    """
+
+    MANIFEST = 'manifest.json'
+    VECTORS = 'vectors.f32'
+    RECORDS = 'records.jsonl'
+    OFFSETS = 'records.idx'
+    KEYS = 'keys.bin'
+    DELETED = 'deleted.u8'
+    DATA_FILES = (VECTORS, RECORDS, OFFSETS, KEYS, DELETED)
+
+    def __init__(self, path, dim=None):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.dim = dim
+        self.count = 0
+        self.deleted = 0
+        self.generation = 0
+        self._manifest_stamp = None
+        self._reset_maps()
+        self._lock = threading.Lock()
+        self.refresh()
+
+    def refresh(self):
+        """Pick up rows committed since the store was opened (by this or another process)."""
+        manifest_file = self.path / self.MANIFEST
+        try:
+            stat = manifest_file.stat()
+        except FileNotFoundError:
+            return
+        stamp = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if stamp == self._manifest_stamp:
+            return
+        with open(manifest_file, 'r') as f:
+            manifest = json.load(f)
+        if manifest.get('format') != FORMAT_VERSION:
+            raise ValueError(f"Unsupported vector store format in {self.path}: {manifest.get('format')}")
+        self.dim = manifest['dim']
+        self.count = manifest['count']
+        self.deleted = manifest.get('deleted', 0)
+        self.generation = manifest.get('generation', 0)
+        self._manifest_stamp = stamp
+        self._reset_maps()
+
+    def file(self, name):
+        """Path of a data file in the current generation."""
+        return self.path / (f'gen{self.generation}-{name}' if self.generation else name)
+
+    def vectors(self):
+        """The committed vectors as a read-only (count, dim) memory map."""
+        if self._vectors is None:
+            if not self.count:
+                return np.empty((0, self.dim or 0), dtype=np.float32)
+            self._vectors = np.memmap(self.file(self.VECTORS), dtype=np.float32, mode='r', shape=(self.count, self.dim))
+        return self._vectors
+
+    def records(self, rows):
+        """Return the records stored for the given row numbers, in that order."""
+        offsets = self._get_offsets()
+        records = []
+        with open(self.file(self.RECORDS), 'rb') as f:
+            for row in rows:
+                start = int(offsets[row - 1]) if row else 0
+                f.seek(start)
+                records.append(json.loads(f.read(int(offsets[row]) - start)))
+        return records
+
+    def keys(self):
+        """Key and content hash of every committed row (key 0 when the row has none)."""
+        if self._keys is None:
+            size = self.file(self.KEYS).stat().st_size if self.file(self.KEYS).exists() else 0
+            if not self.count or size < self.count * KEY_DTYPE.itemsize:
+                # Rows written before keys existed; the next append fills the file in
+                return np.zeros(self.count, dtype=KEY_DTYPE)
+            self._keys = np.memmap(self.file(self.KEYS), dtype=KEY_DTYPE, mode='r', shape=(self.count,))
+        return self._keys
+
+    def deleted_mask(self):
+        """Boolean array marking the committed rows that were deleted."""
+        if not self.deleted:
+            return np.zeros(self.count, dtype=bool)
+        if self._deleted is None:
+            self._deleted = np.fromfile(self.file(self.DELETED), dtype=np.uint8, count=self.count).astype(bool)
+        return self._deleted
+
+    def append(self, vectors, records, keys=None, hashes=None):
+        """Append rows and commit them; returns the row numbers they got.
+
+        `keys` (positive integers) and `hashes` (unsigned 64-bit) optionally
+        label each row so callers can find and replace it later.
+        """
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if vectors.ndim != 2 or len(vectors) != len(records):
+            raise ValueError("append() needs one vector per record")
+        if not len(records):
+            return range(self.count, self.count)
+        labels = np.zeros(len(records), dtype=KEY_DTYPE)
+        if keys is not None:
+            labels['key'] = keys
+        if hashes is not None:
+            labels['hash'] = hashes
+
+        with self._lock, self._file_lock():
+            self.refresh()
+            dim = self.dim or vectors.shape[1]
+            if vectors.shape[1] != dim:
+                raise ValueError(f"Vector dimension {vectors.shape[1]} does not match the store ({dim})")
+            count = self.count
+            end = int(self._get_offsets()[-1]) if count else 0
+
+            lines = [json.dumps(record, ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b'\n' for record in records]
+            ends = end + np.cumsum([len(line) for line in lines], dtype=np.uint64)
+            # Writing at the committed size drops whatever a crashed append left behind
+            self._write_at(self.VECTORS, count * dim * 4, vectors.tobytes())
+            self._write_at(self.RECORDS, end, b''.join(lines))
+            self._write_at(self.OFFSETS, count * 8, ends.astype(np.uint64).tobytes())
+            # Truncating to the committed size zero-fills rows from before keys and deletions existed
+            self._write_at(self.KEYS, count * KEY_DTYPE.itemsize, labels.tobytes())
+            self._write_at(self.DELETED, count, bytes(len(records)))
+            self._commit(dim, count + len(records), self.deleted, self.generation)
+            return range(count, count + len(records))
+
+    def delete(self, rows):
+        """Mark rows as deleted; they are skipped by searches and dropped by compact()."""
+        rows = np.unique(np.asarray(list(rows), dtype=np.int64))
+        if not len(rows):
+            return 0
+        with self._lock, self._file_lock():
+            self.refresh()
+            rows = rows[(rows >= 0) & (rows < self.count)]
+            rows = rows[~self.deleted_mask()[rows]]
+            if not len(rows):
+                return 0
+            fd = os.open(self.file(self.DELETED), os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                if os.fstat(fd).st_size < self.count:
+                    os.ftruncate(fd, self.count)
+                for row in rows:
+                    os.pwrite(fd, b'\x01', int(row))
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            self._commit(self.dim, self.count, self.deleted + len(rows), self.generation)
+            return len(rows)
+
+    def compact(self, chunk_rows=10000):
+        """Copy the live rows into a new generation of files and drop the old one.
+
+        Row numbers change, so indexes over the store must be rebuilt;
+        returns the number of rows dropped.
+        """
+        with self._lock, self._file_lock():
+            self.refresh()
+            if not self.deleted:
+                return 0
+            old = VectorStore(self.path)
+            live = np.flatnonzero(~old.deleted_mask())
+            vectors, keys = old.vectors(), old.keys()
+
+            self.generation += 1
+            self.count = 0
+            self._reset_maps()
+            try:
+                end = 0
+                for start in range(0, len(live), chunk_rows):
+                    rows = live[start:start + chunk_rows]
+                    lines = [
+                        json.dumps(record, ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b'\n'
+                        for record in old.records(rows)
+                    ]
+                    ends = end + np.cumsum([len(line) for line in lines], dtype=np.uint64)
+                    self._write_at(self.VECTORS, start * self.dim * 4, np.ascontiguousarray(vectors[rows]).tobytes())
+                    self._write_at(self.RECORDS, end, b''.join(lines))
+                    self._write_at(self.OFFSETS, start * 8, ends.tobytes())
+                    self._write_at(self.KEYS, start * KEY_DTYPE.itemsize, np.ascontiguousarray(keys[rows]).tobytes())
+                    end = int(ends[-1])
+                self._write_at(self.DELETED, 0, bytes(len(live)))
+                self._commit(self.dim, len(live), 0, self.generation)
+            except BaseException:
+                # The manifest still names the old generation; go back to it
+                self._manifest_stamp = None
+                self.refresh()
+                raise
+            dropped = old.count - len(live)
+
+            # Open memory maps keep the old files readable until their owners refresh
+            for name in self.DATA_FILES:
+                old.file(name).unlink(missing_ok=True)
+            for stale in self.path.glob(f'gen{old.generation}-*' if old.generation else 'index.*'):
+                stale.unlink(missing_ok=True)
+            logger.info(f"Compacted {self.path}: dropped {dropped} deleted rows, {len(live)} remain")
+            return dropped
+
+    def _write_at(self, name, offset, data):
+        fd = os.open(self.file(name), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            os.ftruncate(fd, offset)
+            os.lseek(fd, offset, os.SEEK_SET)
+            view = memoryview(data)
+            while view:
+                written = os.write(fd, view)
+                view = view[written:]
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _commit(self, dim, count, deleted, generation):
+        tmp = self.path / (self.MANIFEST + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump({
+                'format': FORMAT_VERSION,
+                'dim': dim,
+                'count': count,
+                'dtype': 'float32',
+                'deleted': deleted,
+                'generation': generation,
+            }, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path / self.MANIFEST)
+        self._manifest_stamp = None
+        self.refresh()
+
+    def _reset_maps(self):
+        self._vectors = None
+        self._offsets = None
+        self._keys = None
+        self._deleted = None
+
+    def _get_offsets(self):
+        if self._offsets is None:
+            if not self.count:
+                return np.empty(0, dtype=np.uint64)
+            self._offsets = np.memmap(self.file(self.OFFSETS), dtype=np.uint64, mode='r', shape=(self.count,))
+        return self._offsets
+
+    @contextmanager
+    def _file_lock(self):
+        """Serialize appends between processes sharing the directory."""
+        if fcntl is None:
+            yield
+            return
+        with open(self.path / '.lock', 'w') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
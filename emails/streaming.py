@@ -0,0 +1,44 @@
+"""Server-Sent Events helpers for streaming API responses."""
+import json
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+from rest_framework.renderers import BaseRenderer
+
+def sse_event(event, data):
+    """Format one SSE message with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+class EventStreamRenderer(BaseRenderer):
+    """Lets DRF accept `Accept: text/event-stream`; errors are sent as an `error` event."""
+    media_type = 'text/event-stream'
+    format = 'sse'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return sse_event('error', data).encode(self.charset)
+
+async def _iterate_in_thread(events):
+    """Pull a sync iterator one item at a time without blocking the event loop."""
+    done = object()
+    pull = sync_to_async(next)
+    while True:
+        event = await pull(events, done)
+        if event is done:
+            return
+        yield event
+
+def event_stream_response(request, events):
+    """Stream `events` (an iterator of sse_event strings) as text/event-stream.
+
+    Under ASGI the iterator is consumed from the sync thread item by item;
+    handing Django a sync iterator there would buffer the whole response.
+    """
+    events = iter(events)
+    if isinstance(getattr(request, '_request', request), ASGIRequest):
+        events = _iterate_in_thread(events)
+    response = StreamingHttpResponse(events, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,58 @@
+"""Synthetic sales inbox traffic for benchmarks."""
+import random
+
+TEMPLATES = {
+    'interested': [
+        ('Re: your proposal', "Thanks for reaching out. I'd like to learn more about your product and its pricing."),
+        ('Question about the platform', 'We have a few questions about the service. Could you send more information?'),
+        ('Re: quick intro', 'This looks interesting. Can you tell me more about how onboarding works?'),
+        ('Re: your proposal', "Sorry for the slow reply. Yes, we'd like to see a demo and your pricing."),
+        ('Re: follow up', "Could we discuss the pricing? I'd love to learn more about the product."),
+    ],
+    'meeting_booked': [
+        ('Meeting confirmed', 'Great, the meeting is booked for Tuesday at 10am. I sent a calendar invite.'),
+        ('Re: call next week', "Let's schedule a call on Thursday. Here is the Zoom link for our appointment."),
+    ],
+    'not_interested': [
+        ('Re: your proposal', "Thanks, but we're not interested at this time. Please remove me from your list."),
+        ('Re: follow up', 'Unfortunately this is not a fit for us. No thanks, and good luck.'),
+        ('Re: intro', 'We went another way, so please leave us off your list. Not interested.'),
+    ],
+    'spam': [
+        ('Limited time offer!', 'Huge discount on all plans this week only. Click to unsubscribe from this newsletter.'),
+        ('Your weekly newsletter', 'Our latest promotions and deals, picked for you. Unsubscribe anytime.'),
+    ],
+    'out_of_office': [
+        ('Automatic reply: your proposal', 'I am out of office until Monday with limited access to email.'),
+        ('Out of Office', 'I am on vacation and will reply when I am back. For urgent matters contact my colleague.'),
+    ],
+    'uncategorized': [
+        ('Invoice #4411', 'Please find attached the invoice for last month. Payment terms are 30 days.'),
+        ('Re: shipping update', 'The package left the warehouse yesterday and should arrive by Friday.'),
+    ],
+}
+
+FILLER = [
+    'As mentioned in my previous email, our team has grown quite a bit this year.',
+    'We are currently reviewing several vendors for the next quarter.',
+    'Our offices are in Berlin and Toronto, and most of the team works remotely.',
+    'The current setup has been in place for about three years.',
+    'I have copied my colleague who handles procurement on our side.',
+]
+
+SIGNATURE = '\n\nBest regards,\nAlex Morgan\nHead of Operations\n+1 555 0100'
+
+def synthetic_emails(count, seed=0, filler_sentences=(2, 8)):
+    """Yield `count` dicts with subject, body, sender and the intended category."""
+    rng = random.Random(seed)
+    categories = list(TEMPLATES)
+    for index in range(count):
+        category = rng.choice(categories)
+        subject, opening = rng.choice(TEMPLATES[category])
+        filler = ' '.join(rng.choice(FILLER) for _ in range(rng.randint(*filler_sentences)))
+        yield {
+            'subject': subject,
+            'body': f'{opening}\n\n{filler}{SIGNATURE}',
+            'sender': f'contact{index}@example{index % 97}.com',
+            'category': category,
+        }
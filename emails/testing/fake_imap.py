@@ -0,0 +1,300 @@
+"""Minimal in-process IMAP server used by the tests and benchmarks."""
+import email
+import re
+import select
+import socketserver
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+
+
+class FakeMailbox:
+    """A folder on the fake server: a UIDVALIDITY plus (uid, raw) messages."""
+
+    def __init__(self, uidvalidity=1, flags=()):
+        self.uidvalidity = uidvalidity
+        self.flags = flags
+        self.uidnext = 1
+        self.messages = []
+
+    def append(self, raw):
+        """Append a raw RFC822 message and return its UID."""
+        uid = self.uidnext
+        self.uidnext += 1
+        self.messages.append((uid, raw))
+        return uid
+
+    def renumber(self, uidvalidity):
+        """Simulate the server discarding UIDs (new UIDVALIDITY)."""
+        self.uidvalidity = uidvalidity
+        self.uidnext = 1
+        messages, self.messages = self.messages, []
+        for _, raw in messages:
+            self.append(raw)
+
+    def max_uid(self):
+        return self.messages[-1][0] if self.messages else 0
+
+
+class FakeIMAPServer:
+    """Threaded plain-text IMAP server speaking just enough of RFC 3501."""
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0):
+        self.mailboxes = {'INBOX': FakeMailbox()}
+        self.command_counts = Counter()
+        self.latency = latency  # simulated round-trip time per command
+        self._server = _ThreadingTCPServer((host, port), _IMAPHandler)
+        self._server.fake = self
+        self._thread = None
+
+    @property
+    def host(self):
+        return self._server.server_address[0]
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    def mailbox(self, name='INBOX', flags=()):
+        if name not in self.mailboxes:
+            self.mailboxes[name] = FakeMailbox(flags=flags)
+        return self.mailboxes[name]
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def make_message(index, subject=None, body=None, date=None, sender='lead@example.com'):
+    """Build a small plain-text RFC822 message for the fake server."""
+    date = date or datetime.now().astimezone()
+    return (
+        f"Message-ID: <fake-{index}@example.com>\r\n"
+        f"From: {sender}\r\n"
+        f"To: sales@example.com\r\n"
+        f"Subject: {subject or f'Message {index}'}\r\n"
+        f"Date: {email.utils.format_datetime(date)}\r\n"
+        f"Content-Type: text/plain; charset=utf-8\r\n"
+        f"\r\n"
+        f"{body or f'Body of message {index}.'}\r\n"
+    ).encode()
+
+
+class _ThreadingTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _IMAPHandler(socketserver.StreamRequestHandler):
+    # Buffer responses and flush once per command, like a real server, so
+    # benchmarks measure round trips rather than one tiny write per line
+    wbufsize = -1
+
+    def handle(self):
+        self.fake = self.server.fake
+        self.selected = None
+        self.send(b'* OK FakeIMAP ready')
+        self.wfile.flush()
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                break
+            tag, _, rest = line.rstrip(b'\r\n').decode().partition(' ')
+            command, _, args = rest.partition(' ')
+            command = command.upper()
+            if command == 'UID':
+                sub, _, args = args.partition(' ')
+                command = f'UID {sub.upper()}'
+            self.fake.command_counts[command] += 1
+            if self.fake.latency:
+                time.sleep(self.fake.latency)
+            handler = getattr(self, 'do_' + command.replace(' ', '_'), None)
+            if handler is None:
+                self.send(f'{tag} BAD unknown command {command}')
+                self.wfile.flush()
+                continue
+            done = handler(tag, args) is False
+            self.wfile.flush()
+            if done:
+                break
+
+    def send(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        self.wfile.write(data + b'\r\n')
+
+    def do_CAPABILITY(self, tag, args):
+        self.send('* CAPABILITY IMAP4rev1 IDLE UIDPLUS')
+        self.send(f'{tag} OK CAPABILITY completed')
+
+    def do_LOGIN(self, tag, args):
+        self.send(f'{tag} OK LOGIN completed')
+
+    def do_NOOP(self, tag, args):
+        self.send(f'{tag} OK NOOP completed')
+
+    def do_LOGOUT(self, tag, args):
+        self.send('* BYE logging out')
+        self.send(f'{tag} OK LOGOUT completed')
+        return False
+
+    def do_LIST(self, tag, args):
+        for name, mailbox in self.fake.mailboxes.items():
+            flags = ' '.join(mailbox.flags) or '\\HasNoChildren'
+            self.send(f'* LIST ({flags}) "/" "{name}"')
+        self.send(f'{tag} OK LIST completed')
+
+    def do_SELECT(self, tag, args):
+        name = _unquote(args.strip())
+        if name not in self.fake.mailboxes:
+            self.send(f'{tag} NO no such mailbox')
+            return
+        self.selected = self.fake.mailboxes[name]
+        self.send(f'* {len(self.selected.messages)} EXISTS')
+        self.send(f'* OK [UIDVALIDITY {self.selected.uidvalidity}] UIDs valid')
+        self.send(f'* OK [UIDNEXT {self.selected.uidnext}] next UID')
+        self.send(f'{tag} OK [READ-ONLY] SELECT completed')
+
+    do_EXAMINE = do_SELECT
+
+    def do_IDLE(self, tag, args):
+        self.send('+ idling')
+        self.wfile.flush()
+        seen = len(self.selected.messages)
+        while True:
+            readable, _, _ = select.select([self.connection], [], [], 0.05)
+            if readable:
+                line = self.rfile.readline()
+                break
+            if len(self.selected.messages) > seen:
+                seen = len(self.selected.messages)
+                self.send(f'* {seen} EXISTS')
+                self.wfile.flush()
+        if not line:
+            return False
+        self.send(f'{tag} OK IDLE terminated')
+
+    def do_UID_SEARCH(self, tag, args):
+        tokens = args.replace('(', ' ').replace(')', ' ').split()
+        uids = [uid for uid, _ in self.selected.messages]
+        i = 0
+        while i < len(tokens):
+            key = tokens[i].upper()
+            if key == 'SINCE':
+                since = datetime.strptime(tokens[i + 1], '%d-%b-%Y').date()
+                uids = [uid for uid in uids if self._date(uid) >= since]
+                i += 2
+            elif key == 'HEADER':
+                name, value = tokens[i + 1], _unquote(tokens[i + 2])
+                uids = [uid for uid in uids if self._header(uid, name) == value]
+                i += 3
+            elif key == 'UID':
+                wanted = set(self._resolve(tokens[i + 1]))
+                uids = [uid for uid in uids if uid in wanted]
+                i += 2
+            else:
+                i += 1
+        self.send('* SEARCH ' + ' '.join(str(uid) for uid in uids))
+        self.send(f'{tag} OK SEARCH completed')
+
+    def do_UID_FETCH(self, tag, args):
+        message_set, _, items = args.partition(' ')
+        wanted = set(self._resolve(message_set))
+        requested = FETCH_ITEM_PATTERN.findall(items.upper())
+        for seq, (uid, raw) in enumerate(self.selected.messages, start=1):
+            if uid not in wanted:
+                continue
+            msg = email.message_from_bytes(raw)
+            parts = [f'UID {uid}'.encode()]
+            for item, section, origin, length in requested:
+                if item == 'BODYSTRUCTURE':
+                    parts.append(b'BODYSTRUCTURE ' + _bodystructure(msg).encode())
+                elif item == 'RFC822':
+                    parts.append(b'RFC822 ' + _literal(raw))
+                elif item.startswith('BODY'):
+                    data = _section(raw, msg, section)
+                    name = f'BODY[{section}]'
+                    if origin:
+                        data = data[int(origin):int(origin) + int(length)]
+                        name += f'<{origin}>'
+                    parts.append(name.encode() + b' ' + _literal(data))
+            self.wfile.write(b'* %d FETCH (' % seq + b' '.join(parts) + b')\r\n')
+        self.send(f'{tag} OK FETCH completed')
+
+    def _date(self, uid):
+        return parsedate_to_datetime(self._header(uid, 'Date')).date()
+
+    def _header(self, uid, name):
+        raw = dict(self.selected.messages)[uid]
+        return email.message_from_bytes(raw)[name]
+
+    def _resolve(self, message_set):
+        """Expand a UID sequence set, including the `n:*` quirk of RFC 3501."""
+        highest = self.selected.max_uid()
+        uids = []
+        for part in message_set.split(','):
+            if ':' in part:
+                lo, hi = (highest if v == '*' else int(v) for v in part.split(':'))
+                lo, hi = min(lo, hi), max(lo, hi)
+                uids.extend(uid for uid, _ in self.selected.messages if lo <= uid <= hi)
+            else:
+                uids.append(highest if part == '*' else int(part))
+        return uids
+
+
+FETCH_ITEM_PATTERN = re.compile(r'(BODYSTRUCTURE|RFC822|BODY(?:\.PEEK)?\[([^\]]*)\](?:<(\d+)\.(\d+)>)?)')
+
+
+def _literal(data):
+    return b'{%d}\r\n' % len(data) + data
+
+
+def _section(raw, msg, section):
+    """Return the raw bytes of a BODY[...] section of a message."""
+    if not section:
+        return raw
+    if section.startswith('HEADER.FIELDS'):
+        names = section[section.index('(') + 1:section.rindex(')')].split()
+        lines = [f'{name}: {msg[name]}' for name in names if msg[name] is not None]
+        return ('\r\n'.join(lines) + '\r\n\r\n').encode()
+    part = msg
+    for index in section.split('.'):
+        if part.is_multipart():
+            part = part.get_payload()[int(index) - 1]
+    return part.get_payload(decode=False).encode()
+
+
+def _bodystructure(part):
+    """Render a BODYSTRUCTURE for a message built with the email package."""
+    if part.is_multipart():
+        children = ''.join(_bodystructure(child) for child in part.get_payload())
+        return f'({children} "{part.get_content_subtype().upper()}")'
+    params = ' '.join(f'"{key.upper()}" "{value}"' for key, value in part.get_params()[1:])
+    payload = part.get_payload(decode=False).encode()
+    encoding = (part.get('Content-Transfer-Encoding') or '7BIT').upper()
+    structure = (
+        f'("{part.get_content_maintype().upper()}" "{part.get_content_subtype().upper()}" '
+        f'{f"({params})" if params else "NIL"} NIL NIL "{encoding}" {len(payload)}'
+    )
+    if part.get_content_maintype() == 'text':
+        structure += ' %d' % payload.count(b'\n')
+    return structure + ')'
+
+
+def _unquote(value):
+    if len(value) >= 2 and value[0] == value[-1] == '"':
+        return re.sub(r'\\(.)', r'\1', value[1:-1])
+    return value
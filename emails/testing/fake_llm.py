@@ -0,0 +1,216 @@
+"""Local OpenAI-compatible chat completions server used by the tests and benchmarks."""
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+EMAIL_BLOCK = re.compile(r'### Email (\d+)\nSubject: ([^\n]*)\nFrom: [^\n]*\nBody:\n(.*?)(?=\n### Email \d+\n|\Z)', re.DOTALL)
+
+REPLY = (
+    "Hi,\n\nThank you for getting back to us. I'd be glad to walk you through the platform "
+    "and answer any questions about pricing and onboarding. Would Tuesday or Thursday "
+    "afternoon work for a 30 minute call?\n\nBest regards,\nSam"
+)
+
+def default_answer(prompt):
+    """Categorize batched prompts with the rule engine; answer anything else with a stock reply."""
+    blocks = EMAIL_BLOCK.findall(prompt)
+    if not blocks:
+        return REPLY
+    from emails.services.rule_engine import get_rule_engine
+
+    engine = get_rule_engine()
+    return json.dumps({'results': [
+        {'id': int(position), 'category': engine.categorize(f'{subject} {body}')}
+        for position, subject, body in blocks
+    ]})
+
+class FakeLLMServer:
+    """Threaded HTTP server answering POST /v1/chat/completions like the OpenAI API.
+
+    Each request waits `latency` seconds plus an exponentially distributed
+    extra with mean `jitter` before the first token, then `token_latency`
+    per token. `error_rate` and `rate_limit_rate` are the chances of
+    answering 500 or 429 (with Retry-After), and above `max_concurrent`
+    requests in flight every new one gets a 429. `answer(prompt)` produces
+    the reply text. Point OPENAI_BASE_URL at `base_url` to use it.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, jitter=0.0, token_latency=0.0,
+                 error_rate=0.0, rate_limit_rate=0.0, retry_after=0.1, max_concurrent=0,
+                 answer=None, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.token_latency = token_latency
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.max_concurrent = max_concurrent
+        self.answer = answer or default_answer
+        self.counts = Counter()
+        self.active = 0
+        self.peak_active = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), _LLMHandler)
+        self._server.daemon_threads = True
+        self._server.fake = self
+        self._thread = None
+
+    @property
+    def host(self):
+        return self._server.server_address[0]
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    @property
+    def base_url(self):
+        return f'http://{self.host}:{self.port}/v1'
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _admit(self):
+        """Decide the fate of a new request: None to serve it, or an error status."""
+        with self._lock:
+            self.counts['requests'] += 1
+            roll = self._random.random()
+            if self.max_concurrent and self.active >= self.max_concurrent:
+                status = 429
+            elif roll < self.rate_limit_rate:
+                status = 429
+            elif roll < self.rate_limit_rate + self.error_rate:
+                status = 500
+            else:
+                self.active += 1
+                self.peak_active = max(self.peak_active, self.active)
+                return None, self._delay()
+            self.counts[status] += 1
+            return status, 0.0
+
+    def _delay(self):
+        return self.latency + (self._random.expovariate(1 / self.jitter) if self.jitter else 0.0)
+
+    def _release(self):
+        with self._lock:
+            self.active -= 1
+
+
+class _LLMHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        fake = self.server.fake
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            request = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            return self._json(400, _error('Invalid JSON body', 'invalid_request_error'))
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            return self._json(404, _error(f'Unknown path {self.path}', 'invalid_request_error'))
+
+        status, delay = fake._admit()
+        if status == 429:
+            return self._json(429, _error('Rate limit reached', 'requests', 'rate_limit_exceeded'),
+                              {'Retry-After': str(fake.retry_after)})
+        if status:
+            return self._json(status, _error('The server had an error', 'server_error'))
+
+        try:
+            time.sleep(delay)
+            messages = request.get('messages') or [{}]
+            text = fake.answer(messages[-1].get('content') or '')
+            model = request.get('model', 'fake')
+            if request.get('stream'):
+                with fake._lock:
+                    fake.counts['stream'] += 1
+                self._stream(model, text, fake.token_latency)
+            else:
+                with fake._lock:
+                    fake.counts['chat'] += 1
+                time.sleep(fake.token_latency * len(_tokens(text)))
+                self._json(200, {
+                    'id': f'chatcmpl-{uuid.uuid4().hex}',
+                    'object': 'chat.completion',
+                    'created': int(time.time()),
+                    'model': model,
+                    'choices': [{
+                        'index': 0,
+                        'message': {'role': 'assistant', 'content': text},
+                        'finish_reason': 'stop',
+                    }],
+                    'usage': {'prompt_tokens': 0, 'completion_tokens': len(_tokens(text)), 'total_tokens': 0},
+                })
+        finally:
+            fake._release()
+
+    def _stream(self, model, text, token_latency):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        chunk_id = f'chatcmpl-{uuid.uuid4().hex}'
+        created = int(time.time())
+
+        def send(delta, finish_reason=None):
+            chunk = {
+                'id': chunk_id,
+                'object': 'chat.completion.chunk',
+                'created': created,
+                'model': model,
+                'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}],
+            }
+            self.wfile.write(f'data: {json.dumps(chunk)}\n\n'.encode())
+            self.wfile.flush()
+
+        send({'role': 'assistant', 'content': ''})
+        for token in _tokens(text):
+            if token_latency:
+                time.sleep(token_latency)
+            send({'content': token})
+        send({}, 'stop')
+        self.wfile.write(b'data: [DONE]\n\n')
+        self.wfile.flush()
+
+    def _json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def _tokens(text):
+    """Split text into word-sized pieces that join back to the original."""
+    return re.findall(r'\s*\S+|\s+', text)
+
+def _error(message, type, code=None):
+    return {'error': {'message': message, 'type': type, 'param': None, 'code': code}}
@@ -3,6 +3,7 @@ from django.urls import reverse
 from rest_framework.test import APIClient
 from rest_framework import status
 from .models import EmailAccount, Email
+from .services.rag_service import reply_version
 import json
 from datetime import datetime, timedelta
 from django.utils import timezone
@@ -90,6 +91,23 @@ class EmailViewsTests(TestCase):
         account_emails = Email.objects.filter(account=self.account)
         self.assertEqual(account_emails.count(), 16)  # 15 original emails + 1 sent email
     
+    def test_suggest_reply_stream_sends_saved_reply(self):
+        """Test that the streaming endpoint sends an existing suggestion as SSE without calling the LLM."""
+        email = self.emails[0]
+        email.reply_suggestion = 'Thanks, Tuesday works for us.'
+        email.reply_suggestion_version = reply_version(email.category)
+        email.save(update_fields=['reply_suggestion', 'reply_suggestion_version'])
+
+        response = self.client.get(
+            f'/emails/api/emails/{email.id}/suggest_reply_stream/',
+            HTTP_ACCEPT='text/event-stream',
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        body = b''.join(response.streaming_content).decode()
+        self.assertIn('event: delta\ndata: {"text": "Thanks, Tuesday works for us."}', body)
+        self.assertIn('event: done\ndata: {"reply": "Thanks, Tuesday works for us.", "cached": true}', body)
+
     def test_similar_emails_api(self):
         """Test the similar emails API endpoint."""
         # This is a basic test since the actual implementation depends on the vector DB
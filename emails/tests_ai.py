@@ -0,0 +1,626 @@
+from django.test import TestCase, TransactionTestCase
+from types import SimpleNamespace
+import json
+import re
+from datetime import timedelta
+from django.utils import timezone
+from .models import CategoryCacheEntry, Email, EmailAccount
+from .services.ai_service import AIService
+from .services.text_reduction import TextReducer, strip_signature
+from .services.llm_client import CircuitBreaker, CircuitOpenError, LLMClient, LLMError, TokenBucket
+from .services.category_cache import CategoryCache, cache_key
+from .services.local_classifier import CentroidClassifier, TieredCategorizer
+from .services.rule_engine import RuleEngine
+from .services.reply_drafter import ReplyDrafter
+from .testing.fake_llm import FakeLLMServer
+from .services.singleflight import SingleFlight, get_singleflight
+import threading
+import asyncio
+import httpx
+import numpy as np
+import openai
+import os
+import tempfile
+import time
+
+def completion(content):
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+def fake_client(answer, **options):
+    """An LLMClient whose provider is `answer(prompt)`; prompts sent are kept in .prompts."""
+    prompts = []
+
+    async def create(**kwargs):
+        prompt = kwargs['messages'][-1]['content']
+        prompts.append(prompt)
+        return completion(answer(prompt))
+
+    options.setdefault('requests_per_minute', 0)
+    options.setdefault('tokens_per_minute', 0)
+    client = LLMClient(api_key='test', create=create, **options)
+    client.prompts = prompts
+    return client
+
+def rate_limit_error():
+    request = httpx.Request('POST', 'https://api.openai.com/v1/chat/completions')
+    response = httpx.Response(429, request=request, headers={'retry-after': '0'})
+    return openai.RateLimitError('Rate limit reached', response=response, body=None)
+
+def label_by_subject(prompt):
+    """Answer with the category named in each email's subject."""
+    results = [
+        {'id': int(position), 'category': subject}
+        for position, subject in re.findall(r'### Email (\d+)\nSubject: (\S+)', prompt)
+    ]
+    return json.dumps({'results': results})
+
+class BatchCategorizationTests(TestCase):
+    """Tests for batched LLM categorization."""
+
+    def service(self, answer):
+        service = AIService(category_cache=CategoryCache(), client=fake_client(answer))
+        self.addCleanup(service.client.close)
+        return service
+
+    def test_backfill_uses_few_requests(self):
+        """Test that a large backfill is packed into a few dozen requests."""
+        service = self.service(label_by_subject)
+        emails = [
+            {'subject': 'interested', 'sender': 'a@example.com', 'body': f"Tell me more about {chr(97 + i % 26)}{chr(97 + i // 26)}"}
+            for i in range(500)
+        ]
+
+        with self.settings(OPENAI_CATEGORIZE_BATCH_SIZE=20):
+            categories = service.categorize_batch(emails)
+
+        self.assertEqual(categories, ['interested'] * 500)
+        self.assertEqual(len(service.client.prompts), 25)
+
+    def test_token_budget_splits_requests(self):
+        """Test that long emails are split across requests by the token budget."""
+        service = self.service(label_by_subject)
+        emails = [{'subject': 'spam', 'sender': 'a@example.com', 'body': c * 2000} for c in 'wxyz']
+
+        with self.settings(OPENAI_CATEGORIZE_BATCH_TOKENS=900, OPENAI_CATEGORIZE_BODY_CHARS=2000):
+            service.categorize_batch(emails)
+
+        self.assertEqual(len(service.client.prompts), 4)
+
+    def test_only_failed_items_are_retried(self):
+        """Test that invalid labels are retried alone and then fall back to uncategorized."""
+        def answer(prompt):
+            # The first email always gets a label that is not a category
+            return label_by_subject(prompt).replace('"bogus"', '"maybe"')
+
+        service = self.service(answer)
+        emails = [
+            {'subject': 'bogus', 'sender': 'a@example.com', 'body': ''},
+            {'subject': 'spam', 'sender': 'b@example.com', 'body': ''},
+            {'subject': 'out_of_office', 'sender': 'c@example.com', 'body': ''},
+        ]
+
+        with self.settings(OPENAI_CATEGORIZE_RETRIES=2):
+            categories = service.categorize_batch(emails)
+
+        self.assertEqual(categories, ['uncategorized', 'spam', 'out_of_office'])
+        self.assertEqual(len(service.client.prompts), 3)
+        self.assertNotIn('Subject: spam', service.client.prompts[1])
+
+    def test_fenced_json_answer(self):
+        """Test that a JSON answer wrapped in a code fence is accepted."""
+        service = self.service(lambda prompt: '```json\n' + label_by_subject(prompt) + '\n```')
+        self.assertEqual(service.categorize_batch([{'subject': 'meeting_booked'}]), ['meeting_booked'])
+
+
+class CategoryCacheTests(TestCase):
+    """Tests for the content-hash categorization cache."""
+
+    def setUp(self):
+        self.cache = CategoryCache(lru_size=2)
+        self.service = AIService(category_cache=self.cache, client=fake_client(label_by_subject))
+        self.addCleanup(self.service.client.close)
+
+    def test_repeat_categorization_is_free(self):
+        """Test that repeated and near-identical emails never reach the API twice."""
+        first = {'subject': 'spam', 'body': 'Job alert: 12 new roles near you'}
+        again = {'subject': 'RE: spam', 'body': '  job ALERT: 7 new roles   near you'}
+
+        self.assertEqual(self.service.categorize_batch([first, first]), ['spam', 'spam'])
+        self.assertEqual(self.service.categorize_batch([again]), ['spam'])
+        self.assertEqual(len(self.service.client.prompts), 1)
+        self.assertEqual(self.cache.stats()['memory_hits'], 1)
+
+    def test_persistent_store_survives_new_process(self):
+        """Test that a fresh in-process cache is filled from the table."""
+        self.service.categorize_batch([{'subject': 'interested', 'body': 'Pricing?'}])
+
+        fresh = CategoryCache()
+        service = AIService(category_cache=fresh, client=fake_client(label_by_subject))
+        self.addCleanup(service.client.close)
+        self.assertEqual(service.categorize_batch([{'subject': 'interested', 'body': 'Pricing?'}]), ['interested'])
+        self.assertEqual(service.client.prompts, [])
+        self.assertEqual(fresh.stats()['db_hits'], 1)
+
+    def test_eviction_by_age_and_size(self):
+        """Test that expired and least recently used rows are pruned."""
+        keys = [cache_key(f'subject {c}', '', 'model', 1) for c in 'abc']
+        for key in keys:
+            self.cache.set_many({key: 'spam'}, 'model', 1)
+        CategoryCacheEntry.objects.filter(key=keys[0]).update(created_at=timezone.now() - timedelta(days=31))
+        CategoryCacheEntry.objects.filter(key=keys[1]).update(last_used=timezone.now() - timedelta(days=1))
+
+        self.assertEqual(CategoryCache().get_many(keys[:1]), {})
+        CategoryCache(max_entries=1).prune()
+        self.assertEqual(list(CategoryCacheEntry.objects.values_list('key', flat=True)), [keys[2]])
+
+    def test_memory_hits_count_as_use(self):
+        """Test that entries served from memory are not pruned as least recently used."""
+        keys = [cache_key(f'subject {c}', '', 'model', 1) for c in 'ab']
+        self.cache.set_many({keys[0]: 'spam', keys[1]: 'spam'}, 'model', 1)
+        CategoryCacheEntry.objects.update(last_used=timezone.now() - timedelta(days=1))
+        CategoryCacheEntry.objects.filter(key=keys[1]).update(last_used=timezone.now() - timedelta(hours=1))
+
+        self.assertEqual(self.cache.get_many(keys[:1]), {keys[0]: 'spam'})
+        self.cache.max_entries = 1
+        self.cache.prune()
+        self.assertEqual(list(CategoryCacheEntry.objects.values_list('key', flat=True)), keys[:1])
+
+    def test_prune_keeps_max_entries_on_ties(self):
+        """Test that rows sharing last_used with the cutoff are not all deleted."""
+        keys = [cache_key(f'subject {c}', '', 'model', 1) for c in 'abc']
+        self.cache.set_many({key: 'spam' for key in keys}, 'model', 1)
+        CategoryCacheEntry.objects.update(last_used=timezone.now())
+
+        self.assertEqual(CategoryCache(max_entries=2).prune(), 1)
+        self.assertEqual(CategoryCacheEntry.objects.count(), 2)
+
+    def test_failed_touch_is_a_miss(self):
+        """Test that a database error while marking rows used degrades to a cache miss."""
+        class BrokenTouchCache(CategoryCache):
+            def _touch(self, keys=()):
+                raise RuntimeError('database is locked')
+
+        key = cache_key('subject', '', 'model', 1)
+        self.cache.set_many({key: 'spam'}, 'model', 1)
+        cache = BrokenTouchCache()
+        self.assertEqual(cache.get_many([key]), {})
+        self.assertEqual(cache.stats()['misses'], 1)
+
+
+class TieredCategorizerTests(TestCase):
+    """Tests for the local category head and LLM escalation."""
+
+    # Toy embeddings: one axis per category, the third axis is ambiguous
+    VECTORS = {
+        'spam': [1.0, 0.0, 0.0],
+        'out_of_office': [0.0, 1.0, 0.0],
+        'unclear': [0.7, 0.7, 0.1],
+    }
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.train_x = np.array([self.VECTORS[label] for label in ['spam', 'out_of_office'] * 20])
+        self.train_x = self.train_x + rng.normal(0, 0.05, self.train_x.shape)
+        self.train_y = ['spam', 'out_of_office'] * 20
+        self.head = CentroidClassifier.train(self.train_x, self.train_y)
+
+    def test_calibrate_and_evaluate(self):
+        """Test that the threshold keeps local answers above the target accuracy."""
+        holdout_x = np.vstack([self.train_x[:10], [self.VECTORS['unclear']] * 2])
+        holdout_y = self.train_y[:10] + ['spam', 'out_of_office']
+        self.head.calibrate(holdout_x, holdout_y, target_accuracy=1.0)
+        report = self.head.evaluate(holdout_x, holdout_y)
+        self.assertEqual(report['agreement'], 1.0)
+        self.assertAlmostEqual(report['escalation_rate'], 2 / 12)
+
+    def test_only_uncertain_emails_escalate(self):
+        """Test that confident predictions never reach the LLM."""
+        class StubAI:
+            def __init__(self):
+                self.asked = []
+
+            def categorize_batch(self, emails):
+                self.asked.extend(email['subject'] for email in emails)
+                return ['interested'] * len(emails)
+
+        self.head.threshold = 0.5
+        ai = StubAI()
+        tiered = TieredCategorizer(ai, self.head, embed=lambda text: self.VECTORS[text.split()[1]])
+        emails = [{'subject': 'spam'}, {'subject': 'unclear'}, {'subject': 'out_of_office'}]
+
+        self.assertEqual(tiered.categorize_batch(emails), ['spam', 'interested', 'out_of_office'])
+        self.assertEqual(ai.asked, ['unclear'])
+        self.assertAlmostEqual(tiered.stats()['escalation_rate'], 1 / 3)
+
+    def test_save_and_load(self):
+        """Test that a trained head round-trips through its file."""
+        self.head.threshold = 0.25
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'head.npz')
+            self.head.save(path)
+            loaded = CentroidClassifier.load(path)
+        self.assertEqual(loaded.labels, ['out_of_office', 'spam'])
+        self.assertEqual(loaded.threshold, 0.25)
+        self.assertEqual(loaded.predict([self.VECTORS['spam']])[0], ['spam'])
+
+
+class RuleEngineTests(TestCase):
+    """Tests for the compiled fallback rule engine."""
+
+    def setUp(self):
+        self.engine = RuleEngine()
+
+    def test_longest_phrase_wins(self):
+        """Test that "interest" inside "not interested" does not count as interest."""
+        self.assertEqual(self.engine.categorize('Thanks, but we are NOT  interested.'), 'not_interested')
+        self.assertEqual(self.engine.scores('not interested'), {'not_interested': 4.0})
+
+    def test_word_boundaries(self):
+        """Test that phrases only match whole words, with * matching word endings."""
+        self.assertEqual(self.engine.scores('I recall the wholesale ideal'), {})
+        self.assertEqual(self.engine.categorize('Back from the holidays'), 'out_of_office')
+
+    def test_weights_decide(self):
+        """Test that weaker hits are outvoted instead of winning by rule order."""
+        text = "Sorry for the delay, could we discuss pricing? We'd love to learn more."
+        self.assertEqual(self.engine.categorize(text), 'interested')
+        self.assertEqual(self.engine.categorize_batch(['', 'see you on zoom']), ['uncategorized', 'meeting_booked'])
+
+    def test_rules_file(self):
+        """Test that rules load from JSON and unknown categories are rejected."""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'rules.json')
+            with open(path, 'w') as f:
+                json.dump({'rules': [{'category': 'spam', 'weight': 2, 'patterns': ['crypto*']}]}, f)
+            engine = RuleEngine.from_file(path)
+        self.assertEqual(engine.categorize('Cryptocurrency giveaway'), 'spam')
+        with self.assertRaises(ValueError):
+            RuleEngine([{'category': 'urgent', 'patterns': ['asap']}])
+
+
+class TextReductionTests(TestCase):
+    """Tests for prompt text reduction."""
+
+    BODY = (
+        "Hi Sam,\n\nYes, we'd like to see a demo next week. "
+        "Details: https://track.example.com/c/8f2a9d0e1b7c4a3f9e2d1c0b8a7f6e5d4c3b2a19?utm_source=mail&utm_id=42\n\n"
+        "Best regards,\nAlex Morgan\nHead of Operations\n+1 555 0100\n\n"
+        "This email and any attachments are confidential and intended solely for the use of the addressee. "
+        "If you have received this email in error please notify the sender.\n\n"
+        "On Mon, 3 Jun 2024 at 10:02, Sam <sam@example.com> wrote:\n"
+        "> Would you like a demo of the platform?\n> It only takes 20 minutes.\n"
+    )
+
+    def test_strips_history_signature_footer_and_urls(self):
+        """Test that only the new message survives, with tracking links shortened."""
+        reducer = TextReducer(limits={'reply': 1000})
+        reduced = reducer.reduce(self.BODY, 'reply')
+        self.assertEqual(
+            reduced,
+            "Hi Sam,\n\nYes, we'd like to see a demo next week. Details: https://track.example.com/…",
+        )
+        stats = reducer.stats()['reply']
+        self.assertEqual(stats['calls'], 1)
+        self.assertGreater(stats['tokens_saved'], stats['tokens_out'])
+
+    def test_keeps_short_replies_after_a_sign_off_word(self):
+        """Test that a reply written after "Thanks." or "Thank you!" is not taken for a signature."""
+        self.assertEqual(
+            strip_signature("Hi,\nThanks.\nNot interested, please remove me.\n"),
+            "Hi,\nThanks.\nNot interested, please remove me.\n",
+        )
+        body = "Hi Sarah,\n\nThank you!\nWe are interested, can we talk on Friday?\n"
+        self.assertEqual(strip_signature(body), body)
+        self.assertEqual(strip_signature("Hi,\nThanks\nnot interested\n"), "Hi,\nThanks\nnot interested\n")
+        self.assertEqual(
+            strip_signature("Sounds good.\n\nThanks!\nAlex Morgan\nVP of Sales, Acme Inc.\nalex@acme.com\n"),
+            "Sounds good.\n\n",
+        )
+
+    def test_truncates_to_task_budget(self):
+        """Test that long bodies are cut to the token limit of the task."""
+        reducer = TextReducer(limits={'categorize': 50, 'reply': 500})
+        body = 'We are reviewing several vendors for the next quarter. ' * 100
+        short = reducer.reduce(body, 'categorize')
+        self.assertTrue(short.endswith('[…]'))
+        self.assertLessEqual(reducer.count_tokens(short), 52)
+        self.assertGreater(reducer.count_tokens(reducer.reduce(body, 'reply')), 400)
+
+    def test_keeps_forwarded_text_without_reply(self):
+        """Test that a message that is only quoted history is not emptied."""
+        reducer = TextReducer(limits={'reply': 1000})
+        body = '---------- Forwarded message ---------\nFrom: Alex\n\nCan we talk pricing?'
+        self.assertIn('Can we talk pricing?', reducer.reduce(body, 'reply'))
+
+    def test_categorize_prompt_uses_reduced_body(self):
+        """Test that categorization prompts leave out quoted history."""
+        service = AIService(
+            category_cache=CategoryCache(),
+            client=fake_client(label_by_subject),
+            text_reducer=TextReducer(limits={'categorize': 400}),
+        )
+        self.addCleanup(service.client.close)
+        service.categorize_batch([{'subject': 'interested', 'body': self.BODY}])
+        self.assertIn('demo next week', service.client.prompts[0])
+        self.assertNotIn('20 minutes', service.client.prompts[0])
+        self.assertNotIn('confidential', service.client.prompts[0])
+
+
+class LLMClientTests(TestCase):
+    """Tests for the rate-limited LLM client."""
+
+    def make_client(self, create, **options):
+        options.setdefault('requests_per_minute', 0)
+        options.setdefault('tokens_per_minute', 0)
+        client = LLMClient(api_key='test', create=create, **options)
+        self.addCleanup(client.close)
+        return client
+
+    def test_in_flight_limit(self):
+        """Test that concurrent requests never exceed max_in_flight."""
+        state = {'active': 0, 'peak': 0}
+
+        async def create(**kwargs):
+            state['active'] += 1
+            state['peak'] = max(state['peak'], state['active'])
+            await asyncio.sleep(0.02)
+            state['active'] -= 1
+            return completion('ok')
+
+        client = self.make_client(create, max_in_flight=3)
+        request = {'messages': [{'role': 'user', 'content': 'hi'}], 'max_tokens': 5}
+        self.assertEqual(client.chat_many([request] * 10), ['ok'] * 10)
+        self.assertEqual(state['peak'], 3)
+
+    def test_retries_rate_limits(self):
+        """Test that 429s are retried with backoff until the request succeeds."""
+        calls = []
+
+        async def create(**kwargs):
+            calls.append(1)
+            if len(calls) < 3:
+                raise rate_limit_error()
+            return completion('done')
+
+        with self.settings(OPENAI_RETRY_BASE_DELAY=0.01):
+            client = self.make_client(create, max_retries=3)
+            self.assertEqual(client.chat([{'role': 'user', 'content': 'hi'}]), 'done')
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(client.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_circuit_breaker_half_open_probe(self):
+        """Test that the breaker opens on failures and closes after a good probe."""
+        outcomes = ['fail', 'fail', 'ok']
+
+        async def create(**kwargs):
+            if outcomes.pop(0) == 'fail':
+                raise openai.APIConnectionError(request=httpx.Request('POST', 'https://api.openai.com'))
+            return completion('back')
+
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+        client = self.make_client(create, max_retries=0, breaker=breaker)
+        messages = [{'role': 'user', 'content': 'hi'}]
+        for _ in range(2):
+            with self.assertRaises(LLMError):
+                client.chat(messages)
+        self.assertFalse(client.available())
+        with self.assertRaises(CircuitOpenError):
+            client.chat(messages)
+
+        time.sleep(0.06)
+        self.assertTrue(client.available())
+        self.assertEqual(client.chat(messages), 'back')
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    def test_stream_retries_before_first_chunk(self):
+        """Test that a stream is retried until text starts and fails once text has been sent."""
+        calls = []
+
+        async def create(**kwargs):
+            calls.append(kwargs['stream'])
+            if len(calls) == 1:
+                raise rate_limit_error()
+
+            async def chunks():
+                for text in ['Happy ', 'to ', 'help']:
+                    yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))])
+                if len(calls) == 3:
+                    raise openai.APIConnectionError(request=httpx.Request('POST', 'https://api.openai.com'))
+            return chunks()
+
+        with self.settings(OPENAI_RETRY_BASE_DELAY=0.01):
+            client = self.make_client(create, max_retries=2)
+            messages = [{'role': 'user', 'content': 'hi'}]
+            self.assertEqual(list(client.stream(messages)), ['Happy ', 'to ', 'help'])
+            self.assertEqual(calls, [True, True])
+
+            received = []
+            with self.assertRaises(LLMError):
+                for delta in client.stream(messages):
+                    received.append(delta)
+        self.assertEqual(received, ['Happy ', 'to ', 'help'])
+        self.assertEqual(len(calls), 3)
+
+    def test_stream_falls_back_when_unavailable(self):
+        """Test that stream_completion yields the fallback text while the breaker is open."""
+        client = fake_client(label_by_subject)
+        self.addCleanup(client.close)
+        client.breaker.record_failure(trip=True)
+        service = AIService(category_cache=CategoryCache(), client=client)
+        chunks = list(service.stream_completion('Draft a reply to this email'))
+        self.assertEqual(len(chunks), 1)
+        self.assertIn('Thank you for your email', chunks[0])
+
+    def test_fake_server_end_to_end(self):
+        """Test chat, 429 retries and streaming over HTTP against the local fake server."""
+        with FakeLLMServer(max_concurrent=1, retry_after=0.01) as server:
+            client = LLMClient(api_key='test', base_url=server.base_url, requests_per_minute=0, tokens_per_minute=0)
+            self.addCleanup(client.close)
+            service = AIService(category_cache=CategoryCache(), client=client)
+
+            emails = [{'subject': 'Out of office', 'body': 'Back on Monday'}, {'subject': 'Newsletter', 'body': 'Unsubscribe'}]
+            requests = [{'messages': [{'role': 'user', 'content': 'Write a reply'}], 'max_tokens': 50}] * 4
+            self.assertEqual(service.categorize_batch(emails), ['out_of_office', 'spam'])
+            self.assertEqual(len(set(client.chat_many(requests))), 1)
+            reply = ''.join(client.stream([{'role': 'user', 'content': 'Write a reply'}]))
+
+        self.assertTrue(reply.startswith('Hi,'))
+        self.assertEqual(server.peak_active, 1)
+        self.assertEqual(server.counts['chat'], 5)
+        self.assertEqual(server.counts['stream'], 1)
+
+    def test_open_breaker_falls_back_to_rules(self):
+        """Test that categorization uses the rule engine while the breaker is open."""
+        client = fake_client(label_by_subject)
+        self.addCleanup(client.close)
+        client.breaker.record_failure(trip=True)
+        service = AIService(category_cache=CategoryCache(), client=client)
+        self.assertEqual(service.categorize_batch([{'subject': 'Out of office'}]), ['out_of_office'])
+        self.assertEqual(client.prompts, [])
+
+    def test_token_bucket_paces_requests(self):
+        """Test that the bucket delays a request once its capacity is used up."""
+        async def take():
+            bucket = TokenBucket(per_minute=600, capacity=1)
+            start = time.monotonic()
+            for _ in range(3):
+                await bucket.acquire()
+            return time.monotonic() - start
+
+        self.assertGreaterEqual(asyncio.run(take()), 0.18)
+
+
+class SingleFlightTests(TestCase):
+    """Tests for coalescing identical concurrent calls."""
+
+    def run_concurrently(self, count, target):
+        threads = [threading.Thread(target=target) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def test_concurrent_callers_share_one_call(self):
+        """Test that callers arriving while a call is in flight get its result."""
+        flight = SingleFlight(ttl=0)
+        started = threading.Event()
+        release = threading.Event()
+        calls, results = [], []
+
+        def slow():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return 'value'
+
+        leader = threading.Thread(target=lambda: results.append(flight.do('k', slow)))
+        leader.start()
+        started.wait(5)
+        followers = [threading.Thread(target=lambda: results.append(flight.do('k', slow))) for _ in range(4)]
+        for thread in followers:
+            thread.start()
+        while flight.stats()['coalesced'] < 4:
+            time.sleep(0.001)
+        release.set()
+        for thread in [leader] + followers:
+            thread.join()
+
+        self.assertEqual(calls, [1])
+        self.assertEqual(results, ['value'] * 5)
+        self.assertEqual(flight.stats()['coalesced'], 4)
+
+    def test_results_are_remembered_but_errors_are_not(self):
+        """Test the memo: repeats are free until the TTL passes, failures are retried."""
+        flight = SingleFlight(ttl=0.05)
+        self.assertEqual(flight.do('k', lambda: 1), 1)
+        self.assertEqual(flight.do('k', lambda: 2), 1)
+        time.sleep(0.06)
+        self.assertEqual(flight.do('k', lambda: 3), 3)
+
+        def fail():
+            raise ValueError('boom')
+
+        with self.assertRaises(ValueError):
+            flight.do('e', fail)
+        self.assertEqual(flight.do('e', lambda: 'ok'), 'ok')
+        self.assertEqual(flight.stats()['memo_hits'], 1)
+
+    def test_duplicate_completions_send_one_request(self):
+        """Test that identical get_completion calls at the same time reach the LLM once."""
+        def slow_answer(prompt):
+            time.sleep(0.05)
+            return 'Sure, Tuesday works.'
+
+        client = fake_client(slow_answer)
+        self.addCleanup(client.close)
+        service = AIService(category_cache=CategoryCache(), client=client)
+        prompt = f'Draft a reply to email {time.monotonic()}'
+        results = []
+        self.run_concurrently(5, lambda: results.append(service.get_completion(prompt)))
+
+        self.assertEqual(results, ['Sure, Tuesday works.'] * 5)
+        self.assertEqual(len(client.prompts), 1)
+        stats = get_singleflight('completion').stats()
+        self.assertGreaterEqual(stats['coalesced'] + stats['memo_hits'], 4)
+
+
+class ReplyDrafterTests(TransactionTestCase):
+    """Tests for background reply drafting."""
+
+    class StubRAG:
+        def __init__(self):
+            self.ai_service = SimpleNamespace(llm_available=lambda: True)
+            self.drafted = []
+
+        def draft_reply(self, email):
+            self.drafted.append(email.subject)
+            return f'Re: {email.subject}'
+
+    def setUp(self):
+        account = EmailAccount.objects.create(
+            email='rep@example.com', password='password123', imap_server='imap.example.com'
+        )
+        now = timezone.now()
+        for age, category in [(3, 'interested'), (1, 'meeting_booked'), (2, 'spam'), (0, 'interested'), (40, 'interested')]:
+            Email.objects.create(
+                account=account,
+                message_id=f'lead-{age}@example.com',
+                subject=f'{category} {age}',
+                sender='lead@example.com',
+                recipient='rep@example.com',
+                body='Tell me more',
+                received_date=now - timedelta(days=age),
+                folder='INBOX',
+                category=category,
+            )
+
+    def drafter(self):
+        rag = self.StubRAG()
+        drafter = ReplyDrafter(rag_service=rag, workers=1, max_age_days=14)
+        return drafter, rag
+
+    def test_drafts_hot_leads_newest_first(self):
+        """Test that only recent hot leads are drafted, newest first, and not twice."""
+        drafter, rag = self.drafter()
+        self.assertEqual(drafter.enqueue_pending(), 3)
+        with drafter:
+            drafter.join()
+
+        self.assertEqual(rag.drafted, ['interested 0', 'meeting_booked 1', 'interested 3'])
+        self.assertEqual(drafter.stats()['drafted'], 3)
+        self.assertTrue(Email.objects.get(subject='interested 0').has_current_reply_suggestion())
+        self.assertEqual(drafter.enqueue_pending(), 0)
+
+    def test_recategorized_and_new_model_invalidate_drafts(self):
+        """Test that drafts are redone when the category or the model changes."""
+        drafter, rag = self.drafter()
+        drafter.enqueue_pending()
+        with drafter:
+            drafter.join()
+
+        Email.objects.filter(subject='interested 3').update(category='meeting_booked')
+        self.assertEqual(drafter.enqueue_pending(), 1)
+
+        with self.settings(OPENAI_MODEL='another-model'):
+            drafter, rag = self.drafter()
+            self.assertEqual(drafter.enqueue_pending(), 3)
@@ -0,0 +1,631 @@
+from django.test import TestCase, TransactionTestCase, override_settings
+import socket
+import threading
+from django.utils import timezone
+import time
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from .models import EmailAccount, Email, FolderSyncState
+from .services.imap_service import IMAPService
+from .services.imap_fetch import compress_uids, iter_fetch_response, parse_list_response
+from .services.sync_service import SyncEngine, iter_batches
+from .services.idle_service import Backoff, IdleWorker
+from .services.mime_parser import ParserPool, parse_message
+from .services.email_store import upsert_emails
+from .services.ingest_service import IngestService
+from .services.pipeline import IngestPipeline
+from .testing.fake_imap import FakeIMAPServer, make_message
+
+class IncrementalSyncTests(TestCase):
+    """Tests for UID-checkpointed IMAP sync against the fake server."""
+
+    def setUp(self):
+        """Start a fake IMAP server with a few messages."""
+        self.server = FakeIMAPServer().start()
+        self.addCleanup(self.server.stop)
+        self.inbox = self.server.mailbox('INBOX')
+        for i in range(3):
+            self.inbox.append(make_message(i))
+
+        self.account = EmailAccount.objects.create(
+            email='test@example.com',
+            password='password123',
+            imap_server=self.server.host,
+            imap_port=self.server.port,
+            use_ssl=False,
+            is_active=True
+        )
+
+    def sync(self):
+        imap_service = IMAPService(self.account)
+        try:
+            return imap_service.fetch_emails()
+        finally:
+            imap_service.disconnect()
+
+    def test_first_sync_fetches_window_and_records_checkpoint(self):
+        """Test that the first sync fetches everything and stores the highest UID."""
+        emails = self.sync()
+        self.assertEqual([e['uid'] for e in emails], [1, 2, 3])
+        self.assertEqual(emails[0]['folder'], 'INBOX')
+
+        state = FolderSyncState.objects.get(account=self.account, folder='INBOX')
+        self.assertEqual(state.uidvalidity, self.inbox.uidvalidity)
+        self.assertEqual(state.last_uid, 3)
+
+    def test_second_sync_only_fetches_new_uids(self):
+        """Test that unchanged folders download nothing and new mail is picked up."""
+        self.sync()
+        self.assertEqual(self.sync(), [])
+
+        self.inbox.append(make_message(3))
+        emails = self.sync()
+        self.assertEqual([e['uid'] for e in emails], [4])
+        self.assertEqual(emails[0]['message_id'], '<fake-3@example.com>')
+        self.assertEqual(self.sync(), [])
+        state = FolderSyncState.objects.get(account=self.account, folder='INBOX')
+        self.assertEqual(state.last_uid, 4)
+
+    def test_failed_save_keeps_checkpoint(self):
+        """Test that a batch that could not be stored is fetched again by the next sync."""
+        class BrokenStoreIMAPService(IMAPService):
+            def save_emails(self, emails_data):
+                return super().save_emails([dict(e, received_date='not a date') for e in emails_data])
+
+        imap_service = BrokenStoreIMAPService(self.account)
+        self.addCleanup(imap_service.disconnect)
+        self.assertEqual(imap_service.sync_folder(), 0)
+        self.assertIn('sync:', imap_service.last_error)
+        self.assertEqual(FolderSyncState.objects.get(account=self.account, folder='INBOX').last_uid, 0)
+        self.assertFalse(Email.objects.exists())
+
+        imap_service = IMAPService(self.account)
+        self.addCleanup(imap_service.disconnect)
+        self.assertEqual(imap_service.sync_folder(), 3)
+        self.assertEqual(FolderSyncState.objects.get(account=self.account, folder='INBOX').last_uid, 3)
+
+    def test_uidvalidity_change_triggers_full_resync(self):
+        """Test that a new UIDVALIDITY discards the checkpoint."""
+        self.sync()
+        self.inbox.renumber(uidvalidity=2)
+
+        emails = self.sync()
+        self.assertEqual(len(emails), 3)
+        state = FolderSyncState.objects.get(account=self.account, folder='INBOX')
+        self.assertEqual(state.uidvalidity, 2)
+
+    def test_fetch_is_batched(self):
+        """Test that messages are fetched in chunks, not one FETCH per message."""
+        for i in range(3, 10):
+            self.inbox.append(make_message(i))
+        with self.settings(IMAP_FETCH_BATCH_SIZE=4, IMAP_SYNC_MODE='full'):
+            emails = self.sync()
+        self.assertEqual(len(emails), 10)
+        self.assertEqual(self.server.command_counts['UID FETCH'], 3)
+
+    def test_stream_checkpoints_per_batch(self):
+        """Test that the checkpoint only advances for committed batches."""
+        imap_service = IMAPService(self.account)
+        self.addCleanup(imap_service.disconnect)
+        stream = imap_service.stream_folder()
+        emails = iter(stream)
+        first = next(emails)
+        stream.commit(first['uid'])
+        self.assertEqual(FolderSyncState.objects.get(account=self.account).last_uid, 1)
+
+        # An interrupted stream resumes after the committed UID
+        self.assertEqual([e['uid'] for e in self.sync()], [2, 3])
+
+    def test_iter_batches_respects_size_ceiling(self):
+        """Test that batches are cut by item count and by text size."""
+        emails = [{'subject': '', 'body': 'x' * 100} for _ in range(10)]
+        self.assertEqual([len(b) for b in iter_batches(emails, max_items=4, max_bytes=10000)], [4, 4, 2])
+        self.assertEqual([len(b) for b in iter_batches(emails, max_items=50, max_bytes=250)], [3, 3, 3, 1])
+
+    def test_sync_folder_saves_uid(self):
+        """Test that stored emails keep their folder and UID."""
+        saved = IMAPService(self.account).sync_folder()
+        self.assertEqual(saved, 3)
+        email = Email.objects.get(message_id='<fake-2@example.com>')
+        self.assertEqual((email.folder, email.uid), ('INBOX', 3))
+
+    def test_full_sync_mode(self):
+        """Test that the legacy full-message mode still parses bodies."""
+        with self.settings(IMAP_SYNC_MODE='full'):
+            emails = self.sync()
+        self.assertEqual(emails[0]['body'].strip(), 'Body of message 0.')
+        self.assertTrue(emails[0]['body_complete'])
+
+
+class HeaderFirstSyncTests(TestCase):
+    """Tests for header-first sync with lazy body download."""
+
+    def setUp(self):
+        """Start a fake IMAP server holding a reply with a PDF attachment."""
+        self.server = FakeIMAPServer().start()
+        self.addCleanup(self.server.stop)
+
+        msg = MIMEMultipart()
+        msg['Message-ID'] = '<reply-1@example.com>'
+        msg['From'] = 'lead@example.com'
+        msg['To'] = 'sales@example.com'
+        msg['Subject'] = 'Re: our proposal'
+        msg['Date'] = 'Mon, 01 Jan 2024 10:00:00 +0000'
+        msg.attach(MIMEText('Sounds great, let us talk. ' * 20, 'plain', 'utf-8'))
+        msg.attach(MIMEApplication(b'%PDF' + b'0' * 50000, Name='deck.pdf'))
+        self.server.mailbox('INBOX').append(msg.as_bytes())
+
+        self.account = EmailAccount.objects.create(
+            email='test@example.com',
+            password='password123',
+            imap_server=self.server.host,
+            imap_port=self.server.port,
+            use_ssl=False,
+        )
+
+    def sync(self):
+        imap_service = IMAPService(self.account)
+        try:
+            return imap_service.sync_folder()
+        finally:
+            imap_service.disconnect()
+
+    def test_text_part_only(self):
+        """Test that the body comes from the text section, not the whole message."""
+        with self.settings(IMAP_SYNC_WINDOW_DAYS=100000):
+            self.assertEqual(self.sync(), 1)
+        email = Email.objects.get(message_id='<reply-1@example.com>')
+        self.assertEqual(email.subject, 'Re: our proposal')
+        self.assertTrue(email.body.startswith('Sounds great'))
+        self.assertTrue(email.body_complete)
+
+    def test_truncated_body_is_completed_on_demand(self):
+        """Test that a capped preview is replaced by the full body when needed."""
+        with self.settings(IMAP_SYNC_WINDOW_DAYS=100000, IMAP_BODY_PREVIEW_BYTES=40):
+            self.sync()
+        email = Email.objects.get(message_id='<reply-1@example.com>')
+        self.assertFalse(email.body_complete)
+        self.assertLess(len(email.body), 40)
+
+        self.assertTrue(email.ensure_full_body())
+        email.refresh_from_db()
+        self.assertTrue(email.body_complete)
+        self.assertEqual(email.body.count('Sounds great'), 20)
+
+    def test_unresponsive_server_keeps_preview(self):
+        """Test that fetching a full body gives up on a server that never answers."""
+        with self.settings(IMAP_SYNC_WINDOW_DAYS=100000, IMAP_BODY_PREVIEW_BYTES=40):
+            self.sync()
+        email = Email.objects.get(message_id='<reply-1@example.com>')
+        preview = email.body
+
+        # Accepts connections (via the backlog) but never sends a greeting
+        silent = socket.socket()
+        silent.bind(('127.0.0.1', 0))
+        silent.listen()
+        self.addCleanup(silent.close)
+        EmailAccount.objects.filter(pk=self.account.pk).update(imap_server='127.0.0.1', imap_port=silent.getsockname()[1])
+        email.account.refresh_from_db()
+
+        start = time.monotonic()
+        with self.settings(IMAP_BODY_FETCH_TIMEOUT=0.2):
+            self.assertFalse(email.ensure_full_body())
+        self.assertLess(time.monotonic() - start, 5)
+        email.refresh_from_db()
+        self.assertEqual((email.body, email.body_complete), (preview, False))
+
+
+class FetchResponseParserTests(TestCase):
+    """Tests for the FETCH response helpers."""
+
+    def test_compress_uids(self):
+        """Test that consecutive UIDs collapse into ranges."""
+        self.assertEqual(compress_uids([7, 1, 2, 3, 9, 10]), '1:3,7,9:10')
+        self.assertEqual(compress_uids([5]), '5')
+
+    def test_iter_fetch_response_with_literals(self):
+        """Test parsing a multi-message response with several literals per message."""
+        data = [
+            (b'1 (UID 11 BODY[HEADER.FIELDS (SUBJECT)] {13}', b'Subject: hi\r\n'),
+            (b' BODY[1]<0> {5}', b'hello'),
+            b' FLAGS (\\Seen))',
+            b'2 (UID 12 BODYSTRUCTURE ("TEXT" "PLAIN" ("CHARSET" "utf-8") NIL NIL "7BIT" 5 1))',
+        ]
+        messages = list(iter_fetch_response(data))
+        self.assertEqual(len(messages), 2)
+        self.assertEqual(messages[0]['UID'], 11)
+        self.assertEqual(messages[0]['BODY[HEADER.FIELDS (SUBJECT)]'], b'Subject: hi\r\n')
+        self.assertEqual(messages[0]['BODY[1]<0>'], b'hello')
+        self.assertEqual(messages[0]['FLAGS'], ['\\Seen'])
+        self.assertEqual(messages[1]['BODYSTRUCTURE'][:3], ['TEXT', 'PLAIN', ['CHARSET', 'utf-8']])
+        self.assertIsNone(messages[1]['BODYSTRUCTURE'][3])
+
+    def test_parse_list_response(self):
+        """Test parsing LIST lines, including quoted names with spaces."""
+        data = [b'(\\HasNoChildren) "/" "INBOX"', b'(\\Noselect \\HasChildren) "/" "[Gmail]"', b'(\\Sent) "/" "[Gmail]/Sent Mail"']
+        self.assertEqual(parse_list_response(data), [
+            (['\\HasNoChildren'], '/', 'INBOX'),
+            (['\\Noselect', '\\HasChildren'], '/', '[Gmail]'),
+            (['\\Sent'], '/', '[Gmail]/Sent Mail'),
+        ])
+
+
+class SyncEngineTests(TransactionTestCase):
+    """Tests for concurrent multi-account sync."""
+
+    def setUp(self):
+        """Start a fake server and create accounts pointing at it."""
+        self.server = FakeIMAPServer().start()
+        self.addCleanup(self.server.stop)
+        self.server.mailbox('INBOX').append(make_message(0))
+        self.accounts = [
+            EmailAccount.objects.create(
+                email=f'user{i}@example.com',
+                password='password123',
+                imap_server=self.server.host,
+                imap_port=self.server.port,
+                use_ssl=False,
+            )
+            for i in range(4)
+        ]
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+
+    def slow_process(self, imap_service, batch):
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(0.05)
+        with self.lock:
+            self.active -= 1
+        return len(batch)
+
+    def test_per_server_cap(self):
+        """Test that accounts on one server respect the connection cap."""
+        results = SyncEngine(self.slow_process, workers=4, per_server=2).run(self.accounts)
+        self.assertEqual([r.status for r in results], ['ok'] * 4)
+        self.assertEqual([r.processed for r in results], [1] * 4)
+        self.assertLessEqual(self.max_active, 2)
+        self.assertIsNotNone(EmailAccount.objects.get(pk=self.accounts[0].pk).last_sync)
+
+    def test_failures_are_isolated(self):
+        """Test that an unreachable or slow account does not affect the others."""
+        broken = EmailAccount.objects.create(
+            email='broken@example.com', password='x', imap_server='127.0.0.1', imap_port=1, use_ssl=False
+        )
+        results = SyncEngine(lambda imap_service, batch: len(batch), workers=4).run([broken] + self.accounts)
+        self.assertEqual(results[0].status, 'error')
+        self.assertEqual([str(r) for r in results[1:] if r.status != "ok"], [])
+
+    def test_timeout(self):
+        """Test that an account exceeding its budget is reported as timed out."""
+        self.server.mailbox('INBOX').append(make_message(1))
+
+        def stall(imap_service, batch):
+            time.sleep(1.5)
+            return len(batch)
+
+        with self.settings(IMAP_INGEST_BATCH_SIZE=1):
+            result = SyncEngine(stall, workers=1, timeout=1).run(self.accounts[:1])[0]
+        self.assertEqual(result.status, 'timeout')
+        self.assertEqual(result.processed, 1)
+        # Only the processed batch is checkpointed
+        self.assertEqual(FolderSyncState.objects.get(account=self.accounts[0]).last_uid, 1)
+
+
+class IdleWorkerTests(TransactionTestCase):
+    """Tests for the IDLE supervisor worker."""
+
+    def setUp(self):
+        """Start a fake server and an account pointing at it."""
+        self.server = FakeIMAPServer().start()
+        self.addCleanup(self.server.stop)
+        self.inbox = self.server.mailbox('INBOX')
+        self.inbox.append(make_message(0))
+        self.account = EmailAccount.objects.create(
+            email='test@example.com',
+            password='password123',
+            imap_server=self.server.host,
+            imap_port=self.server.port,
+            use_ssl=False,
+        )
+        self.received = []
+
+    def process(self, imap_service, batch):
+        self.received.extend(email_data['uid'] for email_data in batch)
+        return len(batch)
+
+    def wait_for(self, condition, timeout=5):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if condition():
+                return True
+            time.sleep(0.05)
+        return False
+
+    def test_new_mail_is_pushed_via_idle(self):
+        """Test that EXISTS during IDLE fetches only the new UID."""
+        worker = IdleWorker(self.account, self.process, renew_seconds=30)
+        worker.start()
+        self.addCleanup(worker.join, 5)
+        self.addCleanup(worker.stop)
+
+        self.assertTrue(self.wait_for(lambda: self.received == [1]))
+        self.assertTrue(self.wait_for(lambda: self.server.command_counts['IDLE'] >= 1))
+        self.inbox.append(make_message(1))
+        self.assertTrue(self.wait_for(lambda: self.received == [1, 2]))
+
+    def test_idle_is_renewed(self):
+        """Test that IDLE is re-issued when the renewal interval elapses."""
+        worker = IdleWorker(self.account, self.process, renew_seconds=0.2)
+        worker.start()
+        self.addCleanup(worker.join, 5)
+        self.addCleanup(worker.stop)
+        self.assertTrue(self.wait_for(lambda: self.server.command_counts['IDLE'] >= 3))
+
+    def test_backoff_is_jittered_and_capped(self):
+        """Test that reconnect delays grow exponentially up to the cap."""
+        backoff = Backoff(base=1, cap=8)
+        delays = [backoff.next_delay() for _ in range(6)]
+        for attempt, delay in enumerate(delays):
+            self.assertLessEqual(delay, min(8, 2 ** attempt))
+        backoff.reset()
+        self.assertLessEqual(backoff.next_delay(), 1)
+
+
+class MultiFolderSyncTests(TransactionTestCase):
+    """Tests for LIST-based folder discovery and per-folder sync."""
+
+    def setUp(self):
+        """Start a fake server with several folders."""
+        self.server = FakeIMAPServer().start()
+        self.addCleanup(self.server.stop)
+        for index, name in enumerate(['INBOX', 'Sent', 'Clients/Acme', 'Clients/Old', 'Archive']):
+            self.server.mailbox(name).append(make_message(index))
+        self.server.mailbox('Clients', flags=('\\Noselect',))
+        self.account = EmailAccount.objects.create(
+            email='test@example.com',
+            password='password123',
+            imap_server=self.server.host,
+            imap_port=self.server.port,
+            use_ssl=False,
+            folder_include='INBOX, Sent, Clients*',
+            folder_exclude='Clients/Old',
+        )
+
+    def test_discover_folders(self):
+        """Test that folder patterns and \\Noselect are honoured."""
+        imap_service = IMAPService(self.account)
+        self.addCleanup(imap_service.disconnect)
+        self.assertEqual(imap_service.discover_folders(), ['INBOX', 'Sent', 'Clients/Acme'])
+
+    def test_folders_synced_with_connection_pool(self):
+        """Test that every configured folder is synced and saved with its name."""
+        def save(imap_service, batch):
+            return sum(1 for email_data in batch if imap_service.save_email(email_data))
+
+        result = SyncEngine(save, folder_connections=2).run([self.account])[0]
+        self.assertEqual(result.status, 'ok', result.error)
+        self.assertEqual(result.folders, {'INBOX': 1, 'Sent': 1, 'Clients/Acme': 1})
+        self.assertEqual(Email.objects.get(message_id='<fake-2@example.com>').folder, 'Clients/Acme')
+        self.assertLessEqual(self.server.command_counts['LOGIN'], 2)
+
+    def test_sync_endpoint_syncs_every_folder(self):
+        """Test that the manual sync endpoint goes through folder discovery too."""
+        response = self.client.post(f'/emails/api/accounts/{self.account.pk}/sync/')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.json()['folders'], {'INBOX': 1, 'Sent': 1, 'Clients/Acme': 1})
+        self.assertEqual(
+            set(Email.objects.values_list('folder', flat=True)), {'INBOX', 'Sent', 'Clients/Acme'}
+        )
+
+
+class MimeParserTests(TestCase):
+    """Tests for the shared MIME parser."""
+
+    def build_reply(self):
+        msg = MIMEMultipart()
+        msg['Message-ID'] = '<reply-1@example.com>'
+        msg['Subject'] = 'Re: proposal'
+        msg['From'] = 'lead@example.com'
+        msg.attach(MIMEApplication(b'attached notes', Name='notes.txt', _subtype='plain'))
+        msg.attach(MIMEText('Let us talk.', 'plain', 'utf-8'))
+        msg.attach(MIMEApplication(b'%PDF' + b'0' * 1000, Name='deck.pdf'))
+        return msg.as_bytes()
+
+    def test_first_inline_text_part(self):
+        """Test that attachments are skipped and the inline text part is decoded."""
+        record = parse_message(self.build_reply())
+        self.assertEqual(record['body'], 'Let us talk.')
+        self.assertEqual(record['message_id'], '<reply-1@example.com>')
+        # A missing Date header falls back to an aware timestamp
+        self.assertIsNotNone(record['received_date'].tzinfo)
+
+    def test_bad_charset_falls_back_to_utf8(self):
+        """Test that an unknown charset does not lose the body."""
+        raw = b'Subject: hi\r\nContent-Type: text/plain; charset=x-unknown\r\n\r\nHello\r\n'
+        self.assertEqual(parse_message(raw)['body'].strip(), 'Hello')
+
+    def test_process_pool_matches_inline(self):
+        """Test that parsing in worker processes returns the same records in order."""
+        raws = [make_message(i) for i in range(6)] + [self.build_reply()]
+        pool = ParserPool(workers=2, min_batch=1)
+        self.addCleanup(pool.shutdown)
+        pooled = pool.parse_many(raws)
+        inline = ParserPool(workers=0).parse_many(raws)
+        # The last message has no Date header, so only compare what is deterministic
+        self.assertEqual(pooled[:-1], inline[:-1])
+        self.assertEqual(pooled[-1]['body'], inline[-1]['body'])
+
+
+class EmailStoreTests(TestCase):
+    """Tests for batched email persistence."""
+
+    class StubIndex:
+        def __init__(self):
+            self.batches = []
+
+        def index_emails(self, emails):
+            self.batches.append([email.message_id for email in emails])
+            return len(emails)
+
+    class StubNotify:
+        def __init__(self):
+            self.sent = []
+
+        def send_notification(self, email):
+            self.sent.append(email.message_id)
+
+    def setUp(self):
+        self.account = EmailAccount.objects.create(
+            email='test@example.com',
+            password='password123',
+            imap_server='imap.example.com',
+        )
+
+    def record(self, index, **fields):
+        record = {
+            'message_id': f'<store-{index}@example.com>',
+            'subject': f'Message {index}',
+            'sender': 'lead@example.com',
+            'recipient': 'sales@example.com',
+            'body': f'Body {index}',
+            'folder': 'INBOX',
+            'uid': index,
+            'received_date': timezone.now(),
+        }
+        record.update(fields)
+        return record
+
+    def test_upsert_inserts_and_updates(self):
+        """Test that a re-synced message updates its row instead of duplicating it."""
+        first = upsert_emails(self.account, [self.record(1), self.record(2)])
+        self.assertEqual([email.uid for email in first], [1, 2])
+        self.assertTrue(all(email.pk for email in first))
+
+        second = upsert_emails(self.account, [self.record(2, folder='Archive', uid=9), self.record(3)])
+        self.assertEqual(Email.objects.count(), 3)
+        self.assertEqual(second[0].pk, first[1].pk)
+        self.assertEqual((second[0].folder, second[0].uid), ('Archive', 9))
+        self.assertEqual(second[0].created_at, first[1].created_at)
+
+    def test_resync_keeps_downloaded_full_body(self):
+        """Test that a header-only re-sync does not replace a full body with its preview."""
+        upsert_emails(self.account, [self.record(1, body='Short pre', body_complete=False)])
+        Email.objects.filter(message_id='<store-1@example.com>').update(body='Short preview, then more', body_complete=True)
+
+        email = upsert_emails(self.account, [self.record(1, body='Short pre', body_complete=False, uid=7)])[0]
+        self.assertEqual((email.body, email.body_complete, email.uid), ('Short preview, then more', True, 7))
+
+        email = upsert_emails(self.account, [self.record(1, body='Rewritten in full', body_complete=True)])[0]
+        self.assertEqual((email.body, email.body_complete), ('Rewritten in full', True))
+
+    def test_duplicates_and_missing_message_ids(self):
+        """Test that duplicates collapse and mail without a Message-ID gets a stable one."""
+        records = [
+            self.record(1, body='old'),
+            self.record(1, body='new'),
+            self.record(2, message_id=''),
+        ]
+        emails = upsert_emails(self.account, records)
+        self.assertEqual([email.body for email in emails], ['new', 'Body 2'])
+        self.assertTrue(emails[1].message_id.endswith('@imap.example.com>'))
+
+        again = upsert_emails(self.account, [records[2]])
+        self.assertEqual(again[0].pk, emails[1].pk)
+
+    def test_process_batch(self):
+        """Test that a batch is categorized, stored, indexed and notified in bulk."""
+        class StubAI:
+            def categorize_batch(self, emails):
+                return ['interested' if email_data['uid'] == 1 else 'bogus' for email_data in emails]
+
+        index, notify = self.StubIndex(), self.StubNotify()
+        service = IngestService(StubAI(), index, notify)
+        stored = service.process_batch(IMAPService(self.account), [self.record(1), self.record(2)])
+
+        self.assertEqual(stored, 2)
+        self.assertEqual(index.batches, [['<store-1@example.com>', '<store-2@example.com>']])
+        self.assertEqual(notify.sent, ['<store-1@example.com>'])
+        self.assertEqual(Email.objects.get(uid=2).category, 'uncategorized')
+
+    @override_settings(OPENAI_API_KEY='', LOCAL_CLASSIFIER_ENABLED=False)
+    def test_process_email_with_default_categorizer(self):
+        """Test that a single email goes through the same steps as a batch."""
+        index, notify = self.StubIndex(), self.StubNotify()
+        service = IngestService(elasticsearch_service=index, notification_service=notify)
+        email = service.process_email(IMAPService(self.account), self.record(1, subject='Meeting confirmed'))
+
+        self.assertEqual(email.category, 'meeting_booked')
+        self.assertEqual(Email.objects.get(pk=email.pk).category, 'meeting_booked')
+        self.assertEqual(index.batches, [['<store-1@example.com>']])
+        self.assertEqual(notify.sent, ['<store-1@example.com>'])
+
+
+class IngestPipelineTests(TransactionTestCase):
+    """Tests for the staged ingestion pipeline."""
+
+    class StubIngest(IngestService):
+        """Categorizes slowly and records what reaches the later stages."""
+
+        def __init__(self, fail_persist=False):
+            super().__init__(ai_service=object(), elasticsearch_service=object(), notification_service=object())
+            self.fail_persist = fail_persist
+            self.indexed = []
+
+        def categorize(self, batch):
+            time.sleep(0.05)
+            return [dict(email_data, category='interested') for email_data in batch]
+
+        def persist(self, account, records):
+            if self.fail_persist:
+                raise RuntimeError('database is locked')
+            return super().persist(account, records)
+
+        def index(self, emails):
+            self.indexed.extend(email.message_id for email in emails)
+
+        def notify(self, emails):
+            pass
+
+    def setUp(self):
+        self.server = FakeIMAPServer().start()
+        self.addCleanup(self.server.stop)
+        for i in range(6):
+            self.server.mailbox('INBOX').append(make_message(i))
+        self.account = EmailAccount.objects.create(
+            email='test@example.com',
+            password='password123',
+            imap_server=self.server.host,
+            imap_port=self.server.port,
+            use_ssl=False,
+        )
+
+    def run_sync(self, ingest_service):
+        with self.settings(IMAP_INGEST_BATCH_SIZE=1):
+            with IngestPipeline(ingest_service, categorize_workers=3, queue_size=2) as pipeline:
+                result = SyncEngine(pipeline.submit).run([self.account])[0]
+        return result, pipeline
+
+    def test_batches_flow_through_every_stage(self):
+        """Test that every batch is stored, indexed and checkpointed."""
+        ingest_service = self.StubIngest()
+        result, pipeline = self.run_sync(ingest_service)
+
+        self.assertEqual(result.status, 'ok', result.error)
+        self.assertEqual((result.fetched, result.processed), (6, 6))
+        self.assertEqual(Email.objects.filter(category='interested').count(), 6)
+        self.assertEqual(len(ingest_service.indexed), 6)
+        self.assertEqual(pipeline.stats()['persist'], {'processed': 6, 'failed': 0})
+        self.assertEqual(FolderSyncState.objects.get(account=self.account).last_uid, 6)
+
+    def test_failed_persist_keeps_checkpoint(self):
+        """Test that the checkpoint does not move past batches that were not stored."""
+        result, _ = self.run_sync(self.StubIngest(fail_persist=True))
+
+        self.assertEqual(result.status, 'error')
+        self.assertIn('database is locked', result.error)
+        self.assertFalse(Email.objects.exists())
+        self.assertFalse(FolderSyncState.objects.filter(last_uid__gt=0).exists())
@@ -3,8 +3,19 @@ from django.utils import timezone
 from .models import EmailAccount, Email
 from .services.vector_db_service import VectorDBService
 from .services.rag_service import RAGService
+from .services import embedding_runtime
+from .services.embedding_runtime import EmbeddingRuntime, LOAD_RETRY_SECONDS
+from .services.vector_index import VectorIndex
+from .services.vector_store import VectorStore
+from django.core.management import call_command
+from io import StringIO
+from contextlib import contextmanager
 from unittest import skip
+import json
+import numpy as np
 import os
+import tempfile
+import threading
 from datetime import timedelta
 
 class RAGServiceTests(TestCase):
@@ -103,4 +114,402 @@ class RAGServiceTests(TestCase):
         else:
             # If no API key, we should get a default response
             self.assertTrue(success)
-            self.assertIn("Thank you for your email", email.reply_suggestion) 
\ No newline at end of file
+            self.assertIn("Thank you for your email", email.reply_suggestion) 
+
+
+class VectorStoreTests(TestCase):
+    """Tests for the memory-mapped vector store."""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = tmp.name
+
+    def rows(self, start, count, dim=4):
+        vectors = np.arange(start * dim, (start + count) * dim, dtype=np.float32).reshape(count, dim)
+        records = [{'text': f'doc {i}', 'metadata': {'email_id': i}} for i in range(start, start + count)]
+        return vectors, records
+
+    def test_append_and_reopen(self):
+        """Test that appended rows survive reopening and are read back by row number."""
+        store = VectorStore(self.path)
+        self.assertEqual(list(store.append(*self.rows(0, 3))), [0, 1, 2])
+        self.assertEqual(list(store.append(*self.rows(3, 2))), [3, 4])
+
+        reopened = VectorStore(self.path)
+        self.assertEqual((reopened.count, reopened.dim), (5, 4))
+        np.testing.assert_array_equal(reopened.vectors(), self.rows(0, 5)[0])
+        self.assertEqual([r['text'] for r in reopened.records([4, 0, 2])], ['doc 4', 'doc 0', 'doc 2'])
+        with self.assertRaises(ValueError):
+            reopened.append(np.zeros((1, 3)), [{'text': 'wrong dimension'}])
+
+    def test_interrupted_append_is_discarded(self):
+        """Test that data written without a manifest commit is ignored and then overwritten."""
+        store = VectorStore(self.path)
+        store.append(*self.rows(0, 2))
+        # An append that crashed before committing the manifest
+        for name, garbage in [(store.VECTORS, b'\x01' * 40), (store.RECORDS, b'{"text": "half'), (store.OFFSETS, b'\xff' * 12)]:
+            with open(os.path.join(self.path, name), 'ab') as f:
+                f.write(garbage)
+
+        reopened = VectorStore(self.path)
+        self.assertEqual(reopened.count, 2)
+        reopened.append(*self.rows(2, 1))
+        final = VectorStore(self.path)
+        np.testing.assert_array_equal(final.vectors(), self.rows(0, 3)[0])
+        self.assertEqual([r['text'] for r in final.records(range(3))], ['doc 0', 'doc 1', 'doc 2'])
+
+    def test_delete_and_compact(self):
+        """Test that deleted rows are tracked across reopening and dropped by compaction."""
+        store = VectorStore(self.path)
+        store.append(*self.rows(0, 2))  # rows from before keys existed
+        store.append(*self.rows(2, 4), keys=[12, 13, 14, 15], hashes=[1, 2, 3, 4])
+        self.assertEqual(store.keys()['key'].tolist(), [0, 0, 12, 13, 14, 15])
+        self.assertEqual(store.delete([1, 3, 3, 99]), 2)
+        self.assertEqual(store.delete([1]), 0)
+
+        reopened = VectorStore(self.path)
+        self.assertEqual(reopened.deleted, 2)
+        self.assertEqual(np.flatnonzero(reopened.deleted_mask()).tolist(), [1, 3])
+
+        self.assertEqual(reopened.compact(chunk_rows=2), 2)
+        self.assertEqual((reopened.generation, reopened.count, reopened.deleted), (1, 4, 0))
+        self.assertFalse(os.path.exists(os.path.join(self.path, VectorStore.VECTORS)))
+        np.testing.assert_array_equal(reopened.vectors(), self.rows(0, 6)[0][[0, 2, 4, 5]])
+        self.assertEqual([r['text'] for r in reopened.records(range(4))], ['doc 0', 'doc 2', 'doc 4', 'doc 5'])
+        self.assertEqual(reopened.keys()['hash'].tolist(), [0, 1, 3, 4])
+
+        # The instance opened before compaction picks up the new generation
+        store.append(*self.rows(6, 1), keys=[16])
+        self.assertEqual((store.generation, store.count), (1, 5))
+        self.assertEqual(store.records([4])[0]['text'], 'doc 6')
+
+    def test_migrate_vectors_command(self):
+        """Test that migrate_vectors moves vectors.json into the store."""
+        documents = [
+            {'id': i, 'text': f'doc {i}', 'embedding': [float(i)] * 4, 'metadata': {'email_id': i}}
+            for i in range(5)
+        ]
+        with open(os.path.join(self.path, 'vectors.json'), 'w') as f:
+            json.dump(documents, f)
+
+        with self.settings(VECTOR_DB_PATH=self.path):
+            call_command('migrate_vectors', chunk_size=2, stdout=StringIO())
+
+        store = VectorStore(self.path)
+        self.assertEqual(store.count, 5)
+        self.assertEqual(store.records([3])[0], {'text': 'doc 3', 'metadata': {'email_id': 3}})
+        self.assertTrue(os.path.exists(os.path.join(self.path, 'vectors.json.migrated')))
+
+
+def tiny_model_loader(calls=None):
+    """Loader for EmbeddingRuntime building a small random BERT, so tests never download a model."""
+    def load(model_name, device):
+        from transformers import BertConfig, BertModel, BertTokenizerFast
+
+        if calls is not None:
+            calls.append(model_name)
+        words = 'the project deadline meeting notes budget product launch feedback design'.split()
+        with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as f:
+            f.write('\n'.join(['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]'] + words))
+        try:
+            tokenizer = BertTokenizerFast(vocab_file=f.name)
+        finally:
+            os.unlink(f.name)
+        config = BertConfig(vocab_size=tokenizer.vocab_size, hidden_size=8, num_hidden_layers=1,
+                            num_attention_heads=2, intermediate_size=16, max_position_embeddings=64)
+        return tokenizer, BertModel(config).eval()
+    return load
+
+@contextmanager
+def use_runtime(runtime):
+    """Make `runtime` the process-wide embedding runtime for the duration of the block."""
+    previous, embedding_runtime._runtime = embedding_runtime._runtime, runtime
+    try:
+        yield runtime
+    finally:
+        embedding_runtime._runtime = previous
+
+def failing_loader(calls):
+    def load(model_name, device):
+        calls.append(model_name)
+        raise OSError("model not found")
+    return load
+
+
+class EmbeddingRuntimeTests(TestCase):
+    """Tests for the shared embedding model runtime and the readiness endpoint."""
+
+    def test_loads_once_across_threads(self):
+        """Test that concurrent first calls load the model a single time."""
+        calls = []
+        runtime = EmbeddingRuntime('tiny', device='cpu', loader=tiny_model_loader(calls))
+        self.assertEqual(runtime.status()['state'], EmbeddingRuntime.NOT_LOADED)
+
+        threads = [threading.Thread(target=runtime.embed, args=('project deadline',)) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(calls, ['tiny'])
+        self.assertEqual(runtime.status()['state'], EmbeddingRuntime.READY)
+        embedding = runtime.embed('project deadline')
+        self.assertEqual(len(embedding), 8)
+        self.assertEqual(embedding, runtime.embed('project deadline'))
+
+    def test_failed_load_is_retried_later(self):
+        """Test that a failed load is reported and not retried on every call."""
+        calls = []
+        runtime = EmbeddingRuntime('missing', device='cpu', loader=failing_loader(calls))
+        self.assertFalse(runtime.load())
+        self.assertFalse(runtime.load())
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(runtime.status()['state'], EmbeddingRuntime.FAILED)
+        self.assertIn('model not found', runtime.status()['error'])
+
+        runtime._failed_at -= LOAD_RETRY_SECONDS
+        runtime._loader = tiny_model_loader()
+        self.assertTrue(runtime.warmup())
+        self.assertIsNone(runtime.status()['error'])
+
+    def test_readiness_endpoint(self):
+        """Test that readiness follows the runtime state and the warmup setting."""
+        runtime = EmbeddingRuntime('missing', device='cpu', loader=failing_loader([]))
+        with use_runtime(runtime):
+            response = self.client.get('/emails/api/ready/')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json()['embedding']['state'], EmbeddingRuntime.NOT_LOADED)
+            with self.settings(EMBEDDING_WARMUP=True):
+                self.assertEqual(self.client.get('/emails/api/ready/').status_code, 503)
+
+            runtime.load()
+            response = self.client.get('/emails/api/ready/')
+            self.assertEqual(response.status_code, 503)
+            self.assertFalse(response.json()['ready'])
+
+            runtime._failed_at -= LOAD_RETRY_SECONDS
+            runtime._loader = tiny_model_loader()
+            runtime.load()
+            with self.settings(EMBEDDING_WARMUP=True):
+                self.assertEqual(self.client.get('/emails/api/ready/').status_code, 200)
+
+    def test_embed_batch_matches_single_embeddings(self):
+        """Test that batched embeddings come back in input order and match one-at-a-time ones."""
+        runtime = EmbeddingRuntime('tiny', device='cpu', loader=tiny_model_loader())
+        texts = ['project deadline meeting notes budget', 'design', 'the product launch feedback', 'notes']
+        batched = runtime.embed_batch(texts, batch_size=3)
+        self.assertEqual(batched.shape, (4, 8))
+        self.assertEqual(batched.dtype, np.float32)
+        for text, vector in zip(texts, batched):
+            np.testing.assert_allclose(vector, runtime.embed(text), atol=1e-5)
+        self.assertEqual(runtime.embed_batch([]).shape, (0, 8))
+
+    def test_index_all_emails_in_batches(self):
+        """Test that bulk indexing embeds in chunks and stores every email once."""
+        account = EmailAccount.objects.create(email='batch@example.com', password='x', imap_server='imap.example.com')
+        for i in range(5):
+            Email.objects.create(
+                account=account, message_id=f'batch-{i}@example.com', subject=f'Budget {i}',
+                sender='a@example.com', recipient='b@example.com', body='the budget meeting',
+                received_date=timezone.now(), folder='INBOX',
+            )
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        runtime = EmbeddingRuntime('tiny', device='cpu', loader=tiny_model_loader())
+        with self.settings(VECTOR_DB_PATH=tmp.name), use_runtime(runtime):
+            rag_service = RAGService()
+            self.assertEqual(rag_service.index_all_emails(chunk_size=2), 5)
+            store = rag_service.vector_db.store
+            self.assertEqual(store.count, 5)
+            self.assertEqual(sorted(r['metadata']['email_id'] for r in store.records(range(5))),
+                             sorted(Email.objects.values_list('id', flat=True)))
+
+
+class VectorIndexTests(TestCase):
+    """Tests for the similarity search backends."""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.store = VectorStore(tmp.name)
+        self.rng = np.random.default_rng(0)
+        self.centers = self.rng.normal(0, 1, (8, 16)).astype(np.float32)
+
+    def append(self, count):
+        vectors = self.centers[np.arange(count) % 8] + self.rng.normal(0, 0.1, (count, 16)).astype(np.float32)
+        self.store.append(vectors, [{'text': '', 'metadata': {}}] * count)
+
+    def test_backends_agree_with_exact_search(self):
+        """Test that every backend finds the exact nearest neighbours on clustered data, incrementally."""
+        self.append(200)
+        indexes = [VectorIndex(self.store.path, kind) for kind in ('brute', 'hnsw', 'ivf')]
+        query = self.centers[3]
+        for index in indexes:
+            similarities, rows = index.search(self.store, query, 5)
+            self.assertEqual(len(rows), 5)
+            self.assertTrue(all(row % 8 == 3 for row in rows))
+            self.assertTrue(np.all(np.diff(similarities) <= 1e-6))
+
+        self.append(100)
+        exact = indexes[0].search(self.store, query, 10)[1]
+        for index in indexes[1:]:
+            self.assertEqual(set(index.search(self.store, query, 10)[1]), set(exact))
+            self.assertEqual(index.backend.count, 300)
+
+    def test_index_is_persisted_and_caught_up(self):
+        """Test that a saved index is reused and only the missing rows are added on load."""
+        self.append(50)
+        with self.settings(VECTOR_INDEX_SAVE_EVERY=10):
+            VectorIndex(self.store.path, 'hnsw').sync(self.store)
+            self.assertTrue((self.store.path / 'index.hnsw.faiss').exists())
+            self.append(5)
+
+            reopened = VectorIndex(self.store.path, 'hnsw')
+            reopened.sync(self.store)
+            self.assertEqual(reopened.backend.count, 55)
+            self.assertEqual(reopened.unsaved, 5)
+            self.assertIn(54, reopened.search(self.store, self.centers[4], 10)[1])
+
+    def test_first_query_does_not_build_the_index(self):
+        """Test that queries use exact search while a missing index is built in the background."""
+        self.append(200)
+        with self.settings(VECTOR_INDEX_MAX_QUERY_ROWS=50):
+            index = VectorIndex(self.store.path, 'hnsw')
+            exact = VectorIndex(self.store.path, 'brute').search(self.store, self.centers[3], 5)[1]
+            self.assertEqual(list(index.search(self.store, self.centers[3], 5)[1]), list(exact))
+            index.builder.join(timeout=30)
+            self.assertEqual(index.backend.count, 200)
+            self.assertTrue((self.store.path / 'index.hnsw.faiss').exists())
+
+            self.append(20)
+            rows = index.search(self.store, self.centers[3], 5)[1]
+            self.assertTrue(all(row % 8 == 3 for row in rows))
+            self.assertEqual(index.backend.count, 220)
+            self.assertFalse(index.builder.is_alive())
+
+    def test_similarity_search_uses_index(self):
+        """Test that similarity_search returns stored records ranked by the index."""
+        runtime = EmbeddingRuntime('tiny', device='cpu', loader=tiny_model_loader())
+        with self.settings(VECTOR_DB_PATH=str(self.store.path), VECTOR_INDEX='hnsw'), use_runtime(runtime):
+            vector_db = VectorDBService()
+            vector_db.add_documents(['project deadline', 'budget meeting notes', 'product launch'],
+                                    [{'n': 0}, {'n': 1}, {'n': 2}])
+            results = vector_db.similarity_search('project deadline', top_k=2)
+            self.assertEqual(len(results), 2)
+            self.assertEqual(results[0]['metadata'], {'n': 0})
+            self.assertAlmostEqual(results[0]['similarity'], 1.0, places=4)
+
+
+class IncrementalIndexingTests(TestCase):
+    """Tests for keyed, idempotent RAG indexing."""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        account = EmailAccount.objects.create(email='idx@example.com', password='x', imap_server='imap.example.com')
+        bodies = ['the project deadline', 'budget meeting notes', 'product launch', 'design feedback']
+        self.emails = [
+            Email.objects.create(
+                account=account, message_id=f'idx-{i}@example.com', subject=f'Email {i}', sender='a@example.com',
+                recipient='b@example.com', body=body, received_date=timezone.now(), folder='INBOX',
+            )
+            for i, body in enumerate(bodies)
+        ]
+        self.path = tmp.name
+        settings_override = self.settings(VECTOR_DB_PATH=tmp.name, VECTOR_INDEX='hnsw')
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def index(self, runtime=None, **kwargs):
+        with use_runtime(runtime or EmbeddingRuntime('tiny', device='cpu', loader=tiny_model_loader())):
+            rag_service = RAGService()
+            count = rag_service.index_all_emails(**kwargs)
+            return count, rag_service
+
+    def test_reindex_only_pays_for_changes(self):
+        """Test that unchanged emails are skipped, changed ones replaced and deleted ones tombstoned."""
+        self.assertEqual(self.index()[0], 4)
+        count, rag_service = self.index()
+        self.assertEqual(count, 0)
+        self.assertEqual(rag_service.last_index_stats['unchanged'], 4)
+        self.assertEqual(rag_service.vector_db.store.count, 4)
+
+        # A category change keeps the text, so the stored vector is reused without the model
+        Email.objects.filter(id=self.emails[0].id).update(category='interested')
+        broken = EmbeddingRuntime('missing', device='cpu', loader=failing_loader([]))
+        self.assertEqual(self.index(broken)[0], 1)
+
+        Email.objects.filter(id=self.emails[1].id).update(body='the budget was approved')
+        self.emails[2].delete()
+        count, rag_service = self.index()
+        self.assertEqual(count, 1)
+        # The replaced and the deleted row are past VECTOR_COMPACT_DELETED_RATIO, so they are compacted away
+        self.assertEqual(rag_service.last_index_stats['deleted'], 1)
+        self.assertEqual(rag_service.last_index_stats['compacted'], 2)
+
+        vector_db = rag_service.vector_db
+        self.assertEqual(set(vector_db.indexed()), {self.emails[0].id, self.emails[1].id, self.emails[3].id})
+        self.assertEqual((vector_db.store.count, vector_db.store.deleted), (3, 0))
+        with use_runtime(EmbeddingRuntime('tiny', device='cpu', loader=tiny_model_loader())):
+            results = vector_db.similarity_search('product launch', top_k=10)
+        metadata = {r['metadata']['email_id']: r['metadata'] for r in results}
+        self.assertEqual(set(metadata), {self.emails[0].id, self.emails[1].id, self.emails[3].id})
+        self.assertEqual(metadata[self.emails[0].id]['category'], 'interested')
+
+    def test_index_email_only_looks_up_its_key(self):
+        """Test that indexing one email reads just its own row and reuses its vector."""
+        self.index()
+        email = Email.objects.get(id=self.emails[1].id)
+        email.category = 'interested'
+        with use_runtime(EmbeddingRuntime('missing', device='cpu', loader=failing_loader([]))):
+            rag_service = RAGService()
+            self.assertEqual(set(rag_service.vector_db.indexed([email.id])), {email.id})
+            self.assertTrue(rag_service.index_email(email))
+        self.assertEqual(rag_service.vector_db.indexed()[email.id][0], 4)
+
+    def test_migrated_vectors_are_reused(self):
+        """Test that migrate_vectors keys rows by email_id, so indexing afterwards embeds nothing."""
+        rag_service = RAGService()
+        documents = []
+        for email in self.emails:
+            text, metadata = rag_service._document(email)
+            documents.append({'text': text, 'embedding': [0.1] * 8, 'metadata': metadata})
+        # Rows written with older metadata keep their vector; only the record is rewritten
+        del documents[0]['metadata']['category']
+        with open(os.path.join(self.path, 'vectors.json'), 'w') as f:
+            json.dump(documents, f)
+        call_command('migrate_vectors', stdout=StringIO())
+
+        calls = []
+        count, rag_service = self.index(EmbeddingRuntime('missing', device='cpu', loader=failing_loader(calls)))
+        self.assertEqual((count, rag_service.last_index_stats['unchanged']), (1, 3))
+        self.assertEqual(calls, [])
+        self.assertEqual(set(rag_service.vector_db.indexed()), {email.id for email in self.emails})
+
+    def test_deleted_rows_are_hidden_from_search(self):
+        """Test that tombstoned rows below the compaction threshold never show up in results."""
+        self.index()
+        self.emails[2].delete()
+        with self.settings(VECTOR_COMPACT_DELETED_RATIO=0.5):
+            count, rag_service = self.index()
+        vector_db = rag_service.vector_db
+        self.assertEqual((vector_db.store.count, vector_db.store.deleted), (4, 1))
+        with use_runtime(EmbeddingRuntime('tiny', device='cpu', loader=tiny_model_loader())):
+            results = vector_db.similarity_search('product launch', top_k=10)
+        self.assertEqual(len(results), 3)
+        self.assertNotIn(self.emails[2].id, [r['metadata']['email_id'] for r in results])
+
+    def test_compact_command(self):
+        """Test that index_emails --compact drops replaced rows and search keeps working."""
+        self.index()
+        Email.objects.filter(id=self.emails[0].id).update(body='a new deadline')
+        out = StringIO()
+        with use_runtime(EmbeddingRuntime('tiny', device='cpu', loader=tiny_model_loader())):
+            call_command('index_emails', '--compact', stdout=out)
+            self.assertIn('Successfully indexed 1 emails', out.getvalue())
+            vector_db = VectorDBService()
+            self.assertEqual((vector_db.store.generation, vector_db.store.count, vector_db.store.deleted), (1, 4, 0))
+            results = vector_db.similarity_search('a new deadline', top_k=1)
+        self.assertEqual(results[0]['metadata']['email_id'], self.emails[0].id)
+        self.assertTrue(os.path.exists(vector_db.store.file('index.hnsw.faiss')))
@@ -12,5 +12,6 @@ urlpatterns = [
     path('app/accounts/', views.AccountListView.as_view(), name='account_list'),
     
     # API endpoints
+    path('api/ready/', views.ReadinessView.as_view(), name='ready'),
     path('api/', include(router.urls)),
 ] 
\ No newline at end of file
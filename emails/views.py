@@ -1,6 +1,9 @@
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
+from rest_framework.renderers import JSONRenderer, BrowsableAPIRenderer
 from rest_framework.response import Response
+from rest_framework.views import APIView
+from django.conf import settings
 from django.shortcuts import get_object_or_404, render
 from django.views.generic import TemplateView
 from django.views.decorators.csrf import csrf_exempt
@@ -11,12 +14,14 @@ from .serializers import (
     EmailSearchSerializer, EmailCategorySerializer,
     EmailReplySerializer
 )
-from .services.imap_service import IMAPService
 from .services.elasticsearch_service import ElasticsearchService
+from .services.embedding_runtime import EmbeddingRuntime, get_embedding_runtime
 from .services.ai_service import AIService
 from .services.notification_service import NotificationService
 from .services.rag_service import RAGService
+from .services.sync_service import SyncEngine
 from .services.vector_db_service import VectorDBService
+from .streaming import EventStreamRenderer, event_stream_response, sse_event
 from rest_framework.pagination import PageNumberPagination
 import asyncio
 import logging
@@ -35,24 +40,37 @@ class EmailAccountViewSet(viewsets.ModelViewSet):
     serializer_class = EmailAccountSerializer
 
     @action(detail=True, methods=['post'])
-    async def sync(self, request, pk=None):
-        """Manually trigger email synchronization for an account."""
+    def sync(self, request, pk=None):
+        """Manually sync every configured folder of an account, like fetch_emails does."""
         account = self.get_object()
-        
-        # Initialize services
-        imap_service = IMAPService(account)
-        
-        try:
-            # Start sync
-            await imap_service.fetch_recent_emails()
-            return Response({'status': 'sync started'})
-        except Exception as e:
+        engine = SyncEngine(lambda imap_service, batch: len(imap_service.save_emails(batch)))
+        result = engine.run([account])[0]
+        if result.status != 'ok':
             return Response(
-                {'error': str(e)},
+                {'status': result.status, 'error': result.error},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
-        finally:
-            await imap_service.stop()
+        return Response({
+            'status': result.status,
+            'fetched': result.fetched,
+            'processed': result.processed,
+            'folders': result.folders,
+        })
+
+class ReadinessView(APIView):
+    """Readiness probe: 503 while the embedding model is warming up or failed to load."""
+
+    def get(self, request):
+        embedding = get_embedding_runtime().status()
+        if embedding['state'] == EmbeddingRuntime.FAILED:
+            ready = False
+        else:
+            # Without warmup the model loads on first use, so not loaded yet is fine
+            ready = embedding['state'] == EmbeddingRuntime.READY or not settings.EMBEDDING_WARMUP
+        return Response(
+            {'ready': ready, 'embedding': embedding},
+            status=status.HTTP_200_OK if ready else status.HTTP_503_SERVICE_UNAVAILABLE
+        )
 
 class StandardResultsSetPagination(PageNumberPagination):
     page_size = 10
@@ -78,6 +96,13 @@ class EmailViewSet(viewsets.ReadOnlyModelViewSet):
             
         return queryset.order_by('-received_date')
 
+    def retrieve(self, request, *args, **kwargs):
+        """Return one email, downloading its full body if only a preview was synced."""
+        email = self.get_object()
+        email.ensure_full_body()
+        serializer = self.get_serializer(email)
+        return Response(serializer.data)
+
     @action(detail=False, methods=['post'])
     async def search(self, request):
         """Search emails using Elasticsearch."""
@@ -144,8 +169,8 @@ class EmailViewSet(viewsets.ReadOnlyModelViewSet):
         email = self.get_object()
         
         try:
-            # First check if we already have a reply suggestion
-            if email.reply_suggestion:
+            # First check if we already have a reply suggestion for the current category and prompt
+            if email.has_current_reply_suggestion():
                 serializer = EmailReplySerializer({'reply': email.reply_suggestion})
                 return Response(serializer.data)
             
@@ -167,13 +192,43 @@ class EmailViewSet(viewsets.ReadOnlyModelViewSet):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
             
+    @action(detail=True, methods=['get', 'post'],
+            renderer_classes=[EventStreamRenderer, JSONRenderer, BrowsableAPIRenderer])
+    def suggest_reply_stream(self, request, pk=None):
+        """Stream a reply suggestion as Server-Sent Events while it is generated.
+
+        `delta` events carry text as it arrives and a final `done` event the
+        whole reply, which is saved on the email. A saved suggestion is sent
+        straight away.
+        """
+        email = self.get_object()
+        if email.has_current_reply_suggestion():
+            events = [
+                sse_event('delta', {'text': email.reply_suggestion}),
+                sse_event('done', {'reply': email.reply_suggestion, 'cached': True}),
+            ]
+        else:
+            events = self._reply_events(email)
+        return event_stream_response(request, events)
+
+    def _reply_events(self, email):
+        parts = []
+        try:
+            for delta in RAGService().stream_reply_suggestion(email):
+                parts.append(delta)
+                yield sse_event('delta', {'text': delta})
+            yield sse_event('done', {'reply': ''.join(parts).strip(), 'cached': False})
+        except Exception as e:
+            logger.error(f"Error streaming reply suggestion: {e}")
+            yield sse_event('error', {'error': str(e)})
+
     @action(detail=False, methods=['post'])
     def index_for_rag(self, request):
         """Index all emails for RAG-based suggestions."""
         try:
             rag_service = RAGService()
             count = rag_service.index_all_emails()
-            return Response({'indexed_count': count})
+            return Response({'indexed_count': count, **rag_service.last_index_stats})
         except Exception as e:
             logger.error(f"Error indexing emails for RAG: {e}")
             return Response(